@@ -0,0 +1,19 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks for ente-tools.
+
+Run a benchmark with `python -m benchmarks.<name>`, e.g. `python -m benchmarks.bench_codec`.
+Pass `--json results.json` to save the results, and compare the results of two
+runs (e.g. of two commits) with `python -m benchmarks.compare base.json new.json`.
+"""
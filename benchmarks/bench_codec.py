@@ -0,0 +1,67 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare on-disk size and load time of local media for each storage codec."""
+
+import random
+import tempfile
+from pathlib import Path
+
+from sqlmodel import Session
+
+from benchmarks.common import Result, measure, parser, report
+from benchmarks.fixtures import make_media
+from ente_tools.db.codec import CODECS
+from ente_tools.db.models import MediaDB
+from ente_tools.db.sqlite import SQLiteBackend
+
+
+def main() -> None:
+    """Run the benchmark."""
+    p = parser(__doc__ or "")
+    p.add_argument("--count", type=int, default=20_000, help="number of media rows")
+    args = p.parse_args()
+
+    rng = random.Random(0)  # noqa: S311
+    media = [make_media(i, rng) for i in range(args.count)]
+
+    results: list[Result] = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in [None, *CODECS]:
+            db_path = Path(tmpdir) / f"{name}.db"
+            backend = SQLiteBackend(db_path=str(db_path), codec=name)
+            with Session(backend.engine) as session:
+                for m in media:
+                    db_media = MediaDB(fullpath=m.media.file.fullpath)
+                    backend._store_media(db_media, m)  # noqa: SLF001
+                    session.add(db_media)
+                session.commit()
+            backend.compact()
+
+            result = measure(
+                f"get_local_media[{name or 'column'}]",
+                backend.get_local_media,
+                items=args.count,
+                repeat=args.repeat,
+            )
+            result.extra["db_bytes"] = db_path.stat().st_size
+            results.append(result)
+
+    for r in results:
+        print(f"{r.name:40s} {r.extra['db_bytes'] / 1e6:10.1f} MB {r.seconds:8.2f}s")  # noqa: T201
+
+    report("codec", results, args.json)
+
+
+if __name__ == "__main__":
+    main()
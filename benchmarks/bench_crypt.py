@@ -0,0 +1,129 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure the throughput of decrypting metadata, collections, files and file streams.
+
+All fixtures are encrypted locally, so no server is needed.
+"""
+
+import random
+import tempfile
+from base64 import urlsafe_b64decode
+from pathlib import Path
+
+from benchmarks.common import Result, measure, parser, report
+from benchmarks.fixtures import (
+    make_encrypted_collection,
+    make_encrypted_file,
+    make_keys,
+    make_stream_file,
+    use_memory_keyring,
+)
+from ente_tools.api.core.ente_crypt import CHUNK_SIZE, decrypt_blob, decrypt_stream_to_file
+from ente_tools.api.core.types_collection import EncryptedCollection
+from ente_tools.api.core.types_file import decrypt_metadata, metadata_cache
+
+
+def main() -> None:
+    """Run the benchmark."""
+    p = parser(__doc__ or "")
+    p.add_argument("--files", type=int, default=20_000, help="number of files")
+    p.add_argument("--collections", type=int, default=200, help="number of collections")
+    p.add_argument("--metadata-size", type=int, default=1024, help="size of the metadata of each file")
+    p.add_argument("--chunks", type=int, default=100, help="number of 4 MB chunks in the stream")
+    args = p.parse_args()
+
+    use_memory_keyring()
+    rng = random.Random(0)  # noqa: S311
+    keys = make_keys(rng)
+
+    collections = [make_encrypted_collection(i, keys, rng) for i in range(1, args.collections + 1)]
+    (collection, collection_key) = collections[0]
+    files = [
+        make_encrypted_file(i, collection.id, collection_key, rng, metadata_size=args.metadata_size)
+        for i in range(args.files)
+    ]
+    file_keys = [f.file_key(collection_key) for f in files]
+    blobs = [
+        (urlsafe_b64decode(f.metadata.encrypted_data or ""), urlsafe_b64decode(f.metadata.decryption_header))
+        for f in files
+    ]
+    metadata_bytes = sum(len(data) for (data, _) in blobs)
+
+    def decrypt_blobs() -> None:
+        for (data, header), key in zip(blobs, file_keys, strict=True):
+            decrypt_blob(data, header, key)
+
+    def decrypt_files() -> None:
+        converted = [f.to_file() for f in files]
+        for f in converted:
+            f.bind_key(lambda f: f.file_key(collection_key))
+        metadata_cache.clear()
+        decrypt_metadata(converted)
+
+    results: list[Result] = [
+        measure("decrypt_blob[metadata]", decrypt_blobs, items=args.files, nbytes=metadata_bytes, repeat=args.repeat),
+        measure(
+            "EncryptedFile.to_file",
+            lambda: [f.to_file() for f in files],
+            items=args.files,
+            repeat=args.repeat,
+        ),
+        measure(
+            "EncryptedFile.to_file+metadata",
+            decrypt_files,
+            items=args.files,
+            nbytes=metadata_bytes,
+            repeat=args.repeat,
+        ),
+        measure(
+            "EncryptedCollection.to_collection",
+            lambda: [c.to_collection(keys) for (c, _) in collections],
+            items=args.collections,
+            repeat=args.repeat,
+        ),
+        measure(
+            "EncryptedCollection.to_collections",
+            lambda: EncryptedCollection.to_collections([c for (c, _) in collections], keys),
+            items=args.collections,
+            repeat=args.repeat,
+        ),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = Path(tmpdir) / "encrypted"
+        dest = Path(tmpdir) / "decrypted"
+        key = rng.randbytes(32)
+        header = make_stream_file(src, key, rng, args.chunks)
+        stream_bytes = src.stat().st_size
+
+        def decrypt_stream() -> None:
+            with decrypt_stream_to_file(dest, key, header) as handle, src.open("rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    handle(chunk)
+
+        results.append(
+            measure(
+                "decrypt_stream_to_file",
+                decrypt_stream,
+                items=args.chunks,
+                nbytes=stream_bytes,
+                repeat=args.repeat,
+            ),
+        )
+
+    report("crypt", results, args.json)
+
+
+if __name__ == "__main__":
+    main()
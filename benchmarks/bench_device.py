@@ -0,0 +1,76 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare the per-item cost of device-key secrets with a new or a reused SecretBox."""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from nacl.secret import SecretBox
+from nacl.utils import random
+
+from benchmarks.common import Result, measure, parser, report
+from ente_tools.api.core.device import DeviceCrypto
+from ente_tools.api.core.types_crypt import SecretPair
+
+
+def main() -> None:
+    """Run the benchmark."""
+    p = parser(__doc__ or "")
+    p.add_argument("--count", type=int, default=50_000, help="number of secrets")
+    args = p.parse_args()
+
+    key = random(SecretBox.KEY_SIZE)
+    msgs = [random(SecretBox.KEY_SIZE) for _ in range(args.count)]
+    crypto = DeviceCrypto(key)
+    secrets = [SecretPair(encrypted=e, nonce=n) for (e, n) in crypto.encrypt_many(msgs)]
+    nbytes = args.count * SecretBox.KEY_SIZE
+
+    def encrypt_new_box() -> None:
+        # As each secret was encrypted before: a new box, nonce and encoding per call
+        for msg in msgs:
+            nonce = random(SecretBox.NONCE_SIZE)
+            urlsafe_b64encode(SecretBox(key).encrypt(msg, nonce).ciphertext)
+            urlsafe_b64encode(nonce)
+
+    def decrypt_new_box() -> None:
+        for s in secrets:
+            SecretBox(key).decrypt(urlsafe_b64decode(s.encrypted), nonce=urlsafe_b64decode(s.nonce))
+
+    def encrypt_each() -> None:
+        for msg in msgs:
+            crypto.encrypt(msg)
+
+    def decrypt_each() -> None:
+        for s in secrets:
+            crypto.decrypt(s)
+
+    results: list[Result] = [
+        measure(name, f, items=args.count, nbytes=nbytes, repeat=args.repeat)
+        for (name, f) in (
+            ("encrypt[new box]", encrypt_new_box),
+            ("encrypt[reused box]", encrypt_each),
+            ("encrypt_many", lambda: crypto.encrypt_many(msgs)),
+            ("decrypt[new box]", decrypt_new_box),
+            ("decrypt[reused box]", decrypt_each),
+            ("decrypt_many", lambda: crypto.decrypt_many(secrets)),
+        )
+    ]
+
+    for r in results:
+        print(f"{r.name:40s} {r.seconds / r.items * 1e6:8.2f} us/item")  # noqa: T201
+
+    report("device", results, args.json)
+
+
+if __name__ == "__main__":
+    main()
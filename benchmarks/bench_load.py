@@ -0,0 +1,118 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare validated and trusted loading of stored media rows and account files."""
+
+import json
+import random
+import tempfile
+from pathlib import Path
+
+from sqlmodel import Session
+
+from benchmarks.common import Result, measure, parser, report
+from benchmarks.fixtures import make_file, make_media
+from ente_tools.api.core.account import EnteAccount
+from ente_tools.api.photo.file_metadata import Media
+from ente_tools.db.models import MediaDB
+from ente_tools.db.sqlite import SQLiteBackend
+from ente_tools.db.trusted import construct
+
+ACCOUNT = {
+    "email": "bench@example.com",
+    "attributes": {
+        "srpUserID": "user",
+        "srpSalt": "salt",
+        "memLimit": 1,
+        "opsLimit": 1,
+        "kekSalt": "salt",
+        "isEmailMFAEnabled": False,
+    },
+    "auth_response": {
+        "id": 1,
+        "keyAttributes": {
+            "kekSalt": "salt",
+            "encryptedKey": "key",
+            "keyDecryptionNonce": "nonce",
+            "publicKey": "key",
+            "encryptedSecretKey": "key",
+            "secretKeyDecryptionNonce": "nonce",
+            "memLimit": 1,
+            "opsLimit": 1,
+        },
+        "encryptedToken": "token",
+    },
+    "encrypted_keys": {
+        "user_id": 1,
+        "master_key": {"encrypted": "key", "nonce": "nonce"},
+        "secret_key": {"encrypted": "key", "nonce": "nonce"},
+        "token": {"encrypted": "key", "nonce": "nonce"},
+        "public_key": "key",
+    },
+    "collections": [],
+}
+
+
+def main() -> None:
+    """Run the benchmark."""
+    p = parser(__doc__ or "")
+    p.add_argument("--media", type=int, default=100_000, help="number of media rows")
+    p.add_argument("--files", type=int, default=300_000, help="number of files in the account")
+    p.add_argument("--collections", type=int, default=50, help="number of collections in the account")
+    args = p.parse_args()
+
+    rng = random.Random(0)  # noqa: S311
+    results: list[Result] = []
+
+    # Decoded rows, as returned by the storage codec
+    media = [json.loads(json.dumps(make_media(i, rng).model_dump())) for i in range(args.media)]
+    results.append(
+        measure("media[validate]", lambda: [Media(**m) for m in media], items=args.media, repeat=args.repeat),
+    )
+    results.append(
+        measure("media[trusted]", lambda: [construct(Media, m) for m in media], items=args.media, repeat=args.repeat),
+    )
+
+    account = ACCOUNT | {
+        "files": json.loads(
+            json.dumps(
+                {
+                    c: [make_file(i, c, rng).model_dump(by_alias=True) for i in range(c, args.files, args.collections)]
+                    for c in range(args.collections)
+                },
+            ),
+        ),
+    }
+    results.append(measure("account[validate]", lambda: EnteAccount(**account), items=args.files, repeat=args.repeat))
+    results.append(
+        measure("account[trusted]", lambda: construct(EnteAccount, account), items=args.files, repeat=args.repeat),
+    )
+
+    # End to end through the backend
+    with tempfile.TemporaryDirectory() as tmpdir:
+        backend = SQLiteBackend(db_path=str(Path(tmpdir) / "bench.db"), codec="msgpack")
+        with Session(backend.engine) as session:
+            for m in media:
+                db_media = MediaDB(fullpath=m["media"]["file"]["fullpath"])
+                backend._store_media(db_media, construct(Media, m))  # noqa: SLF001
+                session.add(db_media)
+            session.commit()
+        backend.add_account(construct(EnteAccount, account))
+        results.append(measure("get_local_media", backend.get_local_media, items=args.media, repeat=args.repeat))
+        results.append(measure("get_accounts", backend.get_accounts, items=args.files, repeat=args.repeat))
+
+    report("load", results, args.json)
+
+
+if __name__ == "__main__":
+    main()
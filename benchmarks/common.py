@@ -0,0 +1,128 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shared helpers for timing benchmarks and reporting results."""
+
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Result:
+    """The result of a single benchmark."""
+
+    name: str
+    """The name of the benchmark."""
+    items: int
+    """The number of items processed per run."""
+    seconds: float
+    """The best wall time of a run."""
+    nbytes: int = 0
+    """The number of bytes processed per run."""
+    extra: dict[str, Any] = field(default_factory=dict)
+    """Additional benchmark-specific values (e.g. sizes)."""
+
+    @property
+    def items_per_sec(self) -> float:
+        """Items processed per second."""
+        return self.items / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_sec(self) -> float:
+        """Megabytes processed per second."""
+        return self.nbytes / self.seconds / 1e6 if self.seconds else 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert to a dictionary including the derived rates."""
+        return asdict(self) | {"items_per_sec": self.items_per_sec, "mb_per_sec": self.mb_per_sec}
+
+
+def measure(name: str, f: Callable[[], Any], *, items: int, nbytes: int = 0, repeat: int = 3) -> Result:
+    """Time a function, keeping the best of several runs.
+
+    Args:
+        name: The name of the benchmark.
+        f: The function to time.
+        items: The number of items processed by each call of `f`.
+        nbytes: The number of bytes processed by each call of `f`.
+        repeat: The number of runs.
+
+    Returns:
+        The result of the fastest run.
+
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    result = Result(name=name, items=items, seconds=best, nbytes=nbytes)
+    log.info(
+        "%-40s %10.4fs %12.0f items/s %10.1f MB/s",
+        name,
+        result.seconds,
+        result.items_per_sec,
+        result.mb_per_sec,
+    )
+    return result
+
+
+def git_commit() -> str:
+    """Return the current git commit, if available."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def parser(description: str) -> argparse.ArgumentParser:
+    """Create an argument parser with the options common to all benchmarks."""
+    logging.basicConfig(level="INFO", format="%(message)s")
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument("--json", type=Path, default=None, help="write machine-readable results to this file")
+    p.add_argument("--repeat", type=int, default=3, help="number of runs per benchmark (best is kept)")
+    return p
+
+
+def report(benchmark: str, results: list[Result], json_path: Path | None) -> None:
+    """Write the results as JSON, tagged with the commit and platform, if requested."""
+    if json_path is None:
+        return
+    json_path.write_text(
+        json.dumps(
+            {
+                "benchmark": benchmark,
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": [r.to_dict() for r in results],
+            },
+            indent=2,
+        ),
+    )
+    log.info("Wrote %s", json_path)
@@ -0,0 +1,60 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare two JSON results of a benchmark, e.g. from two commits, and flag regressions."""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any
+
+
+def load(path: Path) -> tuple[dict[str, Any], dict[str, dict[str, Any]]]:
+    """Load a JSON result file, returning its header and results by name."""
+    data = json.loads(path.read_text())
+    return (data, {r["name"]: r for r in data["results"]})
+
+
+def main() -> None:
+    """Compare the results."""
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("base", type=Path, help="results to compare against")
+    p.add_argument("new", type=Path, help="new results")
+    p.add_argument("--threshold", type=float, default=0.10, help="slowdown treated as a regression")
+    args = p.parse_args()
+
+    (base_header, base) = load(args.base)
+    (new_header, new) = load(args.new)
+    print(f"{base_header['benchmark']}: {base_header['commit'] or '?'} -> {new_header['commit'] or '?'}")  # noqa: T201
+
+    regressions = 0
+    for name, r in new.items():
+        b = base.get(name)
+        if b is None or not b["items_per_sec"]:
+            print(f"{name:40s} {r['items_per_sec']:12.0f} items/s (new)")  # noqa: T201
+            continue
+        ratio = r["items_per_sec"] / b["items_per_sec"]
+        flag = ""
+        if ratio < 1 - args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(  # noqa: T201
+            f"{name:40s} {b['items_per_sec']:12.0f} -> {r['items_per_sec']:12.0f} items/s {ratio:6.2f}x{flag}",
+        )
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
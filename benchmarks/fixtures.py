@@ -0,0 +1,232 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Synthetic records resembling those produced by scanning and refreshing a library."""
+
+import json
+import random
+from base64 import urlsafe_b64encode
+from pathlib import Path
+from typing import Any
+
+import keyring
+import keyring.backend
+from nacl.public import PrivateKey
+from nacl.secret import SecretBox
+
+from ente_tools.api.core.ente_crypt import StreamEncryptionSize, encrypt_blob, encrypt_stream
+from ente_tools.api.core.types_collection import EncryptedCollection, MagicMetadata
+from ente_tools.api.core.types_crypt import EnteKeys
+from ente_tools.api.core.types_file import EncryptedFile, File, FileAttributes, FileInfo
+from ente_tools.api.photo.file_metadata import Media
+from ente_tools.api.photo.loader import NewImageFile, NewXMPDiskFile
+from ente_tools.api.photo.local_file import NewLocalDiskFile
+
+XMP_KEYS = [
+    "XMP:{adobe:ns:meta/}xmpmeta:{http://www.w3.org/1999/02/22-rdf-syntax-ns#}RDF:"
+    f"{{http://www.w3.org/1999/02/22-rdf-syntax-ns#}}Description:{{http://ns.adobe.com/{ns}/1.0/}}{key}"
+    for ns in ("xap", "exif", "tiff", "photoshop", "camera-raw-settings")
+    for key in ("Rating", "CreateDate", "ModifyDate", "Make", "Model", "Lens", "Exposure", "Label")
+]
+EXIF_KEYS = [
+    f"{prefix}:{key}"
+    for prefix in ("Base", "Extra", "GPS")
+    for key in ("Make", "Model", "DateTime", "Orientation", "XResolution", "FNumber", "ISOSpeedRatings", "Software")
+]
+
+
+def b64(data: bytes) -> str:
+    """Encode bytes as the API does."""
+    return str(urlsafe_b64encode(data), "utf-8")
+
+
+def make_media(i: int, rng: random.Random) -> Media:
+    """Create a synthetic image with EXIF and XMP metadata and an XMP sidecar."""
+    path = f"/photos/{2000 + i % 25}/{i % 12 + 1:02d}/IMG_{i:07d}.JPG"
+    metadata = {k: str(rng.randint(0, 10_000)) for k in XMP_KEYS + EXIF_KEYS}
+    return Media(
+        media=NewImageFile(
+            file=NewLocalDiskFile(
+                mime_type="image/jpeg",
+                fullpath=path,
+                st_mtime_ns=1_600_000_000_000_000_000 + i,
+                size=rng.randint(1_000_000, 10_000_000),
+            ),
+            hash=rng.randbytes(64).hex(),
+            data_hash=rng.randbytes(32).hex(),
+            metadata=metadata,
+        ),
+        xmp_sidecar=NewXMPDiskFile(
+            file=NewLocalDiskFile(mime_type=None, fullpath=path + ".xmp", st_mtime_ns=i, size=4096),
+            metadata={k: str(rng.randint(0, 10)) for k in XMP_KEYS[:10]},
+        ),
+    )
+
+
+def make_file(i: int, collection_id: int, rng: random.Random) -> File:
+    """Create a synthetic remote file, with metadata encrypted with a random key."""
+
+    def encrypt(obj: dict[str, Any]) -> tuple[str, str]:
+        (data, header) = encrypt_blob(json.dumps(obj).encode(), key)
+        return (b64(data), b64(header))
+
+    key = rng.randbytes(32)
+    (metadata, metadata_header) = encrypt(
+        {
+            "title": f"IMG_{i:07d}.JPG",
+            "creationTime": 1_600_000_000_000_000 + i,
+            "modificationTime": 1_600_000_000_000_000 + i,
+            "hash": b64(rng.randbytes(64)),
+            "fileType": 0,
+            "deviceFolder": "Camera",
+        },
+    )
+    (pub_magic, pub_magic_header) = encrypt({"editedTime": 1_700_000_000_000_000 + i})
+    return File(
+        id=i,
+        owner_id=1,
+        encrypted_key=b64(rng.randbytes(48)),
+        key_decryption_nonce=b64(rng.randbytes(24)),
+        collection_id=collection_id,
+        collection_owner_id=1,
+        file=FileAttributes(decryptionHeader=b64(rng.randbytes(24))),
+        thumbnail=FileAttributes(decryptionHeader=b64(rng.randbytes(24))),
+        enc_metadata=FileAttributes(encryptedData=metadata, decryptionHeader=metadata_header),
+        is_deleted=False,
+        update_time=1_700_000_000_000_000 + i,
+        enc_pub_magic_metadata=MagicMetadata(version=1, count=1, data=pub_magic, header=pub_magic_header),
+        info=FileInfo(fileSize=rng.randint(1_000_000, 10_000_000), thumbSize=rng.randint(10_000, 100_000)),
+    )
+
+
+class MemoryKeyring(keyring.backend.KeyringBackend):
+    """A keyring holding passwords in memory, so benchmarks never touch the user's keyring."""
+
+    priority = 1.0  # pyright: ignore [reportAssignmentType]
+
+    def __init__(self) -> None:
+        """Initialise an empty keyring."""
+        super().__init__()
+        self._passwords: dict[tuple[str, str], str] = {}
+
+    def set_password(self, service: str, username: str, password: str) -> None:
+        """Store a password."""
+        self._passwords[(service, username)] = password
+
+    def get_password(self, service: str, username: str) -> str | None:
+        """Return a stored password."""
+        return self._passwords.get((service, username))
+
+    def delete_password(self, service: str, username: str) -> None:
+        """Remove a stored password."""
+        self._passwords.pop((service, username), None)
+
+
+def use_memory_keyring() -> None:
+    """Keep the device key generated by the benchmark in memory."""
+    keyring.set_keyring(MemoryKeyring())
+
+
+def make_keys(rng: random.Random) -> EnteKeys:
+    """Create the keys of an account."""
+    private_key = PrivateKey(rng.randbytes(32))
+    return EnteKeys(
+        user_id=1,
+        master_key=rng.randbytes(SecretBox.KEY_SIZE),
+        secret_key=bytes(private_key),
+        token=rng.randbytes(32),
+        public_key=bytes(private_key.public_key),
+    )
+
+
+def make_encrypted_collection(i: int, keys: EnteKeys, rng: random.Random) -> tuple[EncryptedCollection, bytes]:
+    """Create a collection owned by the account, as received from the server, and its key."""
+    key = rng.randbytes(SecretBox.KEY_SIZE)
+    nonce = rng.randbytes(SecretBox.NONCE_SIZE)
+    (magic, magic_header) = encrypt_blob(json.dumps({"subType": 0, "visibility": 0}).encode(), key)
+    collection = EncryptedCollection.model_validate(
+        {
+            "id": i,
+            "owner": {"id": keys.user_id, "email": "owner@example.com", "role": "OWNER"},
+            "encryptedKey": b64(SecretBox(keys.master_key).encrypt(key, nonce).ciphertext),
+            "keyDecryptionNonce": b64(nonce),
+            "name": f"Album {i}",
+            "type": "album",
+            "sharees": [],
+            "updationTime": 1_700_000_000_000_000 + i,
+            "magicMetadata": {"version": 1, "count": 2, "data": b64(magic), "header": b64(magic_header)},
+        },
+    )
+    return (collection, key)
+
+
+def make_encrypted_file(
+    i: int,
+    collection_id: int,
+    collection_key: bytes,
+    rng: random.Random,
+    metadata_size: int = 1024,
+) -> EncryptedFile:
+    """Create a file as received from the server, with about `metadata_size` bytes of metadata."""
+    key = rng.randbytes(SecretBox.KEY_SIZE)
+    nonce = rng.randbytes(SecretBox.NONCE_SIZE)
+    metadata = {
+        "title": f"IMG_{i:07d}.JPG",
+        "creationTime": 1_600_000_000_000_000 + i,
+        "modificationTime": 1_600_000_000_000_000 + i,
+        "hash": b64(rng.randbytes(64)),
+        "fileType": 0,
+        "deviceFolder": "Camera",
+    }
+    padding = max(0, metadata_size - len(json.dumps(metadata)) - 12)
+    metadata["comment"] = "x" * padding
+    (data, header) = encrypt_blob(json.dumps(metadata).encode(), key)
+    return EncryptedFile.model_validate(
+        {
+            "id": i,
+            "ownerID": 1,
+            "collectionID": collection_id,
+            "collectionOwnerID": 1,
+            "encryptedKey": b64(SecretBox(collection_key).encrypt(key, nonce).ciphertext),
+            "keyDecryptionNonce": b64(nonce),
+            "file": {"decryptionHeader": b64(rng.randbytes(24))},
+            "thumbnail": {"decryptionHeader": b64(rng.randbytes(24))},
+            "metadata": {"encryptedData": b64(data), "decryptionHeader": b64(header)},
+            "isDeleted": False,
+            "updationTime": 1_700_000_000_000_000 + i,
+            "info": {"fileSize": rng.randint(1_000_000, 10_000_000), "thumbSize": rng.randint(10_000, 100_000)},
+        },
+    )
+
+
+def make_stream_file(
+    path: Path,
+    key: bytes,
+    rng: random.Random,
+    chunks: int,
+    chunk_size: int = StreamEncryptionSize,
+) -> bytes:
+    """Write an encrypted file of `chunks` chunks of random data, as stored by the server.
+
+    The same random plaintext is used for every chunk, as each chunk encrypts differently.
+
+    Returns:
+        The stream header.
+
+    """
+    plaintext = rng.randbytes(chunk_size)
+    (header, encrypted) = encrypt_stream(key, iter([plaintext] * chunks))
+    with path.open("wb") as f:
+        for c in encrypted:
+            f.write(c)
+    return header
@@ -15,16 +15,22 @@
 
 import getpass
 import logging
-from collections.abc import Callable
+import threading
+from collections.abc import Callable, Mapping
+from collections.abc import Set as AbstractSet
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager
 from datetime import UTC, datetime
+from typing import Any, Protocol
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, PrivateAttr
 
 from ente_tools.api.core.api import EnteAPI, EnteAPIError
-from ente_tools.api.core.device import get_device_key
-from ente_tools.api.core.types_collection import Collection
+from ente_tools.api.core.device import device_crypto
+from ente_tools.api.core.key_cache import KeyCache
+from ente_tools.api.core.types_collection import Collection, EncryptedCollection
 from ente_tools.api.core.types_crypt import AuthorizationResponse, EnteEncKeys, EnteKeys, SPRAttributes
-from ente_tools.api.core.types_file import File
+from ente_tools.api.core.types_file import File, decrypt_metadata
 
 log = logging.getLogger(__name__)
 
@@ -52,6 +58,82 @@ def retry[T](f: Callable[[], T], onretry: Callable[[], None] | None = None, retr
     return f()
 
 
+class RefreshSink(Protocol):
+    """Persists the results of a refresh as they are fetched.
+
+    A refresh saves each page of files as soon as it is decrypted, together with
+    the collection's file cursor, so an interrupted refresh resumes from the last
+    saved page. The collection itself is saved once all its files are, and the
+    collections cursor once all collections are. A forced refresh saves over the
+    stored collections and files, and only removes those it did not fetch once
+    it completes, so an interrupted one keeps the stored catalog.
+    """
+
+    def save_files(self, collection_id: int, files: list[File], cursor: int) -> None:
+        """Save a page of files of a collection and the file cursor after the page."""
+        ...
+
+    def save_collection(self, collection: Collection) -> None:
+        """Save a fully synchronized collection."""
+        ...
+
+    def save_collections_cursor(self, cursor: int) -> None:
+        """Save the cursor for fetching collections once all collections are saved."""
+        ...
+
+    def retain(self, files: Mapping[int, AbstractSet[int]]) -> None:
+        """Remove the collections, files and file cursors of the account that a full refresh did not fetch.
+
+        Args:
+            files: The IDs of the files fetched, by the ID of their collection.
+
+        """
+        ...
+
+
+class FetchedFiles(RefreshSink):
+    """Passes the results of a refresh to a sink, recording the files fetched."""
+
+    def __init__(self, sink: RefreshSink) -> None:
+        """Record the results passed to the sink."""
+        self.sink = sink
+        self.files: dict[int, set[int]] = {}
+        """The IDs of the files fetched, by the ID of their collection."""
+
+    def save_files(self, collection_id: int, files: list[File], cursor: int) -> None:
+        """Save a page of files of a collection and the file cursor after the page."""
+        self.sink.save_files(collection_id, files, cursor)
+        self.files.setdefault(collection_id, set()).update(f.id for f in files)
+
+    def save_collection(self, collection: Collection) -> None:
+        """Save a fully synchronized collection."""
+        self.sink.save_collection(collection)
+        self.files.setdefault(collection.id, set())
+
+    def save_collections_cursor(self, cursor: int) -> None:
+        """Save the cursor for fetching collections once all collections are saved."""
+        self.sink.save_collections_cursor(cursor)
+
+    def retain(self, files: Mapping[int, AbstractSet[int]]) -> None:
+        """Remove the collections, files and file cursors of the account that a full refresh did not fetch."""
+        self.sink.retain(files)
+
+
+class AccountSummary(BaseModel):
+    """Summary of an account that does not require loading its files."""
+
+    email: str
+    """The email address associated with the account."""
+    user_id: int
+    """The Ente user ID of the account."""
+    collections: int
+    """The number of collections in the account."""
+    files: int
+    """The number of files in the account, across all collections."""
+    update_time: int
+    """The latest update time of the collections, in microseconds since the epoch."""
+
+
 class EnteAccount(BaseModel):
     """Represents an authenticated Ente account.
 
@@ -72,6 +154,33 @@ class EnteAccount(BaseModel):
     """The list of collections in the account."""
     files: dict[int, list[File]]
     """The files in the account, organized by collection ID."""
+    file_cursors: dict[int, int] = Field(default_factory=dict)
+    """The latest update time of the files fetched for each collection, to fetch file diffs since."""
+    collections_cursor: int = 0
+    """The update time to fetch collections since, advanced once a refresh completes."""
+
+    _key_cache: KeyCache = PrivateAttr(default_factory=KeyCache)
+
+    def model_post_init(self, context: Any, /) -> None:  # noqa: ANN401, ARG002
+        """Bind the files to the account's keys, to decrypt their metadata on demand."""
+        for files in self.files.values():
+            for f in files:
+                f.bind_key(self.file_key)
+
+    def summary(self) -> AccountSummary:
+        """Summarise the account.
+
+        Returns:
+            The AccountSummary of the account.
+
+        """
+        return AccountSummary(
+            email=self.email,
+            user_id=self.encrypted_keys.user_id,
+            collections=len(self.collections),
+            files=sum(len(files) for files in self.files.values()),
+            update_time=max((c.update_time for c in self.collections), default=0),
+        )
 
     def keys(self) -> EnteKeys:
         """Retrieve the decrypted Ente keys for the account.
@@ -82,7 +191,45 @@ class EnteAccount(BaseModel):
             The decrypted EnteKeys.
 
         """
-        return self.encrypted_keys.to_keys(get_device_key())
+        return self.encrypted_keys.to_keys(device_crypto())
+
+    def collection(self, collection_id: int) -> Collection:
+        """Find a collection of the account.
+
+        Args:
+            collection_id: The ID of the collection.
+
+        Returns:
+            The collection.
+
+        Raises:
+            KeyError: If the account has no such collection.
+
+        """
+        for c in self.collections:
+            if c.id == collection_id:
+                return c
+        raise KeyError(collection_id)
+
+    def file_key(self, file: File) -> bytes:
+        """Decrypt the key of a file of the account.
+
+        The key is decrypted with the key of the file's collection, and both are
+        cached for later calls.
+
+        Args:
+            file: A file of the account.
+
+        Returns:
+            The decrypted file key.
+
+        """
+        return self._key_cache.file_key(file, self.collection)
+
+    def preload_metadata(self) -> AbstractContextManager[None]:
+        """Decrypt the metadata of all files of the account up front, keeping it cached while in the context."""
+        self._key_cache.add_collections(self.collections)
+        return decrypt_metadata([f for files in self.files.values() for f in files])
 
     @staticmethod
     def authenticate(api: EnteAPI, email: str) -> "EnteAccount":
@@ -120,28 +267,114 @@ class EnteAccount(BaseModel):
             email=email,
             attributes=attributes,
             auth_response=auth_response,
-            encrypted_keys=EnteEncKeys.from_keys(get_device_key(), keys),
+            encrypted_keys=EnteEncKeys.from_keys(device_crypto(), keys),
             collections=[],
             files={},
         )
 
-    def refresh(self, api: EnteAPI, *, force_refresh: bool = False) -> None:
+    def save_files(self, collection_id: int, files: list[File], cursor: int) -> None:
+        """Save a page of files of a collection and the file cursor after the page."""
+        fmap = {f.id: f for f in self.files.get(collection_id, [])}
+        for f in files:
+            f.bind_key(self.file_key)
+            fmap[f.id] = f
+        self.files[collection_id] = list(fmap.values())
+        self.file_cursors[collection_id] = cursor
+
+    def save_collection(self, collection: Collection) -> None:
+        """Save a fully synchronized collection."""
+        self.collections = [c for c in self.collections if c.id != collection.id] + [collection]
+        self.files.setdefault(collection.id, [])
+
+    def save_collections_cursor(self, cursor: int) -> None:
+        """Save the cursor for fetching collections once all collections are saved."""
+        self.collections_cursor = cursor
+
+    def retain(self, files: Mapping[int, AbstractSet[int]]) -> None:
+        """Remove the collections, files and file cursors of the account that a full refresh did not fetch."""
+        self.collections = [c for c in self.collections if c.id in files]
+        self.files = {
+            collection_id: [f for f in collection_files if f.id in files[collection_id]]
+            for collection_id, collection_files in self.files.items()
+            if collection_id in files
+        }
+        self.file_cursors = {k: v for k, v in self.file_cursors.items() if k in files}
+
+    @staticmethod
+    def _refresh_collection(
+        api: EnteAPI,
+        sink: RefreshSink,
+        sink_lock: threading.Lock,
+        c: Collection,
+        file_update_time: int,
+    ) -> None:
+        """Fetch the files of a collection updated since a time, page by page, then save the collection."""
+        log.debug("Requesting files of collection %d since %d", c.id, file_update_time)
+
+        has_more = True
+        while has_more:
+            (files, has_more) = api.get_files(since=file_update_time, collection_id=c.id)
+            for f in files:
+                file_update_time = max(f.update_time, file_update_time)
+            decrypted = [f.to_file() for f in files]
+            with sink_lock:
+                sink.save_files(c.id, decrypted, file_update_time)
+
+        # Save it
+        with sink_lock:
+            sink.save_collection(c)
+
+    def refresh(
+        self,
+        api: EnteAPI,
+        *,
+        force_refresh: bool = False,
+        sink: RefreshSink | None = None,
+        workers: int = 1,
+        progress: Callable[[int, int], None] | None = None,
+    ) -> None:
         """Refresh the account's collections and files from the Ente API.
 
         This method synchronizes the local state of the account with the remote
         state on the Ente servers. It fetches updated collections and files,
-        decrypts them, and updates the local data structures.
+        decrypts them, and saves each page of files to the sink as it arrives.
+
+        The account itself only provides the state to resume from; the results
+        are saved to the sink, which defaults to the account itself.
+
+        The pages of a collection are fetched in order, but collections are
+        fetched concurrently by up to `workers` threads, bounded further by the
+        API's concurrency controller if it has one. Calls to the sink are
+        serialized.
 
         Args:
             api: The EnteAPI client.
             force_refresh: If True, forces a full refresh, ignoring any
-                previous update times.
+                previous update times, and replaces the stored collections and
+                files once it completes.
+            sink: Where to save the refreshed collections and files.
+            workers: The maximum number of collections fetched concurrently.
+            progress: Called with the number of collections refreshed and the total
+                after each collection.
 
         Raises:
             EnteAPIError: If there is an error communicating with the Ente API.
 
         """
-        cmap = {c.id: c for c in self.collections} if not force_refresh else {}
+        if sink is None:
+            sink = self
+
+        # A forced refresh replaces the stored files by those it fetched once it completes
+        fetched: FetchedFiles | None = None
+        if force_refresh:
+            sink = fetched = FetchedFiles(sink)
+            cmap: dict[int, Collection] = {}
+            file_cursors: dict[int, int] = {}
+            update_time = 0
+        else:
+            cmap = {c.id: c for c in self.collections}
+            file_cursors = dict(self.file_cursors)
+            update_time = self.collections_cursor
 
         # Fetch the clear-text keys (in-memory only)
         keys = self.keys()
@@ -149,47 +382,41 @@ class EnteAccount(BaseModel):
         # Set the token for the API
         api.set_token(keys.token)
 
-        # Find the last update time
-        update_time = 0
-        if not force_refresh:
-            for collection in self.collections:
-                update_time = max(collection.update_time, update_time)
-
         # Fetch the updated collections
         log.info(
             "Requesting updates since %s",
             datetime.fromtimestamp(update_time / 1000000, tz=UTC).strftime("%Y/%m/%d %H:%M:%S"),
         )
-        updated_collections = [c.to_collection(keys) for c in api.get_collections(since=update_time)]
+        updated_collections = EncryptedCollection.to_collections(api.get_collections(since=update_time), keys)
 
-        # Update
+        # Find the collections to fetch the files of, and where to start
+        todo: list[tuple[Collection, int]] = []
         for c in updated_collections:
+            update_time = max(c.update_time, update_time)
+
             # Skip if deleted and never seen before!
             if c.id not in cmap and c.is_deleted:
                 continue
 
-            # Create filemap of existing files
-            fmap = {}
-            if c.id in self.files and not force_refresh:
-                fmap = {f.id: f for f in self.files[c.id]}
-
-            # Decrypt the collection key
-            ckey = c.enc_collection_key.decrypt()
-
-            # Find out last update time for collection
+            # Find out the latest update time of the files fetched for the collection. The
+            # collection's own update time also changes for changes other than its files,
+            # and is only used for collections saved before file cursors were kept.
             file_update_time = 0
-            if c.id in cmap:
+            if c.id in file_cursors:
+                file_update_time = file_cursors[c.id]
+            elif c.id in cmap:
                 file_update_time = cmap[c.id].update_time
-
-            has_more = True
-            while has_more:
-                (files, has_more) = api.get_files(since=file_update_time, collection_id=c.id)
-                for f in files:
-                    file_update_time = max(f.update_time, file_update_time)
-                    fmap[f.id] = f.to_file(ckey)
-
-            # Save it
-            cmap[c.id] = c
-            self.files[c.id] = list(fmap.values())
-
-        self.collections = list(cmap.values())
+            todo.append((c, file_update_time))
+
+        sink_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as e:
+            for done, _ in enumerate(
+                e.map(lambda task: self._refresh_collection(api, sink, sink_lock, *task), todo),
+                start=1,
+            ):
+                if progress:
+                    progress(done, len(todo))
+
+        if fetched is not None:
+            fetched.sink.retain(fetched.files)
+        sink.save_collections_cursor(update_time)
@@ -13,19 +13,28 @@
 # limitations under the License.
 """Core API client for interacting with Ente's backend services."""
 
+import asyncio
 import logging
+import time
 from base64 import urlsafe_b64decode, urlsafe_b64encode
-from collections.abc import Callable
+from collections.abc import AsyncIterator, Iterator
+from contextlib import contextmanager
 from http import HTTPStatus
 from pathlib import Path
-from typing import Any
+from typing import Any, Protocol
 
 import httpx
 
-from ente_tools.api.core.ente_crypt import CHUNK_SIZE, decrypt_stream_to_file
+from ente_tools.api.core.bandwidth import TokenBucket
+from ente_tools.api.core.blob_cache import BlobCache
+from ente_tools.api.core.concurrency import ConcurrencyController
+from ente_tools.api.core.ente_crypt import CHUNK_SIZE, EnteCryptError, adecrypt_stream, decrypt_stream
+from ente_tools.api.core.remote_reader import RemoteDecryptedReader
+from ente_tools.api.core.retry import UNPROCESSED_STATUSES, Retrier
 from ente_tools.api.core.types_collection import EncryptedCollection
 from ente_tools.api.core.types_crypt import AuthorizationResponse, SPRAttributes
-from ente_tools.api.core.types_file import EncryptedFile, File
+from ente_tools.api.core.types_file import EncryptedFile, File, MultipartUploadURLs, UploadURL
+from ente_tools.api.core.writer import AtomicFileWriter, FsyncPolicy
 
 log = logging.getLogger(__name__)
 
@@ -34,16 +43,87 @@ class EnteAPIError(Exception):
     """Exception raised for errors when interacting with the Ente API."""
 
 
+FILES_DIFF = "/collections/v2/diff"
+"""The endpoint of pages of files."""
+DOWNLOAD = "download"
+"""The name of the endpoint of whole-file downloads, in retry statistics."""
+THUMBNAIL = "/files/preview/"
+"""The endpoint of thumbnails, redirecting to their storage."""
+UPLOAD_URLS = "/files/upload-urls"
+"""The endpoint of presigned URLs to upload objects to."""
+MULTIPART_UPLOAD_URLS = "/files/multipart-upload-urls"
+"""The endpoint of presigned URLs to upload an object to in parts."""
+FILES = "/files"
+"""The endpoint registering uploaded files."""
+ADD_FILES = "/collections/add-files"
+"""The endpoint adding existing files to a collection."""
+UPLOAD = "upload"
+"""The name of the uploads of objects and their parts to storage, in retry statistics."""
+
+
+@contextmanager
+def limit(controller: ConcurrencyController | None) -> Iterator[None]:
+    """Hold a place in the controller's limit, if there is a controller."""
+    if controller is None:
+        yield
+    else:
+        with controller.slot():
+            yield
+
+
+def rechunk(reads: Iterator[bytes], size: int, skip: int = 0) -> Iterator[bytes]:
+    """Regroup data into chunks of a size, except the last.
+
+    Args:
+        reads: The data, in pieces of any size.
+        size: The size of the chunks.
+        skip: The number of bytes to drop from the start.
+
+    Yields:
+        The chunks.
+
+    """
+    buf = bytearray()
+    for data in reads:
+        buf += data
+        if skip:
+            dropped = min(skip, len(buf))
+            del buf[:dropped]
+            skip -= dropped
+        while len(buf) >= size:
+            yield bytes(buf[:size])
+            del buf[:size]
+    if buf:
+        yield bytes(buf)
+
+
+class BinarySink(Protocol):
+    """Where downloaded content is written, such as a file opened for binary writing."""
+
+    def write(self, data: bytes, /) -> object:
+        """Write data."""
+        ...
+
+
 class EnteAPI:
     """Client for making authenticated requests to the Ente API endpoints."""
 
-    def __init__(
+    def __init__(  # noqa: PLR0913
         self,
         pkg: str,
         api_url: str,
         api_account_url: str,
         api_download_url: str,
         token: bytes | None = None,
+        *,
+        transport: httpx.BaseTransport | None = None,
+        async_transport: httpx.AsyncBaseTransport | None = None,
+        retry: Retrier | None = None,
+        api_concurrency: ConcurrencyController | None = None,
+        download_concurrency: ConcurrencyController | None = None,
+        bandwidth: TokenBucket | None = None,
+        api_thumbnail_url: str | None = None,
+        blob_cache: BlobCache | None = None,
     ) -> None:
         """Initialize the EnteAPI client.
 
@@ -53,18 +133,76 @@ class EnteAPI:
             api_account_url: The base URL for the Ente account API.
             api_download_url: The base URL for file downloads.
             token: An optional authentication token.
+            transport: An optional HTTP transport, e.g. for testing.
+            async_transport: An optional HTTP transport for asynchronous requests.
+            retry: The retrier of failed requests; defaults to one with the default policy.
+            api_concurrency: Limits the concurrent requests for pages of files, if given.
+            download_concurrency: Limits the concurrent file downloads, if given.
+            bandwidth: Limits the bandwidth shared by all downloads, if given.
+            api_thumbnail_url: The base URL for thumbnail downloads; defaults to the
+                preview endpoint of the API.
+            blob_cache: The cache of encrypted files consulted by whole-file downloads, if given.
 
         """
         self.pkg = pkg
         self.api_url = api_url
         self.api_account_url = api_account_url
         self.api_download_url = api_download_url
+        self.api_thumbnail_url = api_thumbnail_url or f"{api_url}{THUMBNAIL}"
         self.token = token
         """The authentication token for API requests."""
+        self.client = httpx.Client(transport=transport, follow_redirects=True)
+        """The HTTP client, reusing connections across requests."""
+        self._async_transport = async_transport
+        self.retry = retry or Retrier()
+        """Retries failed requests, and keeps the retry budget and statistics of the run."""
+        self.retry.observers.append(self._observe_failure)
+        self.api_concurrency = api_concurrency
+        self.download_concurrency = download_concurrency
+        self.bandwidth = bandwidth
+        """Limits the bandwidth shared by all downloads, or None for no limit."""
+        self.blob_cache = blob_cache
         self.headers: dict[str, str]
         """The headers for API requests."""
         self._update_headers()
 
+    def _observe_failure(self, endpoint: str, status: int) -> None:
+        """Cut the concurrency of throttled requests."""
+        if status not in UNPROCESSED_STATUSES:
+            return
+        controller = {FILES_DIFF: self.api_concurrency, DOWNLOAD: self.download_concurrency}.get(endpoint)
+        if controller is not None:
+            controller.throttled()
+
+    def set_bandwidth_limit(self, rate: float | None, burst: float | None = None) -> None:
+        """Set the bandwidth limit shared by all downloads, taking effect for downloads in progress.
+
+        Args:
+            rate: The maximum rate, in bytes per second, or None for no limit.
+            burst: The most bytes transferred at once above the rate; defaults to one second at the rate.
+
+        """
+        if rate is None:
+            self.bandwidth = None
+        elif self.bandwidth is None:
+            self.bandwidth = TokenBucket(rate, burst)
+        else:
+            self.bandwidth.set_rate(rate, burst)
+
+    def _throttle(self, nbytes: int) -> None:
+        """Wait for the bandwidth limit to allow bytes that were received."""
+        bandwidth = self.bandwidth
+        if bandwidth is not None:
+            bandwidth.consume(nbytes)
+
+    def _metered(self, reads: Iterator[bytes], controller: ConcurrencyController | None) -> Iterator[bytes]:
+        """Throttle and count each network read, so concurrent downloads share the bandwidth evenly."""
+        for data in reads:
+            self._throttle(len(data))
+            if controller is not None:
+                controller.add_bytes(len(data))
+            yield data
+
     def set_token(self, token: bytes | None = None) -> None:
         """DocString."""
         self.token = token
@@ -86,7 +224,7 @@ class EnteAPI:
             headers.update(self.headers)
         if log.isEnabledFor(logging.DEBUG):
             log.debug("Requesting %s (headers %s)", url, headers)
-        r = httpx.get(url, params=data, headers=headers)
+        r = self.retry.send(path, lambda: self.client.get(url, params=data, headers=headers))
         # TODO(scannell): 404 is what?
         if r.status_code != HTTPStatus.OK:
             log.info("Invalid status from %s of %d: %s", url, r.status_code, str(r.content, "utf"))
@@ -98,11 +236,11 @@ class EnteAPI:
             return r.json()
         return None
 
-    def _post(self, path: str, data: dict[str, str] | None = None) -> Any:  # noqa: ANN401
+    def _post(self, path: str, data: dict[str, Any] | None = None) -> Any:  # noqa: ANN401
         url = f"{self.api_url}{path}"
         if not data:
             data = {}
-        r = httpx.post(url, json=data, headers=self.headers)
+        r = self.retry.send(path, lambda: self.client.post(url, json=data, headers=self.headers), idempotent=False)
         if r.status_code != HTTPStatus.OK:
             msg = f"invalid status from URL {url}: {r.status_code}"
             raise EnteAPIError(msg)
@@ -171,13 +309,17 @@ class EnteAPI:
 
         """
         # Get list of files
-        result = self._get(
-            "/collections/v2/diff",
-            data={
-                "sinceTime": str(since),
-                "collectionID": str(collection_id),
-            },
-        )
+        with limit(self.api_concurrency):
+            start = time.monotonic()
+            result = self._get(
+                FILES_DIFF,
+                data={
+                    "sinceTime": str(since),
+                    "collectionID": str(collection_id),
+                },
+            )
+            if self.api_concurrency is not None:
+                self.api_concurrency.record(time.monotonic() - start)
 
         files = [EncryptedFile.model_validate(f) for f in result["diff"]]
 
@@ -198,42 +340,387 @@ class EnteAPI:
         msg = "unimplemented"
         raise EnteAPIError(msg)
 
-    # TODO(scannell): Handle retries with status code 429, >= 500.
-    def _download_file(self, file_id: int, handle: Callable[[bytes], None], chunk_size: int | None = None) -> None:
-        """DocString."""
+    def download_range(self, file_id: int, start: int, end: int) -> tuple[bytes, int]:
+        """Download a byte range of an encrypted file.
+
+        Args:
+            file_id: The ID of the file to download.
+            start: The offset of the first byte.
+            end: The offset after the last byte.
+
+        Returns:
+            The bytes in the range (fewer at the end of the file) and the size of the file.
+
+        Raises:
+            EnteAPIError: If the server returns an invalid status code, or a partial
+                response without the size of the file.
+
+        """
         url = f"{self.api_download_url}{file_id}"
-        """Download a file from the server.
+        r = self.retry.send(
+            "download_range",
+            lambda: self.client.get(url, headers=self.headers | {"Range": f"bytes={start}-{end - 1}"}),
+        )
+        self._throttle(len(r.content))
+        if r.status_code == HTTPStatus.PARTIAL_CONTENT:
+            # Content-Range is "bytes start-end/size"
+            content_range = r.headers.get("Content-Range", "")
+            try:
+                size = int(content_range.rpartition("/")[2])
+            except ValueError:
+                msg = f"invalid Content-Range from URL {url}: {r.status_code}: {content_range!r}"
+                raise EnteAPIError(msg) from None
+            return (r.content, size)
+        if r.status_code == HTTPStatus.OK:
+            # The server ignored the range
+            return (r.content[start:end], len(r.content))
+        msg = f"invalid status from URL {url}: {r.status_code}"
+        raise EnteAPIError(msg)
+
+    def download_thumbnail(self, file: File, key: bytes, *, token: bytes | None = None) -> bytes:
+        """Download the thumbnail of a file and decrypt it.
+
+        Args:
+            file: The file metadata.
+            key: The decrypted file key.
+            token: The authentication token of the file's account; see `iter_file`.
+
+        Returns:
+            The decrypted thumbnail, usually a JPEG image.
+
+        Raises:
+            EnteAPIError: If the server returns an invalid status code.
+            EnteCryptError: If the thumbnail is corrupted.
+
+        """
+        url = f"{self.api_thumbnail_url}{file.id}"
+        r = self.retry.send(THUMBNAIL, lambda: self.client.get(url, headers=self._download_headers(0, token)))
+        if not r.is_success:
+            raise self._download_error(r, r.content)
+        self._throttle(len(r.content))
+        return b"".join(decrypt_stream(key, urlsafe_b64decode(file.thumbnail.decryption_header), [r.content]))
+
+    def get_upload_urls(self, count: int) -> list[UploadURL]:
+        """Get presigned URLs to upload objects to, such as encrypted files and thumbnails.
+
+        Args:
+            count: The number of URLs.
+
+        """
+        return [UploadURL.model_validate(u) for u in self._get(UPLOAD_URLS, {"count": str(count)})["urls"]]
+
+    def get_multipart_upload_urls(self, parts: int) -> MultipartUploadURLs:
+        """Get presigned URLs to upload an object to in parts.
+
+        Args:
+            parts: The number of parts.
+
+        """
+        return MultipartUploadURLs.model_validate(self._get(MULTIPART_UPLOAD_URLS, {"count": str(parts)})["urls"])
+
+    def put_object(self, url: str, data: bytes) -> str:
+        """Upload an object, or a part of one, to a presigned URL, retrying failures.
+
+        Args:
+            url: The presigned URL.
+            data: The content.
+
+        Returns:
+            The ETag of the uploaded content.
+
+        Raises:
+            EnteAPIError: If the storage returns an invalid status code after any retries.
+
+        """
+        # The URL is signed for storage, which does not take the API's headers
+        r = self.retry.send(UPLOAD, lambda: self.client.put(url, content=data))
+        if not r.is_success:
+            raise self._download_error(r, r.content)
+        return r.headers.get("ETag", "")
+
+    def complete_multipart_upload(self, url: str, etags: list[str]) -> None:
+        """Complete the upload of an object in parts.
+
+        Args:
+            url: The URL to complete the upload at.
+            etags: The ETags of the parts, in order.
+
+        Raises:
+            EnteAPIError: If the storage returns an invalid status code after any retries.
+
+        """
+        body = "".join(
+            f"<Part><PartNumber>{n}</PartNumber><ETag>{etag}</ETag></Part>" for (n, etag) in enumerate(etags, start=1)
+        )
+        r = self.retry.send(
+            UPLOAD,
+            lambda: self.client.post(
+                url,
+                content=f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>",
+                headers={"Content-Type": "text/xml"},
+            ),
+        )
+        if not r.is_success:
+            raise self._download_error(r, r.content)
+
+    def create_file(self, request: dict[str, Any]) -> EncryptedFile:
+        """Register an uploaded file in a collection.
+
+        Args:
+            request: The collection, the encrypted file key, and the object keys and
+                decryption headers of the uploaded file, thumbnail and metadata.
+
+        Returns:
+            The created file.
+
+        """
+        return EncryptedFile.model_validate(self._post(FILES, request))
+
+    def add_files(self, collection_id: int, files: list[dict[str, Any]]) -> None:
+        """Add existing files of the user to a collection, without uploading them again.
+
+        Args:
+            collection_id: The ID of the collection.
+            files: The ID of each file, with its key encrypted with the collection key
+                as `encryptedKey` and `keyDecryptionNonce`.
+
+        """
+        self._post(ADD_FILES, {"collectionID": collection_id, "files": files})
+
+    def open_file(
+        self,
+        file: File,
+        key: bytes,
+        cache_chunks: int = RemoteDecryptedReader.CacheChunks,
+        max_chunks: int | None = None,
+    ) -> RemoteDecryptedReader:
+        """Open a remote file for random access to its decrypted content.
+
+        Args:
+            file: The file metadata.
+            key: The decrypted file key.
+            cache_chunks: The number of decrypted chunks kept.
+            max_chunks: The maximum number of chunks fetched, or None for no limit.
+
+        Returns:
+            A seekable reader fetching only the chunks that are read.
+
+        """
+        return RemoteDecryptedReader(
+            lambda start, end: self.download_range(file.id, start, end),
+            key=key,
+            header=urlsafe_b64decode(file.file.decryption_header),
+            cache_chunks=cache_chunks,
+            max_chunks=max_chunks,
+        )
+
+    def _download_headers(self, offset: int, token: bytes | None = None) -> dict[str, str]:
+        headers = self.headers
+        if token is not None:
+            headers = headers | {"X-Auth-Token": str(urlsafe_b64encode(token), "utf-8")}
+        return headers | {"Range": f"bytes={offset}-"} if offset else headers
+
+    def _download_error(self, r: httpx.Response, body: bytes) -> EnteAPIError:
+        return EnteAPIError(f"invalid status from URL {r.url}: {r.status_code}: {str(body, 'utf-8', 'replace')}")
+
+    def _iter_encrypted(self, file_id: int, token: bytes | None = None) -> Iterator[bytes]:
+        """Download an encrypted file in chunks, resuming after the last whole chunk on failure.
 
         Args:
             file_id: The ID of the file to download.
-            handle: A callable to handle each chunk of data received.
-            chunk_size: The size of each chunk to download.
+            token: The authentication token to use instead of the client's.
+
+        Yields:
+            The encrypted chunks, of `CHUNK_SIZE` bytes except the last.
+
+        Raises:
+            EnteAPIError: If the server returns an invalid status code after any retries.
+            httpx.TransportError: If the connection fails after any retries.
+
+        """
+        url = f"{self.api_download_url}{file_id}"
+        controller = self.download_concurrency
+        offset = 0
+        attempt = 0
+        attempt_offset = 0
+        with limit(controller):
+            while True:
+                # Failures after progress start a new series of attempts; the budget still applies
+                attempt = 1 if offset > attempt_offset else attempt + 1
+                attempt_offset = offset
+                self.retry.attempt(DOWNLOAD)
+                start = time.monotonic()
+                try:
+                    with self.client.stream("GET", url, headers=self._download_headers(offset, token)) as r:
+                        if controller is not None:
+                            # The time to the response headers is comparable across file sizes
+                            controller.record(time.monotonic() - start)
+                        if not r.is_success:
+                            body = r.read()
+                            delay = self.retry.retry_delay(DOWNLOAD, attempt, r)
+                            if delay is None:
+                                raise self._download_error(r, body)
+                            self.retry.sleep(delay)
+                            continue
+                        # Skip what was received already if the server ignored the range
+                        skip = offset if r.status_code == HTTPStatus.OK else 0
+                        for data in rechunk(self._metered(r.iter_bytes(), controller), CHUNK_SIZE, skip):
+                            offset += len(data)
+                            yield data
+                        return
+                except httpx.TransportError:
+                    delay = self.retry.retry_delay(DOWNLOAD, attempt)
+                    if delay is None:
+                        raise
+                    self.retry.sleep(delay)
+
+    async def _aiter_encrypted(self, file_id: int) -> AsyncIterator[bytes]:
+        """Download an encrypted file in chunks asynchronously; see `_iter_encrypted`.
+
+        The concurrency controllers and the bandwidth limit block threads, so they do not
+        apply to asynchronous downloads.
+        """
+        url = f"{self.api_download_url}{file_id}"
+        offset = 0
+        attempt = 0
+        attempt_offset = 0
+        async with httpx.AsyncClient(transport=self._async_transport, follow_redirects=True) as client:
+            while True:
+                attempt = 1 if offset > attempt_offset else attempt + 1
+                attempt_offset = offset
+                self.retry.attempt(DOWNLOAD)
+                try:
+                    async with client.stream("GET", url, headers=self._download_headers(offset)) as r:
+                        if not r.is_success:
+                            body = await r.aread()
+                            delay = self.retry.retry_delay(DOWNLOAD, attempt, r)
+                            if delay is None:
+                                raise self._download_error(r, body)
+                            await asyncio.sleep(delay)
+                            continue
+                        skip = offset // CHUNK_SIZE if r.status_code == HTTPStatus.OK else 0
+                        async for data in r.aiter_bytes(chunk_size=CHUNK_SIZE):
+                            if skip:
+                                skip -= 1
+                                continue
+                            offset += len(data)
+                            yield data
+                        return
+                except httpx.TransportError:
+                    delay = self.retry.retry_delay(DOWNLOAD, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+
+    def _iter_cached(self, file: File, token: bytes | None = None) -> Iterator[bytes]:
+        """Yield an encrypted file from the blob cache, if any, downloading it if not cached."""
+        if self.blob_cache is None:
+            return self._iter_encrypted(file.id, token)
+        return self.blob_cache.fetch(file.id, file.update_time, lambda: self._iter_encrypted(file.id, token))
+
+    def iter_file(self, file: File, key: bytes, *, token: bytes | None = None) -> Iterator[bytes]:
+        """Download a file from the server, yielding its decrypted content.
+
+        Failed requests are retried according to the retry policy, resuming
+        after the last whole chunk received. With a blob cache, the encrypted
+        file is read from the cache if there, and cached otherwise; a cached
+        file that fails to decrypt is removed from the cache.
+
+        Args:
+            file: The file metadata.
+            key: The decrypted file key.
+            token: The authentication token of the file's account, instead of the
+                client's, so files of several accounts can be downloaded concurrently.
+
+        Yields:
+            The decrypted chunks of the file, of up to `StreamEncryptionSize` bytes.
 
         Raises:
             EnteAPIError: If the server returns an invalid status code.
+            EnteCryptError: If the file is truncated or corrupted.
+
+        """
+        try:
+            yield from decrypt_stream(
+                key,
+                urlsafe_b64decode(file.file.decryption_header),
+                self._iter_cached(file, token),
+            )
+        except EnteCryptError:
+            if self.blob_cache is not None:
+                self.blob_cache.discard(file.id, file.update_time)
+            raise
+
+    async def aiter_file(self, file: File, key: bytes) -> AsyncIterator[bytes]:
+        """Download a file from the server asynchronously, yielding its decrypted content.
+
+        See `iter_file`.
         """
-        with httpx.stream("GET", url, follow_redirects=True, headers=self.headers) as r:
-            for data in r.iter_bytes(chunk_size=chunk_size):
-                if r.status_code != HTTPStatus.OK:
-                    msg = f"invalid status from URL {url}: {r.status_code}: {str(data, 'utf-8')}"
-                    raise EnteAPIError(msg)
-                handle(data)
+        async for data in adecrypt_stream(
+            key,
+            urlsafe_b64decode(file.file.decryption_header),
+            self._aiter_encrypted(file.id),
+        ):
+            yield data
 
-    # TODO(scannell): Handle retries with status code 429, >= 500.
-    def download_file(self, file: File, dest: Path) -> None:
+    def write_file(self, file: File, key: bytes, sink: BinarySink, *, token: bytes | None = None) -> int:
+        """Download a file from the server and write its decrypted content to a binary sink.
+
+        Args:
+            file: The file metadata.
+            key: The decrypted file key.
+            sink: Where to write the content, e.g. an open file or standard output.
+            token: The authentication token of the file's account; see `iter_file`.
+
+        Returns:
+            The number of bytes written.
+
+        Raises:
+            EnteAPIError: If the server returns an invalid status code.
+            EnteCryptError: If the file is truncated or corrupted.
+
+        """
+        size = 0
+        for data in self.iter_file(file, key, token=token):
+            sink.write(data)
+            size += len(data)
+        return size
+
+    def download_file(  # noqa: PLR0913
+        self,
+        file: File,
+        key: bytes,
+        dest: Path,
+        *,
+        token: bytes | None = None,
+        fsync: FsyncPolicy = FsyncPolicy.NONE,
+        expected_hash: str | None = None,
+    ) -> str:
         """Download a file from the server and decrypt it.
 
+        The file is written under a temporary name next to the destination, and
+        only renamed to it once complete and verified, so the destination never
+        holds a partial file (see `AtomicFileWriter`).
+
         Args:
             file: The file metadata.
+            key: The decrypted file key.
             dest: The destination path to save the decrypted file.
+            token: The authentication token of the file's account; see `iter_file`.
+            fsync: When the file is flushed to storage.
+            expected_hash: The hash the content must match, base64 encoded, if any.
+
+        Returns:
+            The hash of the content, encoded as the hashes of local files.
 
         Raises:
             EnteAPIError: If the server returns an invalid status code.
+            EnteCryptError: If the file is truncated or corrupted.
+            HashMismatchError: If the content does not match the expected hash.
 
         """
-        with decrypt_stream_to_file(
-            dest,
-            key=file.enc_file_key.decrypt(),
-            header=urlsafe_b64decode(file.file.decryption_header),
-        ) as handler:
-            self._download_file(file.id, handler, chunk_size=CHUNK_SIZE)
+        size = file.info.file_size if file.info is not None else None
+        with AtomicFileWriter(dest, size=size, fsync=fsync, expected_hash=expected_hash) as f:
+            self.write_file(file, key, f, token=token)
+            f.commit()
+            return f.hash
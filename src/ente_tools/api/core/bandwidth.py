@@ -0,0 +1,91 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Token bucket limiting the bandwidth shared by concurrent transfers."""
+
+import threading
+import time
+from collections.abc import Callable
+
+
+class TokenBucket:
+    """Limits the rate of bytes transferred across threads.
+
+    The bucket fills at `rate` bytes per second up to `burst` bytes. Taking
+    bytes from it blocks until enough have accumulated, so transfers can
+    briefly exceed the rate by at most the burst.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float | None = None,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Initialise a full bucket.
+
+        Args:
+            rate: The sustained rate, in bytes per second.
+            burst: The capacity of the bucket, in bytes; defaults to one second at the rate.
+            clock: Returns the current time in seconds.
+            sleep: Waits for a number of seconds.
+
+        """
+        if rate <= 0:
+            msg = f"invalid rate {rate}"
+            raise ValueError(msg)
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.burst
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float, burst: float | None = None) -> None:
+        """Change the rate and burst, e.g. while transfers are running.
+
+        Args:
+            rate: The new sustained rate, in bytes per second.
+            burst: The new capacity of the bucket, in bytes; defaults to one second at the rate.
+
+        """
+        if rate <= 0:
+            msg = f"invalid rate {rate}"
+            raise ValueError(msg)
+        with self._lock:
+            # Account for the time so far at the old rate
+            self._refill()
+            self.rate = rate
+            self.burst = burst if burst is not None else rate
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, nbytes: int) -> None:
+        """Take bytes from the bucket, waiting until they are available.
+
+        Requests larger than the burst are allowed and leave the bucket in
+        debt, delaying the following requests instead.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            self._sleep(wait)
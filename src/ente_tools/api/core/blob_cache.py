@@ -0,0 +1,195 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of encrypted files as downloaded, shareable by several hosts."""
+
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import BinaryIO
+
+from pydantic import BaseModel
+
+from ente_tools.api.core.ente_crypt import CHUNK_SIZE
+
+log = logging.getLogger(__name__)
+
+
+class BlobCacheStats(BaseModel):
+    """Statistics of the use of a blob cache."""
+
+    hits: int = 0
+    misses: int = 0
+    hit_bytes: int = 0
+    """The number of bytes read from the cache instead of the server."""
+    evicted: int = 0
+
+
+class BlobCache:
+    """A size-capped directory of encrypted files, exactly as received from the server.
+
+    A blob is keyed by its file's ID and update time, so an updated file is
+    downloaded again, and holds ciphertext only: sharing the directory, e.g.
+    over NFS, exposes nothing the server does not already hold. Several hosts
+    restoring the same accounts through a shared directory download each file
+    from the server once.
+
+    Writers, on this or other hosts, write to their own temporary files and
+    publish complete blobs by renaming them into place, so readers never see a
+    partial blob; concurrent writers of a blob write the same content and the
+    last rename wins. Reads refresh the modification time of a blob, which
+    every host sees, and the least recently used blobs are evicted once the
+    directory exceeds its cap.
+
+    The cache is thread-safe.
+    """
+
+    MaxSize = 10 * 1024 * 1024 * 1024
+    """Default cap of the total size of the blobs."""
+
+    StaleAge = 24 * 60 * 60
+    """Age, in seconds, after which a temporary file is left by a writer that failed."""
+
+    def __init__(self, directory: Path, *, max_size: int = MaxSize) -> None:
+        """Open the cache.
+
+        Args:
+            directory: The directory of the blobs; created if missing.
+            max_size: The cap of the total size of the blobs, in bytes.
+
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.stats = BlobCacheStats()
+        self._size: int | None = None
+        """The estimated total size of the blobs, from the last scan and the blobs published since."""
+        self._lock = threading.Lock()
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, file_id: int, update_time: int) -> Path:
+        """Return the path of a blob, spread over subdirectories by file ID."""
+        return self.directory / f"{file_id % 256:02x}" / f"{file_id}-{update_time}.blob"
+
+    def fetch(self, file_id: int, update_time: int, download: Callable[[], Iterator[bytes]]) -> Iterator[bytes]:
+        """Yield an encrypted file from the cache, or from a download that is cached as it is read.
+
+        The download is published to the cache only if it is read to the end.
+
+        Args:
+            file_id: The ID of the file.
+            update_time: The update time of the file.
+            download: Returns the encrypted chunks of the file from the server.
+
+        Yields:
+            The encrypted chunks, of `CHUNK_SIZE` bytes except the last.
+
+        """
+        path = self.path(file_id, update_time)
+        try:
+            f = path.open("rb")
+        except FileNotFoundError:
+            pass
+        else:
+            with f:
+                yield from self._read(path, f)
+            return
+
+        with self._lock:
+            self.stats.misses += 1
+        path.parent.mkdir(exist_ok=True)
+        (fd, name) = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.{socket.gethostname()}.", suffix=".part")
+        tmp = Path(name)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for data in download():
+                    out.write(data)
+                    yield data
+            tmp.chmod(0o644)
+            tmp.replace(path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        log.debug("Cached blob %s", path.name)
+        self._published(path.stat().st_size)
+
+    def _read(self, path: Path, f: BinaryIO) -> Iterator[bytes]:
+        try:
+            # Mark as used, for eviction by other hosts too
+            os.utime(path)
+        except OSError as e:
+            log.debug("Cannot mark %s as used: %s", path, e)
+        size = 0
+        while data := f.read(CHUNK_SIZE):
+            size += len(data)
+            yield data
+        with self._lock:
+            self.stats.hits += 1
+            self.stats.hit_bytes += size
+
+    def discard(self, file_id: int, update_time: int) -> None:
+        """Remove a blob, e.g. one whose content failed to decrypt."""
+        self.path(file_id, update_time).unlink(missing_ok=True)
+
+    def _published(self, size: int) -> None:
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            if self._size is None or self._size > self.max_size:
+                self._trim()
+
+    def trim(self) -> None:
+        """Evict the least recently used blobs until the cache is within its cap.
+
+        Temporary files left by writers that failed are removed too.
+        """
+        with self._lock:
+            self._trim()
+
+    def _trim(self) -> None:
+        blobs: list[tuple[float, int, Path]] = []
+        stale = time.time() - self.StaleAge
+        for path in self.directory.glob("*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Evicted by another host meanwhile
+                continue
+            if path.suffix == ".blob":
+                blobs.append((stat.st_mtime, stat.st_size, path))
+            elif path.suffix == ".part" and stat.st_mtime < stale:
+                path.unlink(missing_ok=True)
+        size = sum(b[1] for b in blobs)
+        for mtime, blob_size, path in sorted(blobs):
+            if size <= self.max_size:
+                break
+            log.debug("Evicting blob %s, last used %s", path.name, time.ctime(mtime))
+            path.unlink(missing_ok=True)
+            size -= blob_size
+            self.stats.evicted += 1
+        self._size = size
+
+    def log_stats(self) -> None:
+        """Log the statistics of the cache, if it was used."""
+        stats = self.stats
+        if stats.hits or stats.misses:
+            log.info(
+                "Blob cache: %d hits (%d bytes not downloaded), %d misses, %d evicted",
+                stats.hits,
+                stats.hit_bytes,
+                stats.misses,
+                stats.evicted,
+            )
@@ -0,0 +1,185 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Adaptive limit on the number of concurrent requests of a kind."""
+
+import logging
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from pydantic import BaseModel
+
+log = logging.getLogger(__name__)
+
+
+class ConcurrencyStats(BaseModel):
+    """Statistics of a concurrency controller."""
+
+    limit: int
+    """The current limit on concurrent operations."""
+    in_flight: int
+    completed: int
+    """The number of observations recorded, e.g. pages or chunks."""
+    throttled: int
+    """The number of throttling responses observed."""
+    decreases: int
+    """The number of times the limit was decreased."""
+    throughput: float
+    """The average throughput since the first observation, in bytes per second."""
+
+
+class ConcurrencyController:
+    """Limits concurrent operations, adapting the limit with additive increase, multiplicative decrease.
+
+    Each observation of an operation's latency raises the limit by `1 / limit`,
+    about one per round of operations. The limit is cut by `backoff` when the
+    server throttles, or when the average latency exceeds `latency_factor` times
+    the lowest latency seen, as queueing rather than parallelism then grows.
+    Cuts are at most one per average latency, so the many failures of one
+    congested round count once.
+
+    Latencies of one controller should be comparable, e.g. of pages of one API
+    or of the response headers of downloads.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        name: str,
+        *,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        backoff: float = 0.5,
+        latency_factor: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialise the controller.
+
+        Args:
+            name: The name of the operations, for logging.
+            initial: The initial limit.
+            min_limit: The lowest limit.
+            max_limit: The highest limit.
+            backoff: The factor the limit is multiplied by when cut.
+            latency_factor: The rise in average latency over the lowest one treated as congestion.
+            clock: Returns the current time in seconds.
+
+        """
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self._clock = clock
+        self._limit = float(max(min_limit, min(initial, max_limit)))
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._baseline: float | None = None
+        self._latency: float | None = None
+        self._last_decrease = float("-inf")
+        self._completed = 0
+        self._throttled = 0
+        self._decreases = 0
+        self._bytes = 0
+        self._start: float | None = None
+
+    @property
+    def limit(self) -> int:
+        """The current limit on concurrent operations."""
+        return max(self.min_limit, min(int(self._limit), self.max_limit))
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Wait for the limit to allow another operation, and hold a place for it."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def _decrease(self, now: float, reason: str) -> None:
+        if now - self._last_decrease < (self._latency or 0.0):
+            return
+        self._last_decrease = now
+        self._decreases += 1
+        self._limit = max(float(self.min_limit), self._limit * self.backoff)
+        log.debug("Limit of %s cut to %d: %s", self.name, self.limit, reason)
+
+    def record(self, latency: float, nbytes: int = 0) -> None:
+        """Record the latency of a completed operation, adjusting the limit.
+
+        Args:
+            latency: The duration of the operation, in seconds.
+            nbytes: The number of bytes transferred, for the throughput.
+
+        """
+        with self._cond:
+            now = self._clock()
+            if self._start is None:
+                self._start = now - latency
+            self._completed += 1
+            self._bytes += nbytes
+            # The baseline follows the lowest latency, rising slowly so it adapts to a slower server
+            self._baseline = latency if self._baseline is None else min(latency, self._baseline * 1.01)
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+            if self._latency > self.latency_factor * self._baseline:
+                self._decrease(now, f"latency {self._latency:.3f}s over {self._baseline:.3f}s")
+            else:
+                self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+    def add_bytes(self, nbytes: int) -> None:
+        """Record bytes transferred by an operation in progress, for the throughput."""
+        with self._cond:
+            if self._start is None:
+                self._start = self._clock()
+            self._bytes += nbytes
+
+    def throttled(self) -> None:
+        """Record a throttling response, cutting the limit."""
+        with self._cond:
+            self._throttled += 1
+            self._decrease(self._clock(), "throttled")
+
+    def stats(self) -> ConcurrencyStats:
+        """Return the statistics of the controller."""
+        with self._cond:
+            elapsed = self._clock() - self._start if self._start is not None else 0.0
+            return ConcurrencyStats(
+                limit=self.limit,
+                in_flight=self._in_flight,
+                completed=self._completed,
+                throttled=self._throttled,
+                decreases=self._decreases,
+                throughput=self._bytes / elapsed if elapsed > 0 else 0.0,
+            )
+
+    def log_stats(self) -> None:
+        """Log the statistics of the controller, if it was used."""
+        stats = self.stats()
+        if stats.completed or stats.throttled:
+            log.info(
+                "Concurrency of %s: limit %d, %d completed, %d throttled, %d decreases, %.0f bytes/s",
+                self.name,
+                stats.limit,
+                stats.completed,
+                stats.throttled,
+                stats.decreases,
+                stats.throughput,
+            )
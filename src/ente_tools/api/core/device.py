@@ -14,9 +14,12 @@
 """Device-specific encryption key management for Ente."""
 
 from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections.abc import Sequence
 from functools import cache
+from typing import Protocol
 
 import keyring
+from nacl.bindings import crypto_secretbox_easy, crypto_secretbox_open_easy
 from nacl.secret import SecretBox
 from nacl.utils import random
 from pydantic import BaseModel
@@ -45,6 +48,86 @@ def get_device_key() -> bytes:
     return urlsafe_b64decode(bytes(encoded, "utf8"))
 
 
+class Secret(Protocol):
+    """Encrypted data and its nonce, both base64 encoded."""
+
+    encrypted: str
+    nonce: str
+
+
+class DeviceCrypto:
+    """Encrypts and decrypts secrets with one key, as a SecretBox does.
+
+    Secrets are encrypted with the libsodium secretbox directly, avoiding the
+    wrapper objects created by each `SecretBox` call. Use `device_crypto()` for
+    the device key.
+    """
+
+    def __init__(self, key: bytes) -> None:
+        """Initialise with the key to encrypt and decrypt with."""
+        if len(key) != SecretBox.KEY_SIZE:
+            msg = f"the key must be exactly {SecretBox.KEY_SIZE} bytes long"
+            raise ValueError(msg)
+        self._key = key
+
+    def encrypt(self, msg: bytes) -> tuple[str, str]:
+        """Encrypt a message with a random nonce.
+
+        Returns:
+            The encrypted message and the nonce, both base64 encoded.
+
+        """
+        return self.encrypt_many([msg])[0]
+
+    def encrypt_many(self, msgs: Sequence[bytes]) -> list[tuple[str, str]]:
+        """Encrypt messages, each with its own random nonce.
+
+        Returns:
+            The encrypted message and the nonce of each message, both base64 encoded.
+
+        """
+        size = SecretBox.NONCE_SIZE
+        nonces = random(size * len(msgs))
+        key = self._key
+        result = []
+        for i, msg in enumerate(msgs):
+            nonce = nonces[i * size : (i + 1) * size]
+            result.append(
+                (
+                    str(urlsafe_b64encode(crypto_secretbox_easy(msg, nonce, key)), "utf-8"),
+                    str(urlsafe_b64encode(nonce), "utf-8"),
+                ),
+            )
+        return result
+
+    def decrypt(self, secret: Secret) -> bytes:
+        """Decrypt a secret.
+
+        Raises:
+            nacl.exceptions.CryptoError: If the decryption fails.
+
+        """
+        return self.decrypt_many([secret])[0]
+
+    def decrypt_many(self, secrets: Sequence[Secret]) -> list[bytes]:
+        """Decrypt secrets.
+
+        Raises:
+            nacl.exceptions.CryptoError: If the decryption of any secret fails.
+
+        """
+        key = self._key
+        return [
+            crypto_secretbox_open_easy(urlsafe_b64decode(s.encrypted), urlsafe_b64decode(s.nonce), key) for s in secrets
+        ]
+
+
+@cache
+def device_crypto() -> DeviceCrypto:
+    """Return the DeviceCrypto for the device key."""
+    return DeviceCrypto(get_device_key())
+
+
 class DeviceSecret(BaseModel):
     """Encrypted data that can only be decrypted using the device key."""
 
@@ -67,11 +150,21 @@ class DeviceSecret(BaseModel):
             DeviceSecret: An object containing the encrypted message and the nonce.
 
         """
-        nonce = random(SecretBox.NONCE_SIZE)
-        return DeviceSecret(
-            encrypted=str(urlsafe_b64encode(SecretBox(get_device_key()).encrypt(msg, nonce).ciphertext), "utf-8"),
-            nonce=str(urlsafe_b64encode(nonce), "utf-8"),
-        )
+        (encrypted, nonce) = device_crypto().encrypt(msg)
+        return DeviceSecret(encrypted=encrypted, nonce=nonce)
+
+    @staticmethod
+    def encrypt_many(msgs: Sequence[bytes]) -> list["DeviceSecret"]:
+        """Encrypt messages using the device key.
+
+        Args:
+            msgs (Sequence[bytes]): The messages to encrypt.
+
+        Returns:
+            list[DeviceSecret]: The encrypted messages, in the same order.
+
+        """
+        return [DeviceSecret(encrypted=e, nonce=n) for (e, n) in device_crypto().encrypt_many(msgs)]
 
     def decrypt(self) -> bytes:
         """Decrypt the encrypted data using the device key.
@@ -86,7 +179,20 @@ class DeviceSecret(BaseModel):
             nacl.exceptions.CryptoError: If the decryption fails.
 
         """
-        return SecretBox(get_device_key()).decrypt(
-            urlsafe_b64decode(self.encrypted),
-            nonce=urlsafe_b64decode(self.nonce),
-        )
+        return device_crypto().decrypt(self)
+
+    @staticmethod
+    def decrypt_many(secrets: Sequence["DeviceSecret"]) -> list[bytes]:
+        """Decrypt secrets using the device key.
+
+        Args:
+            secrets (Sequence[DeviceSecret]): The secrets to decrypt.
+
+        Returns:
+            list[bytes]: The decrypted messages, in the same order.
+
+        Raises:
+            nacl.exceptions.CryptoError: If the decryption of any secret fails.
+
+        """
+        return device_crypto().decrypt_many(secrets)
@@ -14,7 +14,7 @@
 """Module for handling encryption and decryption operations using libsodium."""
 
 import logging
-from collections.abc import Callable, Generator
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Generator, Iterable, Iterator
 from contextlib import contextmanager
 from pathlib import Path
 
@@ -22,14 +22,19 @@ from nacl.bindings import (
     crypto_secretstream_xchacha20poly1305_ABYTES,
     crypto_secretstream_xchacha20poly1305_HEADERBYTES,
     crypto_secretstream_xchacha20poly1305_init_pull,
+    crypto_secretstream_xchacha20poly1305_init_push,
     crypto_secretstream_xchacha20poly1305_KEYBYTES,
     crypto_secretstream_xchacha20poly1305_pull,
+    crypto_secretstream_xchacha20poly1305_push,
     crypto_secretstream_xchacha20poly1305_state,
     crypto_secretstream_xchacha20poly1305_TAG_FINAL,
     crypto_secretstream_xchacha20poly1305_TAG_MESSAGE,
 )
+from nacl.exceptions import CryptoError
 from nacl.secret import SecretBox
 
+from ente_tools.api.core.writer import AtomicFileWriter, FsyncPolicy
+
 log = logging.getLogger(__name__)
 
 
@@ -40,11 +45,26 @@ class EnteCryptError(Exception):
 StreamEncryptionSize = 4 * 1024 * 1024
 CHUNK_SIZE = StreamEncryptionSize + crypto_secretstream_xchacha20poly1305_ABYTES
 
+STREAM_MAC_BYTES = 16
+"""Length of the MAC at the end of each encrypted stream chunk."""
+_STREAM_INONCE_BYTES = 8
+_STREAM_KEY_BYTES = 32
+
 
 class EnteEncryptionError(Exception):
     """Raised when an encryption operation fails."""
 
 
+def encrypted_size(size: int) -> int:
+    """Return the size of content once encrypted as a stream, as files are.
+
+    Every chunk of up to `StreamEncryptionSize` bytes gains a MAC and tag, and
+    even empty content has its final chunk.
+    """
+    chunks = max(1, -(-size // StreamEncryptionSize))
+    return size + chunks * crypto_secretstream_xchacha20poly1305_ABYTES
+
+
 def decrypt(key: bytes, nonce: bytes, data: bytes) -> bytes:
     """Decrypt data using a secret key and nonce.
 
@@ -95,17 +115,161 @@ def decrypt_blob(data: bytes, header: bytes, key: bytes) -> bytes:
     return result[0]
 
 
+def encrypt_blob(data: bytes, key: bytes) -> tuple[bytes, bytes]:
+    """Encrypt a blob of data using a secret key, as a single final stream message.
+
+    Args:
+        data: The data to encrypt.
+        key: The secret key used for encryption.
+
+    Returns:
+        A tuple of the encrypted data and the header needed for decryption.
+
+    Raises:
+        EnteEncryptionError: If the key length is invalid.
+
+    """
+    if len(key) != crypto_secretstream_xchacha20poly1305_KEYBYTES:
+        msg = "invalid key length"
+        raise EnteEncryptionError(msg)
+
+    state = crypto_secretstream_xchacha20poly1305_state()
+
+    header = crypto_secretstream_xchacha20poly1305_init_push(state, key)
+
+    return (
+        crypto_secretstream_xchacha20poly1305_push(state, data, None, crypto_secretstream_xchacha20poly1305_TAG_FINAL),
+        header,
+    )
+
+
+def encrypt_stream(key: bytes, chunks: Iterator[bytes]) -> tuple[bytes, Iterator[bytes]]:
+    """Encrypt chunks as a stream, as files are encrypted.
+
+    Args:
+        key: The secret key used for encryption.
+        chunks: The chunks to encrypt, of `StreamEncryptionSize` bytes except the last.
+
+    Returns:
+        The header needed for decryption and an iterator of the encrypted
+        chunks, the last one tagged final.
+
+    """
+    state = crypto_secretstream_xchacha20poly1305_state()
+    header = crypto_secretstream_xchacha20poly1305_init_push(state, key)
+
+    def push() -> Iterator[bytes]:
+        chunk = next(chunks, b"")
+        for following in chunks:
+            yield crypto_secretstream_xchacha20poly1305_push(
+                state,
+                chunk,
+                None,
+                crypto_secretstream_xchacha20poly1305_TAG_MESSAGE,
+            )
+            chunk = following
+        yield crypto_secretstream_xchacha20poly1305_push(
+            state,
+            chunk,
+            None,
+            crypto_secretstream_xchacha20poly1305_TAG_FINAL,
+        )
+
+    return (header, push())
+
+
+class StreamDecryptor:
+    """Decrypts the chunks of a stream in order, checking that it ends with the final chunk."""
+
+    def __init__(self, key: bytes, header: bytes) -> None:
+        """Initialise the decryption of a stream.
+
+        Args:
+            key: The secret key used for decryption.
+            header: The header of the stream.
+
+        """
+        self._state = crypto_secretstream_xchacha20poly1305_state()
+        crypto_secretstream_xchacha20poly1305_init_pull(self._state, header, key)
+        self._tag = crypto_secretstream_xchacha20poly1305_TAG_MESSAGE
+
+    def pull(self, data: bytes) -> bytes:
+        """Decrypt the next chunk of the stream.
+
+        Raises:
+            EnteCryptError: If the stream already ended, or the chunk fails to decrypt.
+
+        """
+        if self._tag == crypto_secretstream_xchacha20poly1305_TAG_FINAL:
+            msg = "data after the end of the decryption stream"
+            raise EnteCryptError(msg)
+        try:
+            (msg, self._tag) = crypto_secretstream_xchacha20poly1305_pull(self._state, data, None)
+        except CryptoError as e:
+            err = f"corrupted chunk in the decryption stream: {e}"
+            raise EnteCryptError(err) from e
+        return msg
+
+    def finish(self) -> None:
+        """Check the stream ended with its final chunk.
+
+        Raises:
+            EnteCryptError: If the final chunk was not decrypted.
+
+        """
+        if self._tag != crypto_secretstream_xchacha20poly1305_TAG_FINAL:
+            msg = f"unfinished decryption stream: {self._tag}"
+            raise EnteCryptError(msg)
+
+
+def decrypt_stream(key: bytes, header: bytes, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Decrypt a stream of encrypted chunks, yielding the decrypted chunks.
+
+    Args:
+        key: The secret key used for decryption.
+        header: The header of the stream.
+        chunks: The encrypted chunks, of `CHUNK_SIZE` bytes except the last.
+
+    Yields:
+        The decrypted chunks.
+
+    Raises:
+        EnteCryptError: If a chunk fails to decrypt, or the stream ends before its final chunk.
+
+    """
+    decryptor = StreamDecryptor(key, header)
+    for data in chunks:
+        yield decryptor.pull(data)
+    decryptor.finish()
+
+
+async def adecrypt_stream(key: bytes, header: bytes, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Decrypt an asynchronous stream of encrypted chunks, yielding the decrypted chunks.
+
+    See `decrypt_stream`.
+    """
+    decryptor = StreamDecryptor(key, header)
+    async for data in chunks:
+        yield decryptor.pull(data)
+    decryptor.finish()
+
+
 @contextmanager
-def decrypt_stream_to_file(
+def decrypt_stream_to_file(  # noqa: PLR0913
     dest: Path,
     key: bytes,
     header: bytes,
     progress: Callable[[int], None] | None = None,
+    *,
+    size: int | None = None,
+    fsync: FsyncPolicy = FsyncPolicy.NONE,
 ) -> Generator[Callable[[bytes], None]]:
     """Decrypt a stream of data to a file.
 
     This function uses a context manager to handle the decryption of a stream of data
     and write it to a file. It supports progress reporting via a callback function.
+    The file is written under a temporary name and only renamed to the destination
+    once the stream is complete (see `AtomicFileWriter`).
 
     Args:
         dest: The path to the destination file.
@@ -113,26 +277,77 @@ def decrypt_stream_to_file(
         header: The header used for decryption.
         progress: An optional callback function that takes the number of bytes
             written as an argument.
+        size: The size of the encrypted file, if known, to preallocate the destination.
+        fsync: When the destination is flushed to storage.
 
     Yields:
         A callable that takes a chunk of encrypted data and decrypts/writes it.
 
     """
-    state = crypto_secretstream_xchacha20poly1305_state()
-    crypto_secretstream_xchacha20poly1305_init_pull(state, header, key)
+    decryptor = StreamDecryptor(key, header)
 
-    with Path(dest).open("wb") as f:
-        tag = crypto_secretstream_xchacha20poly1305_TAG_MESSAGE
+    with AtomicFileWriter(dest, size=size, fsync=fsync) as f:
 
         def handle_data(data: bytes) -> None:
-            nonlocal tag
-            (msg, tag) = crypto_secretstream_xchacha20poly1305_pull(state, data, None)
+            msg = decryptor.pull(data)
             f.write(msg)
             if progress:
                 progress(len(msg))
 
         yield handle_data
 
-        if tag != crypto_secretstream_xchacha20poly1305_TAG_FINAL:
-            msg = f"unfinished decryption stream: {tag}"
-            raise EnteCryptError(msg)
+        decryptor.finish()
+        f.commit()
+
+
+def stream_chunk_nonce(header: bytes, chunk_macs: Iterable[bytes]) -> bytes:
+    """Compute the internal nonce of a stream chunk from the MACs of the preceding chunks.
+
+    Each pulled chunk XORs the first bytes of its MAC into the stream's internal
+    nonce, so the nonce of chunk `i` depends on the MACs of chunks `0..i-1`.
+
+    Args:
+        header: The stream header.
+        chunk_macs: The MACs (the last `STREAM_MAC_BYTES` bytes) of the preceding chunks, in order.
+
+    Returns:
+        The internal nonce of the chunk.
+
+    """
+    nonce = bytearray(header[16 : 16 + _STREAM_INONCE_BYTES])
+    for mac in chunk_macs:
+        nonce = next_stream_chunk_nonce(nonce, mac)
+    return bytes(nonce)
+
+
+def next_stream_chunk_nonce(nonce: bytes | bytearray, mac: bytes) -> bytearray:
+    """Compute the internal nonce of the chunk following one with the given nonce and MAC."""
+    return bytearray(a ^ b for (a, b) in zip(nonce, mac[:_STREAM_INONCE_BYTES], strict=True))
+
+
+def decrypt_stream_chunk(key: bytes, header: bytes, index: int, nonce: bytes, data: bytes) -> tuple[bytes, int]:
+    """Decrypt one chunk of a stream without decrypting the preceding chunks.
+
+    The stream state after pulling `index` chunks is the initial state with the
+    counter advanced to `index + 1` and the given internal nonce (see
+    `stream_chunk_nonce`). Streams are never rekeyed by Ente.
+
+    Args:
+        key: The secret key used for decryption.
+        header: The stream header.
+        index: The index of the chunk in the stream.
+        nonce: The internal nonce of the chunk.
+        data: The encrypted chunk.
+
+    Returns:
+        The decrypted chunk and its tag.
+
+    Raises:
+        nacl.exceptions.CryptoError: If the decryption fails.
+
+    """
+    state = crypto_secretstream_xchacha20poly1305_state()
+    crypto_secretstream_xchacha20poly1305_init_pull(state, header, key)
+    state.statebuf[_STREAM_KEY_BYTES : _STREAM_KEY_BYTES + 4] = (index + 1).to_bytes(4, "little")
+    state.statebuf[_STREAM_KEY_BYTES + 4 : _STREAM_KEY_BYTES + 4 + _STREAM_INONCE_BYTES] = nonce
+    return crypto_secretstream_xchacha20poly1305_pull(state, data, None)
@@ -0,0 +1,100 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-memory cache of decrypted collection and file keys."""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+
+from ente_tools.api.core.device import DeviceSecret
+from ente_tools.api.core.types_collection import Collection
+from ente_tools.api.core.types_file import File
+
+
+class KeyCache:
+    """Decrypts collection and file keys on demand and keeps them for the run.
+
+    Collection keys are few and are all kept. File keys are kept in a
+    least-recently used cache of at most `maxsize` keys.
+
+    The cache is thread-safe.
+    """
+
+    MaxSize = 10_000
+    """Default number of file keys kept."""
+
+    def __init__(self, maxsize: int = MaxSize) -> None:
+        """Initialise an empty cache.
+
+        Args:
+            maxsize: The maximum number of file keys kept.
+
+        """
+        self.maxsize = maxsize
+        self._collection_keys: dict[int, bytes] = {}
+        self._file_keys: OrderedDict[int, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def collection_key(self, collection: Collection) -> bytes:
+        """Return the decrypted key of a collection."""
+        key = self._collection_keys.get(collection.id)
+        if key is None:
+            key = collection.enc_collection_key.decrypt()
+            self._collection_keys[collection.id] = key
+        return key
+
+    def add_collections(self, collections: Sequence[Collection]) -> None:
+        """Decrypt the keys of many collections at once."""
+        missing = [c for c in collections if c.id not in self._collection_keys]
+        keys = DeviceSecret.decrypt_many([c.enc_collection_key for c in missing])
+        self._collection_keys.update((c.id, key) for (c, key) in zip(missing, keys, strict=True))
+
+    def file_key(self, file: File, collection: Callable[[int], Collection]) -> bytes:
+        """Return the decrypted key of a file.
+
+        Args:
+            file: The file.
+            collection: Looks up a collection by ID, called only if the key of the
+                file's collection is not cached yet.
+
+        Returns:
+            The decrypted file key.
+
+        """
+        with self._lock:
+            key = self._file_keys.get(file.id)
+            if key is not None:
+                self._file_keys.move_to_end(file.id)
+                return key
+
+        if file.enc_file_key is not None:
+            key = file.enc_file_key.decrypt()
+        else:
+            ckey = self._collection_keys.get(file.collection_id)
+            if ckey is None:
+                ckey = self.collection_key(collection(file.collection_id))
+            key = file.file_key(ckey)
+
+        with self._lock:
+            self._file_keys[file.id] = key
+            self._file_keys.move_to_end(file.id)
+            while len(self._file_keys) > self.maxsize:
+                self._file_keys.popitem(last=False)
+        return key
+
+    def clear(self) -> None:
+        """Forget all keys."""
+        with self._lock:
+            self._collection_keys.clear()
+            self._file_keys.clear()
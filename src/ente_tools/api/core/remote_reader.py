@@ -0,0 +1,233 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Seekable reader decrypting remote files chunk by chunk."""
+
+import io
+import logging
+import os
+from collections import OrderedDict
+from collections.abc import Callable
+
+from nacl.bindings import crypto_secretstream_xchacha20poly1305_TAG_FINAL
+from nacl.exceptions import CryptoError
+
+from ente_tools.api.core.ente_crypt import (
+    STREAM_MAC_BYTES,
+    EnteCryptError,
+    StreamEncryptionSize,
+    decrypt_stream_chunk,
+    next_stream_chunk_nonce,
+    stream_chunk_nonce,
+)
+
+log = logging.getLogger(__name__)
+
+type RangeFetcher = Callable[[int, int], tuple[bytes, int]]
+"""Fetches the bytes from start to end (exclusive) of a remote file, returning them and the file's size."""
+
+_CHUNK_OVERHEAD = 1 + STREAM_MAC_BYTES
+
+
+class ReadBudgetExceededError(Exception):
+    """Raised when reading needs more chunks than the reader is allowed to fetch."""
+
+
+class RemoteDecryptedReader(io.RawIOBase):
+    """A seekable, read-only file of the decrypted content of a remote encrypted file.
+
+    Only the encrypted chunks covering the bytes read are fetched, each with the
+    MAC of the preceding chunk. Decrypted chunks are kept in a least-recently
+    used cache.
+
+    The internal nonce of a chunk depends on the MACs of all preceding chunks,
+    so the first read far into a file also fetches the MACs of the chunks that
+    were skipped, with one small request each. They are kept, so later seeks
+    are cheap.
+    """
+
+    CacheChunks = 4
+    """Default number of decrypted chunks kept."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        fetch: RangeFetcher,
+        key: bytes,
+        header: bytes,
+        *,
+        size: int | None = None,
+        chunk_size: int = StreamEncryptionSize,
+        cache_chunks: int = CacheChunks,
+        max_chunks: int | None = None,
+    ) -> None:
+        """Initialise the reader.
+
+        Args:
+            fetch: Fetches a byte range of the encrypted file.
+            key: The decrypted file key.
+            header: The decryption header of the file.
+            size: The size of the encrypted file, if known; otherwise it is
+                learned from the first fetch.
+            chunk_size: The size of the decrypted chunks the file was encrypted in.
+            cache_chunks: The number of decrypted chunks kept.
+            max_chunks: The maximum number of chunks fetched, or None for no limit;
+                reading more raises `ReadBudgetExceededError`.
+
+        """
+        super().__init__()
+        self._fetch = fetch
+        self._key = key
+        self._header = header
+        self._size = size
+        self._plain_chunk = chunk_size
+        self._enc_chunk = chunk_size + _CHUNK_OVERHEAD
+        self._cache_chunks = cache_chunks
+        self._cache: OrderedDict[int, bytes] = OrderedDict()
+        self._macs: dict[int, bytes] = {}
+        self._nonces: list[bytes] = [stream_chunk_nonce(header, [])]
+        self._pos = 0
+        self._max_chunks = max_chunks
+        self.fetched_bytes = 0
+        """The number of encrypted bytes fetched so far."""
+        self.fetched_chunks = 0
+        """The number of chunks fetched so far."""
+
+    def _get(self, start: int, end: int) -> bytes:
+        (data, size) = self._fetch(start, end)
+        self._size = size
+        self.fetched_bytes += len(data)
+        return data
+
+    @property
+    def encrypted_size(self) -> int:
+        """The size of the encrypted file."""
+        if self._size is None:
+            self._get(0, 1)
+        assert self._size is not None
+        return self._size
+
+    @property
+    def chunks(self) -> int:
+        """The number of chunks in the file."""
+        return max(1, -(-self.encrypted_size // self._enc_chunk))
+
+    @property
+    def size(self) -> int:
+        """The size of the decrypted file."""
+        return self.encrypted_size - self.chunks * _CHUNK_OVERHEAD
+
+    def _chunk_end(self, index: int) -> int:
+        end = (index + 1) * self._enc_chunk
+        return end if self._size is None else min(end, self._size)
+
+    def _nonce(self, index: int) -> bytes:
+        """Return the internal nonce of a chunk, fetching the MACs of skipped chunks."""
+        while len(self._nonces) <= index:
+            i = len(self._nonces) - 1
+            mac = self._macs.get(i)
+            if mac is None:
+                end = self._chunk_end(i)
+                log.debug("Fetching MAC of chunk %d", i)
+                mac = self._macs[i] = self._get(end - STREAM_MAC_BYTES, end)
+            self._nonces.append(bytes(next_stream_chunk_nonce(self._nonces[i], mac)))
+        return self._nonces[index]
+
+    def _chunk(self, index: int) -> bytes:
+        """Return a decrypted chunk, from the cache or by fetching it."""
+        chunk = self._cache.get(index)
+        if chunk is not None:
+            self._cache.move_to_end(index)
+            return chunk
+
+        if self._max_chunks is not None and self.fetched_chunks >= self._max_chunks:
+            msg = f"reading chunk {index} exceeds the budget of {self._max_chunks} chunks"
+            raise ReadBudgetExceededError(msg)
+        self.fetched_chunks += 1
+
+        # Fetch the chunk together with the MAC of the preceding chunk
+        start = index * self._enc_chunk
+        fetch_start = start - STREAM_MAC_BYTES if index > 0 and len(self._nonces) <= index else start
+        data = self._get(fetch_start, self._chunk_end(index))
+        if fetch_start < start:
+            self._macs.setdefault(index - 1, data[:STREAM_MAC_BYTES])
+            data = data[STREAM_MAC_BYTES:]
+        self._macs[index] = data[-STREAM_MAC_BYTES:]
+
+        try:
+            (chunk, tag) = decrypt_stream_chunk(self._key, self._header, index, self._nonce(index), data)
+        except CryptoError as e:
+            msg = f"corrupted chunk {index} of {self.chunks}: {e}"
+            raise EnteCryptError(msg) from e
+        if (tag == crypto_secretstream_xchacha20poly1305_TAG_FINAL) != (index == self.chunks - 1):
+            msg = f"unexpected tag {tag} for chunk {index} of {self.chunks}"
+            raise EnteCryptError(msg)
+
+        self._cache[index] = chunk
+        if len(self._cache) > self._cache_chunks:
+            self._cache.popitem(last=False)
+        return chunk
+
+    def readable(self) -> bool:
+        """Return True: the reader is readable."""
+        return True
+
+    def seekable(self) -> bool:
+        """Return True: the reader supports random access."""
+        return True
+
+    def tell(self) -> int:
+        """Return the current position in the decrypted file."""
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """Move to a position in the decrypted file.
+
+        Returns:
+            The new position.
+
+        """
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.size + offset
+        else:
+            msg = f"invalid whence {whence}"
+            raise ValueError(msg)
+        if pos < 0:
+            msg = f"negative seek position {pos}"
+            raise ValueError(msg)
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:  # type: ignore[override]
+        """Read decrypted bytes into a buffer.
+
+        Returns:
+            The number of bytes read, 0 at the end of the file.
+
+        """
+        view = memoryview(buffer).cast("B")
+        if self._size is None and view:
+            # Learn the size from the first chunk read rather than a separate request
+            self._chunk(self._pos // self._plain_chunk)
+        n = 0
+        while n < len(view) and self._pos < self.size:
+            (index, offset) = divmod(self._pos, self._plain_chunk)
+            chunk = self._chunk(index)
+            count = min(len(view) - n, len(chunk) - offset)
+            view[n : n + count] = chunk[offset : offset + count]
+            n += count
+            self._pos += count
+        return n
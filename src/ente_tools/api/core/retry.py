@@ -0,0 +1,227 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Retry policy shared by the requests of the API client."""
+
+import logging
+import random
+import threading
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+
+import httpx
+from pydantic import BaseModel, Field
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset(
+    {
+        HTTPStatus.TOO_MANY_REQUESTS,
+        HTTPStatus.INTERNAL_SERVER_ERROR,
+        HTTPStatus.BAD_GATEWAY,
+        HTTPStatus.SERVICE_UNAVAILABLE,
+        HTTPStatus.GATEWAY_TIMEOUT,
+    },
+)
+"""Statuses of idempotent requests that are retried."""
+
+UNPROCESSED_STATUSES = frozenset({HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE})
+"""Statuses of requests the server did not process, so even non-idempotent requests are retried."""
+
+
+class RetryPolicy(BaseModel):
+    """How failed requests are retried."""
+
+    max_attempts: int = 5
+    """The maximum number of attempts of one request, including the first."""
+    base_delay: float = 0.5
+    """The delay before the first retry, doubled for each further retry."""
+    max_delay: float = 60.0
+    """The maximum delay before a retry, also capping the delays asked for by `Retry-After`."""
+    budget: int = 100
+    """The maximum number of retries of all requests in the run, so an unavailable server fails fast."""
+
+
+class EndpointStats(BaseModel):
+    """Request statistics of an endpoint."""
+
+    requests: int = 0
+    """The number of attempts, including retries."""
+    retries: int = 0
+    failures: int = 0
+    """The number of requests that failed after any retries."""
+    statuses: dict[int, int] = Field(default_factory=dict)
+    """The number of responses by unsuccessful status; transport errors count as 0."""
+
+
+class Retrier:
+    """Applies a retry policy to requests, tracking the run's budget and per-endpoint statistics.
+
+    Delays use exponential backoff with full jitter, unless the server asks for
+    a delay with `Retry-After`. The retrier is thread-safe and is shared by all
+    the requests of a client.
+    """
+
+    def __init__(
+        self,
+        policy: RetryPolicy | None = None,
+        *,
+        rng: Callable[[], float] = random.random,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Initialise the retrier.
+
+        Args:
+            policy: The retry policy; defaults to `RetryPolicy()`.
+            rng: Returns a random number in [0, 1), for the jitter.
+            sleep: Waits for a number of seconds.
+
+        """
+        self.policy = policy or RetryPolicy()
+        self.budget = self.policy.budget
+        """The number of retries left in the run."""
+        self.stats: dict[str, EndpointStats] = {}
+        self.observers: list[Callable[[str, int], None]] = []
+        """Called with the endpoint and status of every failed attempt; the status of transport errors is 0."""
+        self._rng = rng
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def _stats(self, endpoint: str) -> EndpointStats:
+        stats = self.stats.get(endpoint)
+        if stats is None:
+            stats = self.stats[endpoint] = EndpointStats()
+        return stats
+
+    def attempt(self, endpoint: str) -> None:
+        """Record an attempt of a request."""
+        with self._lock:
+            self._stats(endpoint).requests += 1
+
+    def backoff(self, attempt: int, retry_after: str | None = None) -> float:
+        """Return the delay before retrying after a failed attempt.
+
+        Args:
+            attempt: The number of the failed attempt, from 1.
+            retry_after: The `Retry-After` header of the response, if any: a number
+                of seconds or an HTTP date.
+
+        """
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - datetime.now(UTC)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0), self.policy.max_delay)
+        return self._rng() * min(self.policy.max_delay, self.policy.base_delay * 2 ** (attempt - 1))
+
+    def retry_delay(
+        self,
+        endpoint: str,
+        attempt: int,
+        response: httpx.Response | None = None,
+        *,
+        idempotent: bool = True,
+    ) -> float | None:
+        """Record a failed attempt, and decide whether and when to retry it.
+
+        Args:
+            endpoint: The endpoint of the request, for the statistics.
+            attempt: The number of the failed attempt, from 1.
+            response: The unsuccessful response, or None after a transport error.
+            idempotent: Whether the request can be repeated safely; otherwise only
+                requests the server did not process are retried.
+
+        Returns:
+            The delay before retrying, or None to give up.
+
+        """
+        status = response.status_code if response is not None else 0
+        statuses = RETRY_STATUSES if idempotent else UNPROCESSED_STATUSES
+        retryable = status in statuses if response is not None else idempotent
+        for observer in self.observers:
+            observer(endpoint, status)
+        with self._lock:
+            stats = self._stats(endpoint)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if not retryable or attempt >= self.policy.max_attempts or self.budget <= 0:
+                stats.failures += 1
+                return None
+            self.budget -= 1
+            stats.retries += 1
+        delay = self.backoff(attempt, response.headers.get("Retry-After") if response is not None else None)
+        log.info("Retrying %s after %s in %.1fs (attempt %d)", endpoint, status or "transport error", delay, attempt)
+        return delay
+
+    def send(
+        self,
+        endpoint: str,
+        request: Callable[[], httpx.Response],
+        *,
+        idempotent: bool = True,
+    ) -> httpx.Response:
+        """Send a request, retrying it according to the policy.
+
+        Args:
+            endpoint: The endpoint of the request, for the statistics.
+            request: Sends the request.
+            idempotent: Whether the request can be repeated safely.
+
+        Returns:
+            The successful response, or the last unsuccessful one.
+
+        Raises:
+            httpx.TransportError: If the last attempt failed without a response.
+
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self.attempt(endpoint)
+            try:
+                r = request()
+            except httpx.TransportError:
+                delay = self.retry_delay(endpoint, attempt, idempotent=idempotent)
+                if delay is None:
+                    raise
+            else:
+                if r.is_success:
+                    return r
+                delay = self.retry_delay(endpoint, attempt, r, idempotent=idempotent)
+                if delay is None:
+                    return r
+            self._sleep(delay)
+
+    def sleep(self, delay: float) -> None:
+        """Wait before a retry made by the caller."""
+        self._sleep(delay)
+
+    def log_stats(self) -> None:
+        """Log the statistics of the endpoints that needed retries or failed."""
+        for endpoint, stats in sorted(self.stats.items()):
+            if stats.retries or stats.failures:
+                log.info(
+                    "Endpoint %s: %d requests, %d retries, %d failures, statuses %s",
+                    endpoint,
+                    stats.requests,
+                    stats.retries,
+                    stats.failures,
+                    stats.statuses,
+                )
@@ -16,6 +16,7 @@
 import json
 import logging
 from base64 import urlsafe_b64decode
+from collections.abc import Sequence
 from typing import Any
 
 from pydantic import BaseModel, Field
@@ -102,9 +103,28 @@ class EncryptedCollection(BaseModel):
         return key.unseal(urlsafe_b64decode(self.encrypted_key))
 
     def to_collection(self, ente_key: EnteKeys) -> Collection:
-        """DocString."""
-        key = self.collection_key(ente_key)
+        """Decrypt the collection, keeping its key encrypted with the device key."""
+        return self.to_collections([self], ente_key)[0]
+
+    @staticmethod
+    def to_collections(collections: Sequence["EncryptedCollection"], ente_key: EnteKeys) -> list[Collection]:
+        """Decrypt many collections, encrypting their keys with the device key in one pass.
+
+        Args:
+            collections: The encrypted collections.
+            ente_key: The keys of the account.
+
+        Returns:
+            The decrypted collections, in the same order.
+
+        """
+        keys = [c.collection_key(ente_key) for c in collections]
+        return [
+            c._decrypt(key, enc_key)  # noqa: SLF001
+            for (c, key, enc_key) in zip(collections, keys, DeviceSecret.encrypt_many(keys), strict=True)
+        ]
 
+    def _decrypt(self, key: bytes, enc_key: DeviceSecret) -> Collection:
         name = self.name
         if self.encrypted_name and self.name_decryption_nonce:
             name = str(
@@ -119,7 +139,7 @@ class EncryptedCollection(BaseModel):
         return Collection(
             id=self.id,
             owner=self.owner,
-            enc_collection_key=DeviceSecret.encrypt(key),
+            enc_collection_key=enc_key,
             name=name,
             type=self.type,
             sharees=self.sharees,
@@ -21,9 +21,10 @@ from nacl.bindings import (
 )
 from nacl.pwhash.argon2id import kdf
 from nacl.secret import SecretBox
-from nacl.utils import random
 from pydantic import BaseModel, Field
 
+from ente_tools.api.core.device import DeviceCrypto
+
 log = logging.getLogger(__name__)
 
 
@@ -127,6 +128,10 @@ class EnteKeys(BaseModel):
         )
 
 
+def _crypto(key: bytes | DeviceCrypto) -> DeviceCrypto:
+    return key if isinstance(key, DeviceCrypto) else DeviceCrypto(key)
+
+
 class SecretPair(BaseModel):
     """An encrypted secret and its associated nonce."""
 
@@ -134,17 +139,14 @@ class SecretPair(BaseModel):
     nonce: str
 
     @staticmethod
-    def encrypt(key: bytes, msg: bytes) -> "SecretPair":
+    def encrypt(key: bytes | DeviceCrypto, msg: bytes) -> "SecretPair":
         """Encrypt a message with a given key and generate a nonce."""
-        nonce = random(SecretBox.NONCE_SIZE)
-        return SecretPair(
-            encrypted=str(urlsafe_b64encode(SecretBox(key).encrypt(msg, nonce).ciphertext), "utf-8"),
-            nonce=str(urlsafe_b64encode(nonce), "utf-8"),
-        )
+        (encrypted, nonce) = _crypto(key).encrypt(msg)
+        return SecretPair(encrypted=encrypted, nonce=nonce)
 
-    def decrypt(self, key: bytes) -> bytes:
-        """DocString."""
-        return SecretBox(key).decrypt(urlsafe_b64decode(self.encrypted), nonce=urlsafe_b64decode(self.nonce))
+    def decrypt(self, key: bytes | DeviceCrypto) -> bytes:
+        """Decrypt the secret with a given key."""
+        return _crypto(key).decrypt(self)
 
 
 class EnteEncKeys(BaseModel):
@@ -157,22 +159,29 @@ class EnteEncKeys(BaseModel):
     public_key: str
 
     @staticmethod
-    def from_keys(device_key: bytes, keys: EnteKeys) -> "EnteEncKeys":
+    def from_keys(device_key: bytes | DeviceCrypto, keys: EnteKeys) -> "EnteEncKeys":
         """Encrypt EnteKeys using a device key for secure storage."""
+        (master_key, secret_key, token) = (
+            SecretPair(encrypted=e, nonce=n)
+            for (e, n) in _crypto(device_key).encrypt_many([keys.master_key, keys.secret_key, keys.token])
+        )
         return EnteEncKeys(
             user_id=keys.user_id,
-            master_key=SecretPair.encrypt(device_key, keys.master_key),
-            secret_key=SecretPair.encrypt(device_key, keys.secret_key),
-            token=SecretPair.encrypt(device_key, keys.token),
+            master_key=master_key,
+            secret_key=secret_key,
+            token=token,
             public_key=str(urlsafe_b64encode(keys.public_key), "utf-8"),
         )
 
-    def to_keys(self, device_key: bytes) -> EnteKeys:
-        """DocString."""
+    def to_keys(self, device_key: bytes | DeviceCrypto) -> EnteKeys:
+        """Decrypt the keys using a device key."""
+        (master_key, secret_key, token) = _crypto(device_key).decrypt_many(
+            [self.master_key, self.secret_key, self.token],
+        )
         return EnteKeys(
             user_id=self.user_id,
-            master_key=self.master_key.decrypt(device_key),
-            secret_key=self.secret_key.decrypt(device_key),
-            token=self.token.decrypt(device_key),
+            master_key=master_key,
+            secret_key=secret_key,
+            token=token,
             public_key=urlsafe_b64decode(self.public_key),
         )
@@ -15,13 +15,17 @@
 
 import json
 import logging
+import threading
 from base64 import urlsafe_b64decode
+from collections import OrderedDict
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
 from typing import Any
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
 
 from ente_tools.api.core.device import DeviceSecret
-from ente_tools.api.core.ente_crypt import decrypt, decrypt_blob
+from ente_tools.api.core.ente_crypt import EnteCryptError, decrypt, decrypt_blob
 from ente_tools.api.core.types_collection import MagicMetadata
 
 log = logging.getLogger(__name__)
@@ -59,22 +63,204 @@ class FileAttributes(BaseModel):
         return json.loads(str(blob, "utf-8"))
 
 
+def unwrap_file_key(collection_key: bytes, encrypted_key: str, key_decryption_nonce: str) -> bytes:
+    """Decrypt a file's encryption key using the collection key.
+
+    Args:
+        collection_key: The collection's decryption key
+        encrypted_key: The encrypted file key, base64 encoded
+        key_decryption_nonce: The nonce of the encrypted file key, base64 encoded
+
+    Returns:
+        The decrypted file key as bytes
+
+    """
+    return decrypt(collection_key, urlsafe_b64decode(key_decryption_nonce), urlsafe_b64decode(encrypted_key))
+
+
+class MetadataCache:
+    """Least-recently used cache of decrypted file metadata.
+
+    Entries are keyed by the file ID and update time, so a file updated on the
+    server is decrypted again.
+
+    The cache is thread-safe.
+    """
+
+    MaxSize = 50_000
+    """Default number of files whose metadata is kept."""
+
+    def __init__(self, maxsize: int = MaxSize) -> None:
+        """Initialise an empty cache.
+
+        Args:
+            maxsize: The maximum number of files whose metadata is kept.
+
+        """
+        self.maxsize = maxsize
+        self._entries: OrderedDict[tuple[int, int], dict[str, dict[str, Any]]] = OrderedDict()
+        self._reserved: list[int] = []
+        self._lock = threading.Lock()
+
+    def get(self, file_id: int, update_time: int) -> dict[str, dict[str, Any]]:
+        """Return the decrypted metadata of a file by name, adding an entry if missing."""
+        k = (file_id, update_time)
+        with self._lock:
+            entry = self._entries.get(k)
+            if entry is not None:
+                self._entries.move_to_end(k)
+                return entry
+            entry = self._entries[k] = {}
+            self._evict()
+            return entry
+
+    @contextmanager
+    def reserve(self, size: int) -> Iterator[None]:
+        """Grow the cache to hold `size` files, besides those of other reservations, while in the context.
+
+        On exit the cache shrinks back to `maxsize`, so the metadata of a large
+        account is not kept for the life of the process.
+        """
+        with self._lock:
+            self._reserved.append(size)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reserved.remove(size)
+                self._evict()
+
+    def _evict(self) -> None:
+        limit = max(self.maxsize, sum(self._reserved))
+        while len(self._entries) > limit:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Forget all decrypted metadata."""
+        with self._lock:
+            self._entries.clear()
+
+
+metadata_cache = MetadataCache()
+"""The cache of decrypted file metadata, shared by all files."""
+
+
 class File(BaseModel):
-    """Decrypted file information."""
+    """File information with its encrypted key and metadata.
+
+    The file key is kept as provided by the server, encrypted with the key of
+    the collection, and is only decrypted when needed (see `file_key`). The
+    metadata is also kept encrypted and is decrypted on first access with the
+    key resolver bound by the account (see `bind_key`).
+    """
 
     id: int
     owner_id: int
-    enc_file_key: DeviceSecret
+    encrypted_key: str = ""
+    """The file key encrypted with the collection key, base64 encoded."""
+    key_decryption_nonce: str = ""
+    """The nonce of the encrypted file key, base64 encoded."""
+    enc_file_key: DeviceSecret | None = None
+    """The file key encrypted with the device key, for files saved before the server's key was kept."""
     collection_id: int
     collection_owner_id: int
     file: FileAttributes
     thumbnail: FileAttributes
-    metadata: dict[str, Any]
+    enc_metadata: FileAttributes | None = None
+    """The encrypted metadata."""
     is_deleted: bool
     update_time: int
-    magic_metadata: dict[str, Any]
-    pub_magic_metadata: dict[str, Any]
+    enc_magic_metadata: MagicMetadata | None = None
+    """The encrypted private magic metadata."""
+    enc_pub_magic_metadata: MagicMetadata | None = None
+    """The encrypted public magic metadata."""
     info: FileInfo | None = Field(default=None)
+    plain_metadata: dict[str, dict[str, Any]] | None = None
+    """The metadata by name, for files saved decrypted before the encrypted metadata was kept."""
+
+    _key: Callable[["File"], bytes] | None = PrivateAttr(default=None)
+
+    @model_validator(mode="before")
+    @classmethod
+    def _from_decrypted(cls, data: Any) -> Any:  # noqa: ANN401
+        """Move the metadata of files saved decrypted to `plain_metadata`."""
+        if isinstance(data, dict) and "metadata" in data and "enc_metadata" not in data:
+            data = dict(data)
+            data["plain_metadata"] = {name: data.pop(name, None) or {} for name in _METADATA}
+        return data
+
+    def file_key(self, collection_key: bytes) -> bytes:
+        """Decrypt the file's encryption key using the collection key.
+
+        Args:
+            collection_key: The decryption key of the file's collection
+
+        Returns:
+            The decrypted file key as bytes
+
+        """
+        if self.enc_file_key is not None:
+            return self.enc_file_key.decrypt()
+        return unwrap_file_key(collection_key, self.encrypted_key, self.key_decryption_nonce)
+
+    def bind_key(self, key: Callable[["File"], bytes]) -> None:
+        """Set how to obtain the decrypted file key, used to decrypt the metadata."""
+        self._key = key
+
+    def _decrypted(self, name: str) -> dict[str, Any]:
+        if self.plain_metadata is not None:
+            return self.plain_metadata.get(name, {})
+
+        entry = metadata_cache.get(self.id, self.update_time)
+        value = entry.get(name)
+        if value is None:
+            encrypted: FileAttributes | MagicMetadata | None = getattr(self, f"enc_{name}")
+            if encrypted is None:
+                value = {}
+            elif self._key is None:
+                msg = f"file {self.id} has no key to decrypt its {name}"
+                raise EnteCryptError(msg)
+            else:
+                value = encrypted.decrypt(self._key(self))
+            entry[name] = value
+        return value
+
+    @property
+    def metadata(self) -> dict[str, Any]:
+        """The decrypted metadata, such as the title and hash."""
+        return self._decrypted("metadata")
+
+    @property
+    def magic_metadata(self) -> dict[str, Any]:
+        """The decrypted private magic metadata."""
+        return self._decrypted("magic_metadata")
+
+    @property
+    def pub_magic_metadata(self) -> dict[str, Any]:
+        """The decrypted public magic metadata."""
+        return self._decrypted("pub_magic_metadata")
+
+
+_METADATA = ("metadata", "magic_metadata", "pub_magic_metadata")
+
+
+@contextmanager
+def decrypt_metadata(files: Sequence[File]) -> Iterator[None]:
+    """Decrypt the metadata of many files up front, keeping it cached while in the context.
+
+    Use this when the files' metadata will be read repeatedly; the cache is
+    grown to hold all of them until the context exits. Only `metadata`, with
+    the hash and title, is decrypted; the magic metadata is still decrypted on
+    first access.
+
+    Args:
+        files: The files, with their keys bound.
+
+    """
+    with metadata_cache.reserve(len(files)):
+        for f in files:
+            f._decrypted("metadata")  # noqa: SLF001
+        yield
 
 
 class EncryptedFile(BaseModel):
@@ -111,39 +297,47 @@ class EncryptedFile(BaseModel):
             The decrypted file key as bytes
 
         """
-        return decrypt(
-            collection_key,
-            urlsafe_b64decode(self.key_decryption_nonce),
-            urlsafe_b64decode(self.encrypted_key),
-        )
+        return unwrap_file_key(collection_key, self.encrypted_key, self.key_decryption_nonce)
 
-    def to_file(self, collection_key: bytes) -> File:
-        """Convert encrypted file to decrypted File object.
+    def to_file(self) -> File:
+        """Convert encrypted file to a File object.
 
-        Args:
-            collection_key: The collection's decryption key
+        The file key and the metadata are kept encrypted.
 
         Returns:
-            A File object containing the decrypted data
+            A File object
 
         """
-        key = self.file_key(collection_key)
-        metadata = self.metadata.decrypt(key) if self.metadata else {}
-        pub_metadata = self.pub_magic_metadata.decrypt(key) if self.pub_magic_metadata else {}
-        magic_metadata = self.magic_metadata.decrypt(key) if self.magic_metadata else {}
-
         return File(
             id=self.id,
             owner_id=self.owner_id,
-            enc_file_key=DeviceSecret.encrypt(key),
+            encrypted_key=self.encrypted_key,
+            key_decryption_nonce=self.key_decryption_nonce,
             collection_id=self.collection_id,
             collection_owner_id=self.collection_owner_id,
             file=self.file,
             thumbnail=self.thumbnail,
-            metadata=metadata,
+            enc_metadata=self.metadata,
             is_deleted=self.is_deleted,
             update_time=self.update_time,
-            magic_metadata=magic_metadata,
-            pub_magic_metadata=pub_metadata,
+            enc_magic_metadata=self.magic_metadata,
+            enc_pub_magic_metadata=self.pub_magic_metadata,
             info=self.info,
         )
+
+
+class UploadURL(BaseModel):
+    """A presigned URL to upload an object to in one request."""
+
+    object_key: str = Field(alias="objectKey")
+    url: str
+
+
+class MultipartUploadURLs(BaseModel):
+    """The presigned URLs to upload an object to in parts."""
+
+    object_key: str = Field(alias="objectKey")
+    part_urls: list[str] = Field(alias="partURLs")
+    """The URL of each part, in order."""
+    complete_url: str = Field(alias="completeURL")
+    """The URL to complete the upload at, once all parts are uploaded."""
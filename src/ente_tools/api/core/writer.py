@@ -0,0 +1,183 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Atomic writes of downloaded files."""
+
+import hashlib
+import logging
+import os
+import tempfile
+from base64 import b64encode, urlsafe_b64encode
+from enum import StrEnum
+from pathlib import Path
+from types import TracebackType
+from typing import Self
+
+log = logging.getLogger(__name__)
+
+# The umask can only be read by setting it, which is not thread-safe, so it is read once
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+WriteBufferSize = 8 * 1024 * 1024
+"""Number of bytes gathered before writing them out."""
+
+WriteAlignment = 1024 * 1024
+"""Alignment of the offsets and sizes of the writes, except the last."""
+
+
+class HashMismatchError(Exception):
+    """Raised when written content does not match its expected hash."""
+
+
+class FsyncPolicy(StrEnum):
+    """When written files are flushed to storage."""
+
+    NONE = "none"
+    """Leave flushing to the operating system; a crash may lose recently renamed files."""
+    FILE = "file"
+    """Flush the content before renaming, so a file never appears with content missing after a crash."""
+    FULL = "full"
+    """Also flush the directory after renaming, so the new name survives a crash too."""
+
+
+class AtomicFileWriter:
+    """A binary sink writing a file under a temporary name, renamed into place when complete.
+
+    The temporary file is in the destination's directory, so the rename is
+    atomic: the destination either does not exist or has the complete content,
+    even if the process is killed. Where the size is known, the file is
+    preallocated so concurrent downloads do not fragment each other, and
+    writes are gathered into large aligned blocks.
+
+    Use as a context manager, and call `commit` once all the content is
+    written; otherwise the temporary file is removed on exit.
+    """
+
+    def __init__(
+        self,
+        dest: Path,
+        *,
+        size: int | None = None,
+        fsync: FsyncPolicy = FsyncPolicy.NONE,
+        expected_hash: str | None = None,
+        buffer_size: int = WriteBufferSize,
+    ) -> None:
+        """Initialise the writer; the temporary file is created on entry.
+
+        Args:
+            dest: The file to write.
+            size: The expected size of the content, or an upper bound, to preallocate.
+            fsync: When the file is flushed to storage.
+            expected_hash: The base64 encoded blake2b hash the content must match,
+                in either alphabet, or None to not verify it.
+            buffer_size: The number of bytes gathered before writing them out.
+
+        """
+        self.dest = dest
+        self.size = size
+        self.fsync = fsync
+        self.expected_hash = expected_hash
+        self.buffer_size = max(buffer_size, WriteAlignment)
+        self.written = 0
+        """The number of bytes written."""
+        self._buffer = bytearray()
+        self._hash = hashlib.blake2b()
+        self._fd = -1
+        self._tmp: Path | None = None
+
+    def __enter__(self) -> Self:
+        """Create the temporary file, preallocating it if the size is known."""
+        (self._fd, name) = tempfile.mkstemp(dir=self.dest.parent, prefix=f".{self.dest.name}.", suffix=".part")
+        self._tmp = Path(name)
+        # Temporary files are private, the downloaded file gets the usual permissions
+        self._tmp.chmod(0o666 & ~_UMASK)
+        if self.size:
+            try:
+                os.posix_fallocate(self._fd, 0, self.size)
+            except (OSError, AttributeError) as e:
+                # Not supported by the platform or the filesystem
+                log.debug("Cannot preallocate %s: %s", self._tmp, e)
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        """Remove the temporary file, unless committed."""
+        self._close()
+        if self._tmp is not None:
+            self._tmp.unlink(missing_ok=True)
+            self._tmp = None
+
+    @property
+    def hash(self) -> str:
+        """The hash of the content written so far, encoded as local files' hashes are."""
+        return str(urlsafe_b64encode(self._hash.digest()), "utf-8")
+
+    def write(self, data: bytes) -> int:
+        """Write data, returning its length."""
+        self._hash.update(data)
+        self._buffer += data
+        self.written += len(data)
+        if len(self._buffer) >= self.buffer_size:
+            # Keep the offsets aligned by writing whole blocks, leaving the remainder for later
+            self._write_out(len(self._buffer) - len(self._buffer) % WriteAlignment)
+        return len(data)
+
+    def _write_out(self, n: int) -> None:
+        with memoryview(self._buffer) as view:
+            offset = 0
+            while offset < n:
+                offset += os.write(self._fd, view[offset:n])
+        del self._buffer[:n]
+
+    def commit(self) -> None:
+        """Verify the content, and rename the file into place.
+
+        Raises:
+            HashMismatchError: If the content does not match the expected hash; the
+                temporary file is removed on exit.
+
+        """
+        digest = self._hash.digest()
+        if self.expected_hash is not None and self.expected_hash not in {
+            str(b64encode(digest), "utf-8"),
+            str(urlsafe_b64encode(digest), "utf-8"),
+        }:
+            msg = f"{self.dest}: content hash {self.hash} does not match {self.expected_hash}"
+            raise HashMismatchError(msg)
+
+        self._write_out(len(self._buffer))
+        # Release what was preallocated beyond the content
+        os.ftruncate(self._fd, self.written)
+        if self.fsync != FsyncPolicy.NONE:
+            os.fsync(self._fd)
+        self._close()
+
+        assert self._tmp is not None
+        self._tmp.replace(self.dest)
+        self._tmp = None
+        if self.fsync == FsyncPolicy.FULL:
+            fd = os.open(self.dest.parent, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -0,0 +1,134 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Integrity audit of remote files, decrypting and hashing them without storing them."""
+
+import hashlib
+import logging
+import time
+from base64 import b64encode, urlsafe_b64encode
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+from ente_tools.api.core.api import EnteAPI
+from ente_tools.api.core.ente_crypt import EnteCryptError
+from ente_tools.api.core.types_file import File
+
+log = logging.getLogger(__name__)
+
+type AuditStatus = Literal["ok", "mismatch", "corrupt", "error", "unverified"]
+"""The outcome of auditing a file:
+
+- ok: the file decrypted and matched its hash.
+- mismatch: the file decrypted, but did not match its hash.
+- corrupt: the file failed to decrypt, or was truncated.
+- error: the file could not be downloaded.
+- unverified: the file decrypted, but has no single hash to compare with (e.g. live photos).
+"""
+
+
+class HashingSink:
+    """A binary sink hashing what is written to it, as local files are hashed."""
+
+    def __init__(self) -> None:
+        """Initialise the sink."""
+        self._hash = hashlib.blake2b()
+        self.size = 0
+        """The number of bytes written."""
+
+    def write(self, data: bytes) -> int:
+        """Hash data, returning its length."""
+        self._hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def matches(self, expected: str) -> bool:
+        """Return whether the hash matches a base64 encoded hash, in either alphabet."""
+        digest = self._hash.digest()
+        return expected in {str(b64encode(digest), "utf-8"), str(urlsafe_b64encode(digest), "utf-8")}
+
+
+class AuditResult(BaseModel):
+    """The result of auditing a remote file."""
+
+    file_id: int
+    update_time: int
+    """The update time of the file when it was audited."""
+    status: AuditStatus
+    size: int = 0
+    """The number of decrypted bytes."""
+    detail: str | None = None
+    """Why the file failed the audit, if it did."""
+    audit_time: float = Field(default_factory=time.time)
+    """When the file was audited, in seconds since the epoch."""
+
+
+class AuditReport(BaseModel):
+    """Summary of an audit run."""
+
+    counts: dict[str, int] = Field(default_factory=dict)
+    """The number of files by status."""
+    failed: dict[int, str] = Field(default_factory=dict)
+    """The status of the files that were mismatched, corrupt or not downloaded, by file ID."""
+    size: int = 0
+    """The number of decrypted bytes audited."""
+    seconds: float = 0.0
+    """The duration of the run."""
+
+    def add(self, result: AuditResult) -> None:
+        """Add the result of a file."""
+        self.counts[result.status] = self.counts.get(result.status, 0) + 1
+        self.size += result.size
+        if result.status not in {"ok", "unverified"}:
+            self.failed[result.file_id] = result.status
+
+    @property
+    def throughput(self) -> float:
+        """The achieved throughput, in bytes per second."""
+        return self.size / self.seconds if self.seconds > 0 else 0.0
+
+
+def audit_file(api: EnteAPI, file: File, key: bytes) -> AuditResult:
+    """Download, decrypt and hash a remote file, discarding its content.
+
+    Args:
+        api: The EnteAPI client, with the token of the file's account set.
+        file: The remote file.
+        key: The decrypted file key.
+
+    Returns:
+        The result of the audit.
+
+    """
+    sink = HashingSink()
+    result = AuditResult(file_id=file.id, update_time=file.update_time, status="ok")
+    try:
+        api.write_file(file, key, sink)
+    except EnteCryptError as e:
+        result.status = "corrupt"
+        result.detail = str(e) or type(e).__name__
+    except Exception as e:  # noqa: BLE001
+        result.status = "error"
+        result.detail = str(e) or type(e).__name__
+    else:
+        expected = file.metadata.get("hash")
+        if not expected or ":" in expected:
+            result.status = "unverified"
+        elif not sink.matches(expected):
+            result.status = "mismatch"
+            result.detail = f"expected hash {expected}"
+    result.size = sink.size
+    if result.detail:
+        log.debug("Audit of file %d: %s: %s", file.id, result.status, result.detail)
+    return result
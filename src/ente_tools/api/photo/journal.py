@@ -0,0 +1,269 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Journal of the transfers of missing files, so an interrupted run resumes where it stopped."""
+
+import glob
+import logging
+import threading
+from collections.abc import Sequence
+from mimetypes import guess_type
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal
+
+from pydantic import BaseModel
+
+from ente_tools.api.photo.file_metadata import Media
+from ente_tools.api.photo.loader import extract_metadata, hash_file, identify_media_type
+from ente_tools.api.photo.local_file import NewLocalDiskFile
+from ente_tools.api.photo.planner import PlannedDownload
+
+if TYPE_CHECKING:
+    from ente_tools.db.base import Backend
+
+log = logging.getLogger(__name__)
+
+type TransferState = Literal["planned", "in_flight", "completed", "failed"]
+"""The state of the transfer of a target:
+
+- planned: the target is to be created.
+- in_flight: the target is being created; if found in this state, the run was interrupted.
+- completed: the target was created and its content matches the expected hash.
+- failed: the target could not be created, or did not match the expected hash.
+"""
+
+
+class JournalEntry(BaseModel):
+    """The transfer of the content of a planned download to one of its targets."""
+
+    target: str
+    """The path of the local file to create."""
+    hash: str
+    """The expected hash of the content, in the URL-safe alphabet of local hashes."""
+    file_id: int
+    """The remote file the content is downloaded from."""
+    state: TransferState = "planned"
+    verified_hash: str | None = None
+    """The hash of the created file, once completed."""
+    size: int | None = None
+    """The size of the created file, once completed."""
+    st_mtime_ns: int | None = None
+    """The modification time of the created file, once completed."""
+    detail: str | None = None
+    """Why the transfer failed, if it did."""
+
+    def is_unchanged(self) -> bool:
+        """Return whether the created file is still as it was completed."""
+        try:
+            stat = Path(self.target).stat()
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime_ns == self.st_mtime_ns
+
+
+def journal_media(entry: JournalEntry) -> Media | None:
+    """Return the local media of a completed transfer, without hashing its content again.
+
+    Returns:
+        The media, or None if the target is not a media file.
+
+    """
+    mime_type = guess_type(entry.target, strict=False)[0]
+    subtype = identify_media_type(mime_type) if mime_type else None
+    if subtype is None or entry.verified_hash is None or entry.size is None or entry.st_mtime_ns is None:
+        return None
+    media_type = subtype.model_fields["media_type"].default
+    try:
+        metadata = extract_metadata(entry.target, media_type)
+    except Exception as e:  # noqa: BLE001 - any failure of the image and video libraries
+        log.warning("Failed extracting metadata from %s: %s", entry.target, e)
+        metadata = {"Error": str(e)}
+    return Media(
+        media=subtype(
+            file=NewLocalDiskFile(
+                mime_type=mime_type,
+                fullpath=entry.target,
+                st_mtime_ns=entry.st_mtime_ns,
+                size=entry.size,
+            ),
+            hash=entry.verified_hash,
+            data_hash=None,
+            metadata=metadata,
+        ),
+        xmp_sidecar=None,
+    )
+
+
+class DownloadJournal:
+    """Records the transfers of missing files in the backend, as they progress.
+
+    A target is recorded as in flight before it is created, so a file found at
+    a target in that state, or a temporary file next to it, was left unverified
+    by an interrupted run.
+    Completed targets are folded into the local media index in batches, and
+    then leave the journal, so a rerun plans with them as local without
+    scanning or hashing the sync directory again.
+
+    The journal is thread-safe.
+    """
+
+    BatchSize = 100
+    """Number of completed targets folded into the local media index at a time."""
+
+    def __init__(self, backend: "Backend") -> None:
+        """Load the journal of the backend.
+
+        Args:
+            backend: The backend storing the journal and the local media index.
+
+        """
+        self.backend = backend
+        self.entries = backend.get_download_journal()
+        """The entries of the targets not yet folded into the local media index, by target."""
+        self._completed: list[JournalEntry] = []
+        self._lock = threading.Lock()
+
+    def recover(self) -> None:
+        """Resolve the transfers of an interrupted run, before planning the next one.
+
+        Completed targets that are unchanged are folded into the local media
+        index; changed ones are forgotten, to be planned again. Partially written
+        targets of transfers in flight are removed, with their temporary files, and the transfers planned again.
+        """
+        with self._lock:
+            restart: list[JournalEntry] = []
+            forget: list[str] = []
+            for entry in self.entries.values():
+                if entry.state == "completed":
+                    if entry.is_unchanged():
+                        self._completed.append(entry)
+                    else:
+                        forget.append(entry.target)
+                elif entry.state == "in_flight":
+                    # The target may have been created but not verified, and the temporary file left
+                    target = Path(entry.target)
+                    log.info("Removing %s, left unverified", target)
+                    target.unlink(missing_ok=True)
+                    for tmp in target.parent.glob(f".{glob.escape(target.name)}.*"):
+                        tmp.unlink(missing_ok=True)
+                    restart.append(entry.model_copy(update={"state": "planned"}))
+            if self._completed or restart or forget:
+                log.info(
+                    "Resuming downloads: %d completed, %d interrupted, %d changed since",
+                    len(self._completed),
+                    len(restart),
+                    len(forget),
+                )
+            self._save(restart)
+            self._delete(forget)
+            self._fold()
+
+    def plan(self, downloads: Sequence[PlannedDownload]) -> None:
+        """Record the targets of planned downloads not recorded yet, forgetting those no longer planned."""
+        with self._lock:
+            targets = {str(t) for d in downloads for t in d.targets}
+            self._delete(
+                [t for (t, e) in self.entries.items() if e.state in {"planned", "failed"} and t not in targets],
+            )
+            self._save(
+                [
+                    JournalEntry(target=str(t), hash=d.hash, file_id=d.ref.file.id)
+                    for d in downloads
+                    for t in d.targets
+                    if str(t) not in self.entries
+                ],
+            )
+
+    def start(self, download: PlannedDownload, target: Path) -> None:
+        """Record that a target is about to be created."""
+        with self._lock:
+            self._save(
+                [JournalEntry(target=str(target), hash=download.hash, file_id=download.ref.file.id, state="in_flight")],
+            )
+
+    def complete(self, target: Path, verified_hash: str | None = None) -> bool:
+        """Verify the hash of a created target and record the outcome.
+
+        A target that does not match its expected hash is removed.
+
+        Args:
+            target: The created target.
+            verified_hash: The hash of the target computed as it was written, if
+                any; otherwise the target is read to hash it.
+
+        Returns:
+            Whether the target matches its expected hash.
+
+        """
+        with self._lock:
+            entry = self.entries[str(target)]
+        stat = target.stat()
+        if verified_hash is None:
+            verified_hash = hash_file(str(target))
+        with self._lock:
+            if verified_hash != entry.hash:
+                target.unlink()
+                self._save(
+                    [entry.model_copy(update={"state": "failed", "detail": f"hash mismatch: {verified_hash}"})],
+                )
+                return False
+            entry = entry.model_copy(
+                update={
+                    "state": "completed",
+                    "verified_hash": verified_hash,
+                    "size": stat.st_size,
+                    "st_mtime_ns": stat.st_mtime_ns,
+                    "detail": None,
+                },
+            )
+            self._save([entry])
+            self._completed.append(entry)
+            if len(self._completed) >= self.BatchSize:
+                self._fold()
+        return True
+
+    def fail(self, download: PlannedDownload, detail: str) -> None:
+        """Record that the targets of a download in flight failed, removing what was written of them."""
+        with self._lock:
+            failed = [
+                self.entries[str(t)].model_copy(update={"state": "failed", "detail": detail})
+                for t in download.targets
+                if str(t) in self.entries and self.entries[str(t)].state == "in_flight"
+            ]
+            for entry in failed:
+                Path(entry.target).unlink(missing_ok=True)
+            self._save(failed)
+
+    def flush(self) -> None:
+        """Fold the completed targets into the local media index."""
+        with self._lock:
+            self._fold()
+
+    def _save(self, entries: list[JournalEntry]) -> None:
+        if entries:
+            self.backend.save_download_journal(entries)
+            self.entries.update((e.target, e) for e in entries)
+
+    def _delete(self, targets: list[str]) -> None:
+        if targets:
+            self.backend.delete_download_journal(targets)
+            for t in targets:
+                self.entries.pop(t, None)
+
+    def _fold(self) -> None:
+        if not self._completed:
+            return
+        media = [m for m in (journal_media(e) for e in self._completed) if m is not None]
+        self.backend.add_local_media(media)
+        self._delete([e.target for e in self._completed])
+        self._completed = []
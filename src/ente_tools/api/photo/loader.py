@@ -19,10 +19,11 @@ from base64 import urlsafe_b64encode
 from collections.abc import Mapping
 from datetime import UTC, datetime
 from pathlib import Path
-from typing import Literal, Self
+from typing import BinaryIO, Literal, Self
 from xml.etree import ElementTree as ET
 
 import av
+import av.container
 from PIL import ExifTags, Image
 from pillow_heif import register_heif_opener
 
@@ -60,26 +61,7 @@ class NewImageFile(MetadataModel):
         try:
             with Image.open(file.fullpath) as img:
                 # Extract metadata
-                assign_to_dict(metadata, "XMP", img.getxmp())
-                exif_data = img.getexif()
-                metadata.update({f"Base:{ExifTags.TAGS.get(k, k)}": str(v) for k, v in exif_data.items()})
-                metadata.update(
-                    {
-                        f"GPS:{ExifTags.GPSTAGS.get(k, k)}": str(v)
-                        for k, v in exif_data.get_ifd(
-                            ExifTags.IFD.GPSInfo,
-                        ).items()
-                    },
-                )
-                metadata.update(
-                    {
-                        f"Extra:{ExifTags.TAGS.get(k, k)}": str(v)
-                        for k, v in exif_data.get_ifd(
-                            ExifTags.IFD.Exif,
-                        ).items()
-                        if not isinstance(v, bytes | bytearray)
-                    },
-                )
+                metadata = image_metadata(img)
 
                 # Hash the data
                 m = hashlib.sha256()
@@ -155,7 +137,7 @@ class NewAVFile(MetadataModel):
                     file=file,
                     hash=hash_file(file.fullpath),
                     data_hash=m.hexdigest(),
-                    metadata=f.metadata,
+                    metadata=av_metadata(f),
                 )
 
         except Exception as e:  # noqa: BLE001
@@ -251,6 +233,70 @@ class NewXMPDiskFile(MetadataModel):
 type MediaTypes = NewImageFile | NewAVFile
 
 
+def image_metadata(img: Image.Image) -> dict[str, DictTypes]:
+    """Extract the XMP and EXIF metadata of an opened image.
+
+    Args:
+        img: The image.
+
+    Returns:
+        The metadata, keyed by the XMP path or by the EXIF group and tag name.
+
+    """
+    metadata: dict[str, DictTypes] = {}
+    assign_to_dict(metadata, "XMP", img.getxmp())
+    exif_data = img.getexif()
+    metadata.update({f"Base:{ExifTags.TAGS.get(k, k)}": str(v) for k, v in exif_data.items()})
+    metadata.update(
+        {
+            f"GPS:{ExifTags.GPSTAGS.get(k, k)}": str(v)
+            for k, v in exif_data.get_ifd(
+                ExifTags.IFD.GPSInfo,
+            ).items()
+        },
+    )
+    metadata.update(
+        {
+            f"Extra:{ExifTags.TAGS.get(k, k)}": str(v)
+            for k, v in exif_data.get_ifd(
+                ExifTags.IFD.Exif,
+            ).items()
+            if not isinstance(v, bytes | bytearray)
+        },
+    )
+    return metadata
+
+
+def av_metadata(container: av.container.InputContainer) -> dict[str, DictTypes]:
+    """Extract the container metadata of an opened audio or video file."""
+    return dict(container.metadata)
+
+
+def extract_metadata(
+    source: str | BinaryIO,
+    media_type: Literal["image", "video"],
+) -> dict[str, DictTypes]:
+    """Extract the metadata of a media file without reading more of it than needed.
+
+    Unlike `from_file`, the content is not hashed, so only the parts of the file
+    holding the metadata are read: the headers of images, and the headers and
+    index (e.g. the MP4 `moov` atom) of videos.
+
+    Args:
+        source: The path of the file, or a seekable binary file object.
+        media_type: Whether the file is an image or a video.
+
+    Returns:
+        The metadata, as stored for local files.
+
+    """
+    if media_type == "image":
+        with Image.open(source) as img:
+            return image_metadata(img)
+    with av.open(source, "r") as container:
+        return av_metadata(container)
+
+
 def identify_media_type(mime_type: str) -> type[MediaTypes] | None:
     """Identify the media type based on the MIME type.
 
@@ -0,0 +1,116 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Creation of files from identical local content without copying it through user space."""
+
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+from typing import Literal
+
+log = logging.getLogger(__name__)
+
+FICLONE = 0x40049409
+"""The Linux ioctl sharing the extents of one file with another (`_IOW(0x94, 9, int)`)."""
+
+type Method = Literal["reflink", "copy_file_range", "hardlink", "copy"]
+
+
+def _reflink(src: int, dst: int) -> None:
+    import fcntl  # noqa: PLC0415 - not available on Windows
+
+    fcntl.ioctl(dst, FICLONE, src)
+
+
+def _copy_file_range(src: int, dst: int) -> None:
+    size = os.fstat(src).st_size
+    offset = 0
+    while offset < size:
+        n = os.copy_file_range(src, dst, size - offset, offset, offset)
+        if n == 0:
+            break
+        offset += n
+
+
+_SHARING: tuple[tuple[Method, Callable[[int, int], None]], ...] = (
+    ("reflink", _reflink),
+    ("copy_file_range", _copy_file_range),
+)
+"""The methods copying or sharing the content of one open file with another, in order."""
+
+
+def materialize(source: Path, dest: Path) -> Method:
+    """Create a file with the content of a local file, as cheaply as the filesystem allows.
+
+    The methods are tried in order:
+
+    - reflink: the copy shares the source's blocks until either is modified
+      (e.g. on Btrfs and XFS).
+    - copy_file_range: the kernel copies the data, itself sharing blocks where
+      the filesystem can.
+    - hardlink: the destination is another name of the source, so modifying one
+      modifies both.
+    - copy: a plain copy, e.g. where the others are not supported.
+
+    The destination is created under a temporary name and renamed into place,
+    so it never appears partially written.
+
+    Args:
+        source: The local file with the content.
+        dest: The file to create; its directory is created if needed.
+
+    Returns:
+        The method used.
+
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    (fd, name) = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.", suffix=".tmp")
+    tmp = Path(name)
+    try:
+        method: Method | None = None
+        with source.open("rb") as src:
+            for m, f in _SHARING:
+                try:
+                    f(src.fileno(), fd)
+                except (OSError, AttributeError) as e:
+                    # Not supported by the platform or the filesystems, or across them
+                    log.debug("Cannot %s %s to %s: %s", m, source, dest, e)
+                    os.ftruncate(fd, 0)
+                else:
+                    method = m
+                    break
+        os.close(fd)
+        fd = -1
+
+        if method is None:
+            try:
+                tmp.unlink()
+                tmp.hardlink_to(source)
+                method = "hardlink"
+            except OSError as e:
+                log.debug("Cannot hardlink %s to %s: %s", source, dest, e)
+                shutil.copyfile(source, tmp)
+                method = "copy"
+        if method != "hardlink":
+            shutil.copystat(source, tmp)
+
+        tmp.replace(dest)
+    except BaseException:
+        if fd >= 0:
+            os.close(fd)
+        tmp.unlink(missing_ok=True)
+        raise
+    return method
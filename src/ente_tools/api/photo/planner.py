@@ -0,0 +1,168 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Planning of downloads of remote files that are not in the sync directory."""
+
+import logging
+from collections import defaultdict
+from collections.abc import Callable, Sequence
+from pathlib import Path
+from typing import Literal
+
+from pydantic import BaseModel
+
+from ente_tools.api.core.types_file import File
+from ente_tools.api.photo.file_metadata import Media
+from ente_tools.api.photo.local_file import NewLocalDiskFile
+
+log = logging.getLogger(__name__)
+
+
+def normalize_hash(file_hash: str) -> str:
+    """Return a base64 encoded hash in the URL-safe alphabet used for local files.
+
+    Remote hashes use the standard alphabet, local hashes the URL-safe one.
+    """
+    return file_hash.replace("+", "-").replace("/", "_")
+
+
+class RemoteRef(BaseModel):
+    """A remote file and the account it is in."""
+
+    email: str
+    user_id: int
+    """The ID of the account's user."""
+    file: File
+
+    @property
+    def is_owner(self) -> bool:
+        """Whether the account owns the file, rather than it being shared with it."""
+        return self.file.owner_id == self.user_id
+
+    @property
+    def size(self) -> int | None:
+        """The size of the encrypted file, if known."""
+        return self.file.info.file_size if self.file.info is not None else None
+
+
+def best_source(refs: Sequence[RemoteRef]) -> RemoteRef:
+    """Choose the remote file to download content from, of files with the same content.
+
+    The owner's copy is preferred, as it does not depend on a share, then the
+    smallest, e.g. over one uploaded again with a larger encoding, then the
+    lowest ID so the choice is stable.
+    """
+    return min(
+        refs,
+        key=lambda r: (not r.is_owner, r.size if r.size is not None else float("inf"), r.file.id),
+    )
+
+
+class PlannedDownload(BaseModel):
+    """The remote files with one content, and how to create it in the sync directory."""
+
+    hash: str
+    """The normalized hash of the content."""
+    refs: list[RemoteRef]
+    """The remote files with the content, the one to download first."""
+    targets: list[Path]
+    """The local files to create, one per distinct path of the remote files."""
+    source: Path | None = None
+    """A local file with the same content to create the targets from, if any."""
+
+    @property
+    def ref(self) -> RemoteRef:
+        """The remote file to download the content from."""
+        return self.refs[0]
+
+    @property
+    def action(self) -> Literal["materialize", "fetch"]:
+        """Whether the content is created from a local copy or fetched from the server."""
+        return "materialize" if self.source is not None else "fetch"
+
+
+class DownloadPlan(BaseModel):
+    """The downloads needed to bring remote files into the sync directory."""
+
+    downloads: list[PlannedDownload] = []
+    present: int = 0
+    """The number of contents already in the sync directory."""
+    unhashed: int = 0
+    """The number of remote files skipped as they have no hash."""
+
+
+def is_current(file: NewLocalDiskFile) -> bool:
+    """Return whether a local file is unchanged since it was indexed, so its hash still holds."""
+    try:
+        stat = Path(file.fullpath).stat()
+    except OSError:
+        return False
+    return stat.st_size == file.size and stat.st_mtime_ns == file.st_mtime_ns
+
+
+def local_index(local_media: Sequence[Media]) -> dict[str, list[NewLocalDiskFile]]:
+    """Index local media files by their hash."""
+    index: dict[str, list[NewLocalDiskFile]] = defaultdict(list)
+    for m in local_media:
+        index[m.media.hash].append(m.media.file)
+    return index
+
+
+def plan_downloads(
+    refs: Sequence[RemoteRef],
+    local_media: Sequence[Media],
+    sync_dir: Path,
+    target: Callable[[File], str],
+) -> DownloadPlan:
+    """Plan the downloads of remote content missing from the sync directory.
+
+    Remote files with the same content, e.g. in several albums or accounts,
+    are collapsed into one download from the best source (see `best_source`).
+    The content is placed at the path of every one of them.
+
+    Content already indexed in the sync directory is skipped. Content indexed
+    elsewhere, e.g. under another sync directory, is created from that copy if
+    the copy is unchanged since it was indexed. Only the remaining content is
+    fetched.
+
+    Args:
+        refs: The remote files.
+        local_media: The index of local media, possibly of several directories.
+        sync_dir: The sync directory.
+        target: Returns the path of a remote file relative to the sync directory.
+
+    Returns:
+        The plan, with a download per content.
+
+    """
+    plan = DownloadPlan()
+    groups: dict[str, list[RemoteRef]] = defaultdict(list)
+    for ref in refs:
+        file_hash = ref.file.metadata.get("hash")
+        if not file_hash:
+            plan.unhashed += 1
+            continue
+        groups[normalize_hash(file_hash)].append(ref)
+
+    index = local_index(local_media)
+    for file_hash, group in groups.items():
+        copies = index.get(file_hash, [])
+        if any(Path(c.fullpath).is_relative_to(sync_dir) for c in copies):
+            plan.present += 1
+            continue
+        source = next((Path(c.fullpath) for c in copies if is_current(c)), None)
+        best = best_source(group)
+        refs = [best, *(r for r in group if r is not best)]
+        targets = list(dict.fromkeys(sync_dir / target(r.file) for r in refs))
+        plan.downloads.append(PlannedDownload(hash=file_hash, refs=refs, targets=targets, source=source))
+    return plan
@@ -0,0 +1,85 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Extraction of media metadata from partial downloads of remote files."""
+
+import io
+import logging
+from collections.abc import Mapping
+from mimetypes import guess_type
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+from ente_tools.api.core.api import EnteAPI
+from ente_tools.api.core.types_file import File
+from ente_tools.api.photo.loader import DictTypes, NewImageFile, extract_metadata, identify_media_type
+
+log = logging.getLogger(__name__)
+
+READ_BUFFER_SIZE = 64 * 1024
+"""Size of the reads made by the metadata parsers."""
+
+
+class RemoteMetadata(BaseModel):
+    """Media metadata extracted from the content of a remote file."""
+
+    file_id: int
+    update_time: int
+    """The update time of the file the metadata was extracted from."""
+    media_type: Literal["image", "video"] | None = None
+    metadata: Mapping[str, DictTypes] = Field(default_factory=dict)
+    """The metadata, with the same keys as for local media."""
+    fetched_bytes: int = 0
+    """The number of encrypted bytes downloaded to extract the metadata."""
+    error: str | None = None
+    """Why the metadata could not be extracted, if it could not."""
+
+
+def remote_media_type(file: File) -> Literal["image", "video"] | None:
+    """Identify the media type of a remote file from its title."""
+    mime_type = guess_type(file.metadata.get("title", ""), strict=False)[0]
+    media_type = identify_media_type(mime_type) if mime_type else None
+    if media_type is None:
+        return None
+    return "image" if media_type is NewImageFile else "video"
+
+
+def extract_remote_metadata(api: EnteAPI, file: File, key: bytes, *, max_chunks: int) -> RemoteMetadata:
+    """Extract the metadata of a remote file, downloading only the chunks the parsers read.
+
+    Args:
+        api: The EnteAPI client, with the token of the file's account set.
+        file: The remote file.
+        key: The decrypted file key.
+        max_chunks: The maximum number of chunks downloaded; files needing more are
+            recorded with an error.
+
+    Returns:
+        The extracted metadata, or the error preventing it.
+
+    """
+    result = RemoteMetadata(file_id=file.id, update_time=file.update_time, media_type=remote_media_type(file))
+    if result.media_type is None:
+        result.error = "unsupported media type"
+        return result
+
+    reader = api.open_file(file, key, max_chunks=max_chunks)
+    try:
+        with io.BufferedReader(reader, buffer_size=READ_BUFFER_SIZE) as f:
+            result.metadata = extract_metadata(f, result.media_type)
+    except Exception as e:  # noqa: BLE001
+        log.debug("Failed extracting metadata of file %d: %s", file.id, e)
+        result.error = str(e)
+    result.fetched_bytes = reader.fetched_bytes
+    return result
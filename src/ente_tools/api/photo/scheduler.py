@@ -0,0 +1,160 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Ordering of planned downloads, and lanes keeping large files from blocking small ones."""
+
+import logging
+import threading
+from collections import defaultdict, deque
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from enum import StrEnum
+from itertools import chain, zip_longest
+
+from ente_tools.api.photo.planner import PlannedDownload
+
+log = logging.getLogger(__name__)
+
+
+class SchedulePolicy(StrEnum):
+    """The order in which planned downloads are started."""
+
+    SMALLEST_FIRST = "smallest-first"
+    """Smallest files first, so most files arrive early."""
+    NEWEST_FIRST = "newest-first"
+    """Most recently taken files first, by their creation time."""
+    COLLECTION = "collection"
+    """Files of the prioritised collections first, in order, then smallest first."""
+    ROUND_ROBIN = "round-robin"
+    """Alternating between accounts, each smallest first, so no account waits for another."""
+
+
+def download_size(download: PlannedDownload) -> float:
+    """Return the size of the file to download, or infinity if unknown."""
+    size = download.ref.size
+    return size if size is not None else float("inf")
+
+
+def creation_time(download: PlannedDownload) -> int:
+    """Return the latest creation time of the remote files, in microseconds since the epoch."""
+    return max((r.file.metadata.get("creationTime") or 0 for r in download.refs), default=0)
+
+
+def schedule(
+    downloads: Sequence[PlannedDownload],
+    policy: SchedulePolicy = SchedulePolicy.SMALLEST_FIRST,
+    *,
+    collection_priority: Sequence[int] = (),
+) -> list[PlannedDownload]:
+    """Order planned downloads by a policy.
+
+    Args:
+        downloads: The planned downloads.
+        policy: The policy.
+        collection_priority: The IDs of the collections downloaded first, in order,
+            for `SchedulePolicy.COLLECTION`. A download ranks by the best ranked
+            collection of its remote files.
+
+    Returns:
+        The downloads, in the order to start them.
+
+    """
+    by_size = sorted(downloads, key=download_size)
+    match policy:
+        case SchedulePolicy.SMALLEST_FIRST:
+            return by_size
+        case SchedulePolicy.NEWEST_FIRST:
+            return sorted(downloads, key=creation_time, reverse=True)
+        case SchedulePolicy.COLLECTION:
+            rank = {c: i for (i, c) in enumerate(collection_priority)}
+            return sorted(
+                by_size,
+                key=lambda d: min((rank.get(r.file.collection_id, len(rank)) for r in d.refs), default=len(rank)),
+            )
+        case SchedulePolicy.ROUND_ROBIN:
+            accounts: dict[str, list[PlannedDownload]] = defaultdict(list)
+            for d in by_size:
+                accounts[d.ref.email].append(d)
+            return [d for d in chain.from_iterable(zip_longest(*accounts.values())) if d is not None]
+
+
+class DownloadLanes:
+    """Ordered downloads split into a lane of large files and a lane of the others.
+
+    Workers take from their own lane first, so a few large files cannot hold
+    all the workers while thousands of small files wait, and from the other
+    lane once theirs is empty, so no worker idles while work remains.
+    """
+
+    def __init__(self, downloads: Sequence[PlannedDownload], large_size: int) -> None:
+        """Split the downloads into lanes, keeping their order.
+
+        Args:
+            downloads: The downloads, in the order to start them.
+            large_size: The size from which a file is large; files of unknown size are large.
+
+        """
+        self._lanes: dict[bool, deque[PlannedDownload]] = {
+            large: deque(d for d in downloads if (download_size(d) >= large_size) == large) for large in (False, True)
+        }
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of downloads not taken yet."""
+        with self._lock:
+            return sum(len(lane) for lane in self._lanes.values())
+
+    def take(self, *, large: bool) -> PlannedDownload | None:
+        """Take the next download of a lane, or of the other lane if it is empty.
+
+        Args:
+            large: Whether the worker's lane is the one of large files.
+
+        Returns:
+            The download, or None when both lanes are empty.
+
+        """
+        with self._lock:
+            for lane in (self._lanes[large], self._lanes[not large]):
+                if lane:
+                    return lane.popleft()
+        return None
+
+    def run(
+        self,
+        task: Callable[[PlannedDownload], None],
+        *,
+        workers: int,
+        large_workers: int = 1,
+    ) -> None:
+        """Run a task on every download, with workers dedicated to each lane.
+
+        Args:
+            task: Performs a download; it must handle its own errors.
+            workers: The total number of workers.
+            large_workers: The number of workers whose lane is the large files; the
+                rest take the small files first. Unless there is a single worker, at
+                least one worker serves each lane.
+
+        """
+        workers = max(workers, 1)
+        large_workers = max(1, min(large_workers, workers - 1)) if workers > 1 else 0
+
+        def worker(large: bool) -> None:  # noqa: FBT001
+            while (d := self.take(large=large)) is not None:
+                task(d)
+
+        with ThreadPoolExecutor(max_workers=workers) as e:
+            futures = [e.submit(worker, i < large_workers) for i in range(workers)]
+            for f in futures:
+                f.result()
@@ -14,23 +14,43 @@
 """Module for synchronizing local and remote photo files with the Ente API."""
 
 import logging
+import shutil
+import sys
+import threading
+import time
 from collections import defaultdict
-from collections.abc import Callable
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 from pathlib import Path
 from typing import TYPE_CHECKING
 
+import httpx
 import humanize
 from jinja2 import Environment
+from rich.progress import Progress, TextColumn, track
 
 from ente_tools.api.core import EnteAPI
 from ente_tools.api.core.account import EnteAccount
 from ente_tools.api.core.api import EnteAPIError
+from ente_tools.api.core.blob_cache import BlobCache
+from ente_tools.api.core.concurrency import ConcurrencyController
+from ente_tools.api.core.ente_crypt import EnteCryptError, encrypted_size
+from ente_tools.api.core.writer import FsyncPolicy, HashMismatchError
+from ente_tools.api.photo.audit import AuditReport, AuditResult, audit_file
 from ente_tools.api.photo.file_metadata import Media
+from ente_tools.api.photo.journal import DownloadJournal
+from ente_tools.api.photo.materialize import materialize
 from ente_tools.api.photo.photo_file import RemotePhotoFile
+from ente_tools.api.photo.planner import PlannedDownload, RemoteRef, best_source, normalize_hash, plan_downloads
+from ente_tools.api.photo.remote_metadata import RemoteMetadata, extract_remote_metadata
+from ente_tools.api.photo.scheduler import DownloadLanes, SchedulePolicy, schedule
+from ente_tools.api.photo.thumbnails import PrefetchReport, ThumbnailCache
+from ente_tools.api.photo.upload import Uploader, UploadReport, local_hashes, media_files, plan_uploads
 from ente_tools.db.base import Backend
 
 if TYPE_CHECKING:
-    from ente_tools.api.core.types_crypt import EnteKeys
     from ente_tools.api.core.types_file import File
 
 log = logging.getLogger("sync")
@@ -43,27 +63,80 @@ class EnteClient:
     EnteAccountUrl = "https://accounts.ente.io"
     EnteDownloadUrl = "https://files.ente.io/?fileID="
 
-    def __init__(
+    LargeFileSize = 100 * 1024 * 1024
+    """Size from which a file is downloaded in the large file lane."""
+
+    ThumbnailCacheSize = ThumbnailCache.MaxSize
+    """Default cap of the total size of the thumbnail cache."""
+
+    BlobCacheSize = BlobCache.MaxSize
+    """Default cap of the total size of the blob cache."""
+
+    def __init__(  # noqa: PLR0913
         self,
         backend: Backend,
         api_url: str = EnteApiUrl,
         api_account_url: str = EnteAccountUrl,
         api_download_url: str = EnteDownloadUrl,
+        *,
+        bandwidth_limit: int | None = None,
+        bandwidth_burst: int | None = None,
+        thumbnail_dir: Path | None = None,
+        thumbnail_cache_size: int = ThumbnailCacheSize,
+        blob_cache_dir: Path | None = None,
+        blob_cache_size: int = BlobCacheSize,
     ) -> None:
-        """Initialize the EnteClient with the given backend and API URLs."""
+        """Initialize the EnteClient with the given backend and API URLs.
+
+        Args:
+            backend: The database backend.
+            api_url: The base URL for the Ente API.
+            api_account_url: The base URL for the Ente account API.
+            api_download_url: The base URL for file downloads.
+            bandwidth_limit: The maximum rate of all downloads together, in bytes per
+                second, or None for no limit; see `EnteAPI.set_bandwidth_limit`.
+            bandwidth_burst: The most bytes downloaded at once above the rate.
+            thumbnail_dir: The directory of the thumbnail cache; required to use it.
+            thumbnail_cache_size: The cap of the total size of the thumbnail cache, in bytes.
+            blob_cache_dir: The directory of the cache of encrypted files, possibly shared
+                with other hosts, or None to download every file from the server.
+            blob_cache_size: The cap of the total size of the blob cache, in bytes.
+
+        """
         self.backend = backend
         self.api = EnteAPI(
             pkg="io.ente.photos",
             api_url=api_url,
             api_account_url=api_account_url,
             api_download_url=api_download_url,
+            api_concurrency=ConcurrencyController("file pages", initial=4, max_limit=16),
+            download_concurrency=ConcurrencyController("downloads", initial=2, max_limit=8),
+            blob_cache=BlobCache(blob_cache_dir, max_size=blob_cache_size) if blob_cache_dir is not None else None,
         )
+        self.api.set_bandwidth_limit(bandwidth_limit, bandwidth_burst)
+        self.thumbnail_dir = thumbnail_dir
+        self.thumbnail_cache_size = thumbnail_cache_size
+        self._thumbnails: ThumbnailCache | None = None
+
+    def _log_stats(self) -> None:
+        """Log the retry, concurrency and cache statistics of the run."""
+        self.api.retry.log_stats()
+        for controller in (self.api.api_concurrency, self.api.download_concurrency):
+            if controller is not None:
+                controller.log_stats()
+        if self.api.blob_cache is not None:
+            self.api.blob_cache.log_stats()
+
+    @staticmethod
+    def _progress() -> Progress:
+        """Return a progress display with the current concurrency limit."""
+        return Progress(*Progress.get_default_columns(), TextColumn("limit {task.fields[limit]}"))
 
     def info(self) -> None:
         """Display information about the linked accounts and the status of local and remote files."""
+        for summary in self.backend.list_account_summaries():
+            log.info("Account %s has collections %d, files %d", summary.email, summary.collections, summary.files)
         accounts = self.backend.get_accounts()
-        for acc in accounts:
-            log.info("Account %s has collections %d, files %d", acc.email, len(acc.collections), len(acc.files))
 
         def calc_files(desc: str, files: list[Media], t: Callable[[Media], bool]) -> str:
             files = [f for f in files if t(f)]
@@ -132,7 +205,7 @@ class EnteClient:
 
     def link(self, email: str, *, unlink: bool = False) -> None:
         """Link or unlink an Ente account with the given email address."""
-        emails = {acc.email for acc in self.backend.get_accounts()}
+        emails = {summary.email for summary in self.backend.list_account_summaries()}
 
         if unlink:
             if email not in emails:
@@ -149,22 +222,217 @@ class EnteClient:
 
     def remote_refresh(self, *, email: str | None = None, force_refresh: bool = False) -> None:
         """Refresh the remote data for the specified account(s) from the Ente API."""
-        for acc in self.backend.get_accounts():
-            if email and acc.email != email:
-                continue
+        emails = [email] if email else [summary.email for summary in self.backend.list_account_summaries()]
+        for account_email in emails:
+            acc = self.backend.get_account(account_email, with_files=False)
+            if acc is None:
+                msg = f"Email {account_email} is not linked"
+                raise EnteAPIError(msg)
             log.info("Refreshing account %s", acc.email)
-            acc.refresh(self.api, force_refresh=force_refresh)
+            controller = self.api.api_concurrency
+            with self._progress() as progress:
+                task = progress.add_task("Refreshing", total=None, limit="-")
+
+                def update(done: int, total: int) -> None:
+                    progress.update(
+                        task,  # noqa: B023
+                        completed=done,
+                        total=total,
+                        limit=controller.limit if controller else "-",  # noqa: B023
+                    )
+
+                acc.refresh(
+                    self.api,
+                    force_refresh=force_refresh,
+                    sink=self.backend.refresh_sink(acc.email),
+                    workers=controller.max_limit if controller else 1,
+                    progress=update,
+                )
+            for summary in self.backend.list_account_summaries():
+                if summary.email == acc.email:
+                    log.info(
+                        "Refreshed account %s with %d collections and %d files.",
+                        summary.email,
+                        summary.collections,
+                        summary.files,
+                    )
+        self._log_stats()
+
+    RemoteMetadataBatchSize = 100
+    """Number of extracted metadata saved at a time, bounding the work lost when interrupted."""
+
+    def remote_metadata(self, *, max_chunks: int = 1, force: bool = False, workers: int | None = None) -> None:
+        """Extract the media metadata of remote files from partial downloads.
+
+        Only the chunks the metadata parsers read are downloaded, up to `max_chunks`
+        per file. Files whose metadata was extracted since their last update are
+        skipped unless `force` is set.
+
+        Args:
+            max_chunks: The maximum number of chunks downloaded per file.
+            force: Extract the metadata of all files again.
+            workers: The number of files processed concurrently.
+
+        """
+        known = {} if force else self.backend.get_remote_metadata()
+        for acc in self.backend.get_accounts():
+            self.api.set_token(acc.keys().token)
+            # A file in several collections has the same ID in each, and is fetched once
+            unique = {f.id: f for files in acc.files.values() for f in files}
+            todo = [
+                (f, partial(acc.file_key, f))
+                for f in unique.values()
+                if f.id not in known or known[f.id].update_time != f.update_time
+            ]
+            log.info("Account %s extracting metadata of %d files", acc.email, len(todo))
+
+            def run_task(task: tuple["File", Callable[[], bytes]]) -> RemoteMetadata:
+                return extract_remote_metadata(self.api, task[0], task[1](), max_chunks=max_chunks)
+
+            (extracted, failed, fetched) = (0, 0, 0)
+            batch: list[RemoteMetadata] = []
+            with ThreadPoolExecutor(max_workers=workers) as e:
+                for result in track(e.map(run_task, todo), description="Extracting", total=len(todo)):
+                    if result.error is None:
+                        extracted += 1
+                    else:
+                        failed += 1
+                    fetched += result.fetched_bytes
+                    batch.append(result)
+                    if len(batch) >= self.RemoteMetadataBatchSize:
+                        self.backend.save_remote_metadata(batch)
+                        batch = []
+            self.backend.save_remote_metadata(batch)
+
+            total = sum(f.info.file_size for (f, _) in todo if f.info is not None)
             log.info(
-                "Refreshed account %s with %d collections and %d files.",
+                "Account %s extracted metadata of %d files (%d failed), downloading %s of %s",
                 acc.email,
-                len(acc.collections),
-                len(acc.files),
+                extracted,
+                failed,
+                humanize.naturalsize(fetched),
+                humanize.naturalsize(total),
             )
-            # After refreshing, we need to update the account in the backend
-            # This is tricky because we don't have a direct way to update an account.
-            # A simple way is to remove and re-add it.
-            self.backend.remove_account(acc.email)
-            self.backend.add_account(acc)
+
+    def thumbnail_cache(self) -> ThumbnailCache:
+        """Return the thumbnail cache, opening it on first use.
+
+        Raises:
+            EnteAPIError: If the client has no thumbnail directory.
+
+        """
+        if self._thumbnails is None:
+            if self.thumbnail_dir is None:
+                err = "No thumbnail directory"
+                raise EnteAPIError(err)
+            self._thumbnails = ThumbnailCache(self.thumbnail_dir, self.backend, max_size=self.thumbnail_cache_size)
+        return self._thumbnails
+
+    def thumbnails(self, *, workers: int = 8) -> PrefetchReport:
+        """Download the thumbnails of all remote files into the thumbnail cache.
+
+        Thumbnails already cached at the current version of their file are
+        skipped, so repeated runs only fetch those of new and updated files.
+
+        Args:
+            workers: The maximum number of thumbnails downloaded concurrently.
+
+        Returns:
+            The summary of the prefetch.
+
+        """
+        cache = self.thumbnail_cache()
+        tasks: list[tuple[File, Callable[[], bytes], bytes | None]] = []
+        for acc in self.backend.get_accounts():
+            token = acc.keys().token
+            tasks.extend((f, partial(acc.file_key, f), token) for files in acc.files.values() for f in files)
+
+        start = time.monotonic()
+        with self._progress() as progress:
+            task = progress.add_task("Thumbnails", total=None, limit="-")
+            report = cache.prefetch(
+                self.api,
+                tasks,
+                workers=workers,
+                progress=lambda done, total: progress.update(task, completed=done, total=total, limit=workers),
+            )
+        log.info(
+            "Thumbnails: %d cached, %d fetched (%s in %.1fs), %d failed; cache is %s",
+            report.cached,
+            report.fetched,
+            humanize.naturalsize(report.size),
+            time.monotonic() - start,
+            report.failed,
+            humanize.naturalsize(cache.size),
+        )
+        self._log_stats()
+        return report
+
+    AuditBatchSize = 100
+    """Number of audit results saved at a time, bounding the work lost when interrupted."""
+
+    def audit(
+        self,
+        *,
+        workers: int = 4,
+        resume: bool = False,
+    ) -> AuditReport:
+        """Verify that every remote file decrypts and matches its hash, without storing it.
+
+        Args:
+            workers: The maximum number of files downloaded concurrently; the
+                download concurrency controller adapts the limit below it.
+            resume: Skip files audited before at their current version, except
+                those that could not be downloaded.
+
+        Returns:
+            The report of the run, covering only the files audited in it.
+
+        """
+        controller = self.api.download_concurrency
+        if controller is not None:
+            controller.max_limit = workers
+        done = self.backend.get_audit_results() if resume else {}
+        report = AuditReport()
+        start = time.monotonic()
+        for acc in self.backend.get_accounts():
+            self.api.set_token(acc.keys().token)
+            # A file in several collections has the same ID in each, and is audited once
+            unique = {f.id: f for files in acc.files.values() for f in files}
+            todo = [
+                (f, partial(acc.file_key, f))
+                for f in unique.values()
+                if f.id not in done or done[f.id].update_time != f.update_time or done[f.id].status == "error"
+            ]
+            log.info("Account %s auditing %d files", acc.email, len(todo))
+
+            def run_task(task: tuple["File", Callable[[], bytes]]) -> AuditResult:
+                return audit_file(self.api, task[0], task[1]())
+
+            batch: list[AuditResult] = []
+            with ThreadPoolExecutor(max_workers=workers) as e, self._progress() as progress:
+                task = progress.add_task("Auditing", total=len(todo), limit="-")
+                for result in e.map(run_task, todo):
+                    progress.update(task, advance=1, limit=controller.limit if controller else "-")
+                    report.add(result)
+                    batch.append(result)
+                    if len(batch) >= self.AuditBatchSize:
+                        self.backend.save_audit_results(batch)
+                        batch = []
+            self.backend.save_audit_results(batch)
+
+        report.seconds = time.monotonic() - start
+        log.info(
+            "Audited %s files (%s) in %.1fs at %s/s",
+            ", ".join(f"{n} {status}" for (status, n) in sorted(report.counts.items())) or "no",
+            humanize.naturalsize(report.size),
+            report.seconds,
+            humanize.naturalsize(report.throughput),
+        )
+        for file_id, status in sorted(report.failed.items()):
+            log.error("File %d is %s", file_id, status)
+        self._log_stats()
+        return report
 
     def local_export(self) -> None:
         """Export the local files."""
@@ -174,48 +442,295 @@ class EnteClient:
         self.backend.local_refresh(sync_dir, force_refresh=force_refresh, workers=workers)
 
     # TODO(scannell): Jinja template needs a way to deal with duplicates, e.g., making it unique
-    def download_missing(self, jinja_template: str = "{{file.get_filename()}}") -> None:
-        """Download files present in the remote storage but not locally.
+    def download_missing(  # noqa: PLR0913
+        self,
+        sync_dir: Path,
+        jinja_template: str = "{{file.get_filename()}}",
+        *,
+        dry_run: bool = False,
+        policy: SchedulePolicy = SchedulePolicy.SMALLEST_FIRST,
+        collection_priority: Sequence[int] = (),
+        workers: int = 4,
+        large_size: int = LargeFileSize,
+        fsync: FsyncPolicy = FsyncPolicy.NONE,
+    ) -> None:
+        """Download files present in the remote storage but not in the sync directory.
+
+        Remote files with the same content, e.g. in several albums or accounts,
+        are downloaded once, preferring the owner's and then the smallest copy,
+        and the other copies are created from the download. Content already
+        indexed locally outside the sync directory, e.g. under another sync
+        directory, is created from the local copy by reflink, kernel copy or
+        hardlink where possible, without downloading it.
+
+        Downloads start in the order of the policy. One worker is dedicated to
+        large files and the others to the rest, so a few large videos do not
+        hold back thousands of photos; see `DownloadLanes`.
 
-        This method identifies files that exist in the remote Ente storage but are not
-        present in the local sync directory. It uses a Jinja template to determine the
-        local filename for each file to be downloaded.
+        Transfers are recorded in the backend's download journal, and each
+        created file is verified against the hash of its content. A rerun after
+        an interruption resumes from the journal, without rescanning the sync
+        directory; see `DownloadJournal`.
 
         Args:
+            sync_dir: The local sync directory.
             jinja_template: A Jinja template string used to generate the local filename
-                for each file to be downloaded. The template has access to a `file`
-                variable, which is an instance of `RemotePhotoFile`. Defaults to
-                "{{file.get_filename()}}".
+                for each file to be downloaded, relative to the sync directory. The
+                template has access to a `file` variable, which is an instance of
+                `RemotePhotoFile`. Defaults to "{{file.get_filename()}}".
+            dry_run: Only log what would be created, in order.
+            policy: The order in which downloads start.
+            collection_priority: The IDs of the collections downloaded first, for
+                `SchedulePolicy.COLLECTION`.
+            workers: The maximum number of files downloaded concurrently; the
+                download concurrency controller adapts the limit below it.
+            large_size: The size in bytes from which a file is downloaded in the large file lane.
+            fsync: When downloaded files are flushed to storage.
 
         """
-        # for those files, figure out using the template the target name
-        # download them in parallel by some configuration to the local filename
-
-        # Find local hashes
-        local_hashes = {f.media.hash for f in self.backend.get_local_media()}
-
-        # Find remote groups of files by hash that aren't already local
-        file_groups: dict[str, list[File]] = defaultdict(list)
+        accounts = {acc.email: acc for acc in self.backend.get_accounts()}
+        refs = [
+            RemoteRef(email=acc.email, user_id=acc.encrypted_keys.user_id, file=f)
+            for acc in accounts.values()
+            for files in acc.files.values()
+            for f in files
+        ]
+        # The plan, the schedule and each placement read the metadata, so it is decrypted once for the run
+        with ExitStack() as preloaded:
+            for acc in accounts.values():
+                preloaded.enter_context(acc.preload_metadata())
+
+            journal = DownloadJournal(self.backend)
+            if not dry_run:
+                journal.recover()
+
+            ftemplate = Environment(autoescape=True).from_string(jinja_template)
+            sync_dir = sync_dir.resolve()
+            plan = plan_downloads(
+                refs,
+                self.backend.get_local_media(),
+                sync_dir,
+                lambda f: ftemplate.render(file=RemotePhotoFile(f)),
+            )
+            log.info(
+                "%d contents already local, %d to create, %d remote files without hash",
+                plan.present,
+                len(plan.downloads),
+                plan.unhashed,
+            )
+            downloads = schedule(plan.downloads, policy, collection_priority=collection_priority)
+            if dry_run:
+                for d in downloads:
+                    titles = ", ".join(r.file.metadata.get("title", str(r.file.id)) for r in d.refs)
+                    log.info("%s %s to %s", d.action.capitalize(), titles, ", ".join(str(t) for t in d.targets))
+                return
+
+            journal.plan(downloads)
+            tokens = {email: acc.keys().token for (email, acc) in accounts.items()}
+            methods: dict[str, int] = defaultdict(int)
+            lock = threading.Lock()
+            controller = self.api.download_concurrency
+            if controller is not None:
+                controller.max_limit = workers
+
+            with self._progress() as progress:
+                task = progress.add_task("Downloading", total=len(downloads), limit="-")
+
+                def place(d: PlannedDownload) -> None:
+                    try:
+                        created = self._place(
+                            d,
+                            sync_dir,
+                            accounts[d.ref.email],
+                            tokens[d.ref.email],
+                            journal=journal,
+                            fsync=fsync,
+                        )
+                    except (EnteAPIError, EnteCryptError, HashMismatchError, httpx.HTTPError, OSError) as e:
+                        log.error("Failed to create %s: %s", d.targets[0], e)  # noqa: TRY400
+                        journal.fail(d, str(e))
+                        created = ["failed"]
+                    with lock:
+                        for m in created:
+                            methods[m] += 1
+                        progress.update(task, advance=1, limit=controller.limit if controller else "-")
+
+                try:
+                    DownloadLanes(downloads, large_size).run(place, workers=workers)
+                finally:
+                    journal.flush()
+
+            if methods:
+                log.info("Created files: %s", ", ".join(f"{n} by {m}" for (m, n) in sorted(methods.items())))
+            self._log_stats()
+
+    def _place(  # noqa: PLR0913
+        self,
+        d: PlannedDownload,
+        sync_dir: Path,
+        acc: EnteAccount,
+        token: bytes,
+        *,
+        journal: DownloadJournal,
+        fsync: FsyncPolicy,
+    ) -> list[str]:
+        """Create the targets of a planned download, returning how each was created."""
+        titles = ", ".join(r.file.metadata.get("title", str(r.file.id)) for r in d.refs)
+        targets = [t for t in d.targets if self._placeable(t, sync_dir, titles)]
+        if not targets:
+            return []
+        log.info("%s %s to %s", d.action.capitalize(), titles, ", ".join(str(t) for t in targets))
+
+        created: list[str] = []
+        source = d.source
+        file_hash: str | None = None
+        if source is None:
+            # Download the content once, and place the other copies from it
+            (source, *targets) = targets
+            journal.start(d, source)
+            source.parent.mkdir(parents=True, exist_ok=True)
+            file_hash = self.api.download_file(
+                d.ref.file,
+                acc.file_key(d.ref.file),
+                source,
+                token=token,
+                fsync=fsync,
+                expected_hash=d.hash,
+            )
+            journal.complete(source, file_hash)
+            created.append("download")
+        for t in targets:
+            journal.start(d, t)
+            method = materialize(source, t)
+            # A hardlink of the download is the verified file itself
+            verified = journal.complete(t, file_hash if method == "hardlink" else None)
+            created.append(method if verified else "mismatch")
+        return created
+
+    @staticmethod
+    def _placeable(target: Path, sync_dir: Path, titles: str) -> bool:
+        """Return whether a file can be created at a target, logging why not."""
+        if not target.resolve().is_relative_to(sync_dir):
+            log.warning("Skipping %s: target %s is outside %s", titles, target, sync_dir)
+            return False
+        if target.exists():
+            log.warning("Skipping %s: target %s already exists", titles, target)
+            return False
+        return True
+
+    def _find_by_title(self, title: str) -> list[tuple[EnteAccount, "File"]]:
+        """Find the remote files with a title, with their accounts."""
+        found_files: list[tuple[EnteAccount, File]] = []
         for acc in self.backend.get_accounts():
             for files in acc.files.values():
                 for f in files:
-                    if not f.metadata or "hash" not in f.metadata:
+                    if not f.metadata:
                         continue
-                    if f.metadata["hash"] in local_hashes:
+                    if "title" not in f.metadata:
+                        continue
+                    if f.metadata["title"] != title:
                         continue
-                    file_groups[f.metadata["hash"]].append(f)
+                    found_files.append((acc, f))
+        return found_files
+
+    def _collection_account(self, collection_id: int, email: str | None = None) -> EnteAccount:
+        """Find the linked account to add files to a collection with, preferring its owner.
+
+        Raises:
+            EnteAPIError: If no linked account has the collection.
+
+        """
+        accounts = [
+            acc
+            for acc in self.backend.get_accounts()
+            if (email is None or acc.email == email) and any(c.id == collection_id for c in acc.collections)
+        ]
+        if not accounts:
+            err = f"Collection {collection_id} is not in any linked account"
+            raise EnteAPIError(err)
+        return min(accounts, key=lambda acc: acc.collection(collection_id).owner.id != acc.encrypted_keys.user_id)
+
+    def upload(  # noqa: PLR0913
+        self,
+        paths: Sequence[Path],
+        collection_id: int,
+        *,
+        email: str | None = None,
+        workers: int = 4,
+        file_workers: int = 2,
+        dry_run: bool = False,
+    ) -> UploadReport:
+        """Upload local media files, and the media files in directories, into a collection.
+
+        Files are hashed first, from the local index where it is current, and only
+        content not yet in the account is uploaded: content already in the
+        collection is skipped, and content in other collections is added to it.
 
-        ftemplate = Environment(autoescape=True).from_string(jinja_template)
+        Args:
+            paths: The files and directories.
+            collection_id: The ID of the collection.
+            email: The account to upload with; by default the one owning the collection.
+            workers: The maximum number of parts uploaded concurrently.
+            file_workers: The maximum number of files encrypted concurrently.
+            dry_run: Only log the plan.
 
-        # Show what's to be downloaded
-        log.info("To be downloaded:")
-        for h, g in file_groups.items():
-            log.info("Hash %s, files %s", h, ", ".join(x.metadata["title"] for x in g))
-            # Grab first and feed through template? Or just generate it as-is?
-            fname = ftemplate.render(file=RemotePhotoFile(g[0]))
-            log.info("Download file: %s", fname)
+        Returns:
+            The report of the run.
 
-    def download(self, path: str) -> None:  # noqa: C901
+        """
+        acc = self._collection_account(collection_id, email)
+        files = media_files(paths)
+        plan = plan_uploads(
+            local_hashes(files, self.backend.get_local_media()),
+            [f for remote in acc.files.values() for f in remote],
+            collection_id,
+            acc.encrypted_keys.user_id,
+        )
+        total = sum(encrypted_size(f.stat().st_size) for f in plan.uploads)
+        log.info(
+            "Account %s: %d files to upload (%s), %d to add from other collections, "
+            "%d already in the collection, %d duplicates",
+            acc.email,
+            len(plan.uploads),
+            humanize.naturalsize(total),
+            len(plan.adds),
+            len(plan.present),
+            len(plan.duplicates),
+        )
+        report = UploadReport(present={str(p): file_id for (p, file_id) in plan.present.items()})
+        if dry_run:
+            return report
+
+        self.api.set_token(acc.keys().token)
+        with self._progress() as progress:
+            task = progress.add_task("Uploading", total=total, limit=workers)
+            uploader = Uploader(
+                self.api,
+                collection_id,
+                acc.collection(collection_id).enc_collection_key.decrypt(),
+                workers=workers,
+                progress=lambda n: progress.update(task, advance=n),
+            )
+            report.added = uploader.add({p: (f.id, acc.file_key(f)) for (p, f) in plan.adds.items()})
+            run = uploader.upload(plan.uploads, file_workers=file_workers)
+        report.uploaded = run.uploaded
+        report.failed = run.failed
+        report.size = run.size
+        report.seconds = run.seconds
+        log.info(
+            "Added %d files, uploaded %d files (%s) in %.1fs at %s/s",
+            len(report.added),
+            len(report.uploaded),
+            humanize.naturalsize(report.size),
+            report.seconds,
+            humanize.naturalsize(report.throughput),
+        )
+        for path, detail in sorted(report.failed.items()):
+            log.error("Failed to upload %s: %s", path, detail)
+        self._log_stats()
+        return report
+
+    def download(self, path: str, *, stdout: bool = False, thumbnail: bool = False) -> None:
         """Download a specific file from the remote storage to the local filesystem.
 
         This method downloads a file from the remote Ente storage to the local
@@ -224,40 +739,47 @@ class EnteClient:
 
         Args:
             path: The path (title) of the file to download.
+            stdout: Write the decrypted file to standard output instead, e.g. to
+                pipe it into another tool.
+            thumbnail: Get the file's thumbnail instead, through the thumbnail cache,
+                saved as "<title>-thumbnail.jpg" unless written to standard output.
 
         Raises:
-            EnteAPIError: If the file is not found, or if multiple files match the given path.
+            EnteAPIError: If the file is not found, or if multiple files with different
+                content match the given path.
 
         """
-        found_files: list[File] = []
-        keys: EnteKeys | None = None
-        for acc in self.backend.get_accounts():
-            for files in acc.files.values():
-                for f in files:
-                    if not f.metadata:
-                        continue
-                    if "title" not in f.metadata:
-                        continue
-                    if f.metadata["title"] != path:
-                        continue
-                    keys = acc.keys()
-                    found_files.append(f)
+        found_files = self._find_by_title(path)
 
-        for f in found_files:
+        for _, f in found_files:
             log.info("Found file: %s", f.metadata["title"])
 
-        if len(found_files) > 1:
-            err = "Found multiple files"
-            raise EnteAPIError(err)
-
         if len(found_files) == 0:
             err = "Found no files"
             raise EnteAPIError(err)
 
-        if keys is None:
-            err = "Found no keys"
+        # Copies of one content, e.g. in several albums, are downloaded from the best one
+        refs = [RemoteRef(email=acc.email, user_id=acc.encrypted_keys.user_id, file=f) for (acc, f) in found_files]
+        if len({normalize_hash(r.file.metadata.get("hash") or str(r.file.id)) for r in refs}) > 1:
+            err = "Found multiple files"
             raise EnteAPIError(err)
 
-        self.api.set_token(keys.token)
-
-        self.api.download_file(found_files[0], Path(found_files[0].metadata["title"]))
+        ref = best_source(refs)
+        (acc, file) = next((a, f) for (a, f) in found_files if f is ref.file)
+        self.api.set_token(acc.keys().token)
+
+        if thumbnail:
+            cache = self.thumbnail_cache()
+            cached = cache.fetch(self.api, file, acc.file_key(file))
+            cache.save()
+            if stdout:
+                sys.stdout.buffer.write(cached.read_bytes())
+                sys.stdout.buffer.flush()
+            else:
+                shutil.copyfile(cached, f"{Path(file.metadata['title']).stem}-thumbnail.jpg")
+        elif stdout:
+            size = self.api.write_file(file, acc.file_key(file), sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+            log.info("Wrote %s to standard output", humanize.naturalsize(size))
+        else:
+            self.api.download_file(file, acc.file_key(file), Path(file.metadata["title"]))
@@ -0,0 +1,257 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""On-disk cache of decrypted thumbnails of remote files."""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import httpx
+from pydantic import BaseModel, Field
+
+from ente_tools.api.core.api import EnteAPI, EnteAPIError
+from ente_tools.api.core.ente_crypt import EnteCryptError
+from ente_tools.api.core.types_file import File
+from ente_tools.api.core.writer import AtomicFileWriter
+
+if TYPE_CHECKING:
+    from ente_tools.db.base import Backend
+
+log = logging.getLogger(__name__)
+
+
+class ThumbnailEntry(BaseModel):
+    """The cached thumbnail of a remote file."""
+
+    file_id: int
+    update_time: int
+    """The update time of the file when its thumbnail was cached."""
+    digest: str
+    """The blake2b hex digest of the thumbnail, naming it in the cache directory."""
+    size: int
+    last_access: float = Field(default_factory=time.time)
+    """When the thumbnail was last cached or read, in seconds since the epoch."""
+
+
+class PrefetchReport(BaseModel):
+    """Summary of a prefetch of thumbnails."""
+
+    cached: int = 0
+    """The number of thumbnails already cached."""
+    fetched: int = 0
+    failed: int = 0
+    size: int = 0
+    """The number of bytes fetched."""
+
+
+class ThumbnailCache:
+    """A size-capped directory of decrypted thumbnails, with its index in the backend.
+
+    Thumbnails are stored by the digest of their content, so files sharing a
+    thumbnail, e.g. copies in several albums, share its storage. When the
+    cache grows over its cap, the least recently used thumbnails are evicted.
+    Access times are kept in memory and saved with `save`, so reads do not
+    each write to the backend.
+
+    The cache is thread-safe.
+    """
+
+    MaxSize = 1024 * 1024 * 1024
+    """Default cap of the total size of the cached thumbnails."""
+
+    def __init__(self, directory: Path, backend: "Backend", *, max_size: int = MaxSize) -> None:
+        """Open the cache, loading its index from the backend.
+
+        Args:
+            directory: The directory of the thumbnails; created if missing.
+            backend: The backend storing the index.
+            max_size: The cap of the total size of the cached thumbnails, in bytes.
+
+        """
+        self.directory = directory
+        self.backend = backend
+        self.max_size = max_size
+        self.entries = backend.get_thumbnail_index()
+        """The cached thumbnails, by file ID."""
+        self._digests: OrderedDict[str, set[int]] = OrderedDict()
+        """The IDs of the files sharing each thumbnail, least recently used first."""
+        self._size = 0
+        for e in sorted(self.entries.values(), key=lambda e: e.last_access):
+            self._add(e)
+        self._dirty: dict[int, ThumbnailEntry] = {}
+        self._lock = threading.Lock()
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest: str) -> Path:
+        """Return the path of a thumbnail by its digest."""
+        return self.directory / digest[:2] / f"{digest}.jpg"
+
+    @property
+    def size(self) -> int:
+        """The total size of the cached thumbnails, counting shared ones once."""
+        with self._lock:
+            return self._size
+
+    def _add(self, entry: ThumbnailEntry) -> None:
+        """Count a file's reference to its thumbnail, as the most recently used."""
+        files = self._digests.get(entry.digest)
+        if files is None:
+            files = self._digests[entry.digest] = set()
+            self._size += entry.size
+        files.add(entry.file_id)
+        self._digests.move_to_end(entry.digest)
+
+    def _remove(self, entry: ThumbnailEntry) -> bool:
+        """Drop a file's reference to its thumbnail, returning whether no other file shares it."""
+        files = self._digests[entry.digest]
+        files.discard(entry.file_id)
+        if files:
+            return False
+        del self._digests[entry.digest]
+        self._size -= entry.size
+        return True
+
+    def get(self, file: File) -> Path | None:
+        """Return the cached thumbnail of a file, if cached at the file's current version."""
+        with self._lock:
+            entry = self.entries.get(file.id)
+            if entry is None or entry.update_time != file.update_time:
+                return None
+            path = self.path(entry.digest)
+            if not path.exists():
+                # Removed from the directory behind the index's back
+                return None
+            entry.last_access = time.time()
+            self._digests.move_to_end(entry.digest)
+            self._dirty[file.id] = entry
+            return path
+
+    def put(self, file: File, data: bytes) -> Path:
+        """Cache the decrypted thumbnail of a file, evicting others if over the cap.
+
+        Returns:
+            The path of the cached thumbnail.
+
+        """
+        digest = hashlib.blake2b(data).hexdigest()
+        path = self.path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            with AtomicFileWriter(path, size=len(data)) as f:
+                f.write(data)
+                f.commit()
+        with self._lock:
+            entry = ThumbnailEntry(file_id=file.id, update_time=file.update_time, digest=digest, size=len(data))
+            previous = self.entries.get(file.id)
+            # The thumbnail of an updated file replaces the former one, unless shared
+            if previous is not None and self._remove(previous) and previous.digest != digest:
+                self.path(previous.digest).unlink(missing_ok=True)
+            self.entries[file.id] = entry
+            self._add(entry)
+            self._dirty[file.id] = entry
+            if self._size > self.max_size:
+                self._evict()
+        return path
+
+    def _evict(self) -> None:
+        """Remove the least recently used thumbnails until the cache is within its cap."""
+        evicted: list[int] = []
+        while self._size > self.max_size and self._digests:
+            (digest, files) = self._digests.popitem(last=False)
+            self.path(digest).unlink(missing_ok=True)
+            self._size -= self.entries[next(iter(files))].size
+            for file_id in files:
+                del self.entries[file_id]
+                self._dirty.pop(file_id, None)
+                evicted.append(file_id)
+        log.debug("Evicted %d thumbnails, cache is now %d bytes", len(evicted), self._size)
+        self.backend.delete_thumbnail_index(evicted)
+
+    def save(self) -> None:
+        """Save the thumbnails cached or read since the last save to the index."""
+        with self._lock:
+            if self._dirty:
+                self.backend.save_thumbnail_index(list(self._dirty.values()))
+                self._dirty = {}
+
+    def fetch(self, api: EnteAPI, file: File, key: bytes, *, token: bytes | None = None) -> Path:
+        """Return the thumbnail of a file, downloading and caching it if not cached.
+
+        Args:
+            api: The API client.
+            file: The remote file.
+            key: The decrypted file key.
+            token: The authentication token of the file's account; see `EnteAPI.iter_file`.
+
+        """
+        path = self.get(file)
+        if path is None:
+            path = self.put(file, api.download_thumbnail(file, key, token=token))
+        return path
+
+    def prefetch(
+        self,
+        api: EnteAPI,
+        tasks: Sequence[tuple[File, Callable[[], bytes], bytes | None]],
+        *,
+        workers: int = 8,
+        progress: Callable[[int, int], None] | None = None,
+    ) -> PrefetchReport:
+        """Download and cache the thumbnails of files that are not cached, concurrently.
+
+        Args:
+            api: The API client.
+            tasks: The files, each with a function returning its decrypted key and the
+                authentication token of its account.
+            workers: The maximum number of thumbnails downloaded concurrently.
+            progress: Called with the number of thumbnails fetched or failed so far,
+                and the number not cached.
+
+        Returns:
+            The summary of the prefetch.
+
+        """
+        report = PrefetchReport()
+        todo = [t for t in tasks if self.get(t[0]) is None]
+        report.cached = len(tasks) - len(todo)
+        lock = threading.Lock()
+
+        def run_task(task: tuple[File, Callable[[], bytes], bytes | None]) -> None:
+            (file, key, token) = task
+            try:
+                size = self.put(file, api.download_thumbnail(file, key(), token=token)).stat().st_size
+            except (EnteAPIError, EnteCryptError, httpx.HTTPError, OSError) as e:
+                log.warning("Failed to fetch the thumbnail of file %d: %s", file.id, e)
+                size = None
+            with lock:
+                if size is None:
+                    report.failed += 1
+                else:
+                    report.fetched += 1
+                    report.size += size
+                if progress is not None:
+                    progress(report.fetched + report.failed, len(todo))
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as e:
+                list(e.map(run_task, todo))
+        finally:
+            self.save()
+        return report
@@ -0,0 +1,499 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Upload of local media files: stream encryption, concurrent multipart uploads and registration."""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from base64 import b64encode
+from collections import defaultdict
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Any, BinaryIO, Literal
+
+import av
+import httpx
+from nacl.secret import SecretBox
+from nacl.utils import random
+from PIL import Image, ImageOps
+from pydantic import BaseModel, Field
+
+from ente_tools.api.core.api import EnteAPI, EnteAPIError
+from ente_tools.api.core.ente_crypt import (
+    CHUNK_SIZE,
+    StreamEncryptionSize,
+    encrypt_blob,
+    encrypt_stream,
+    encrypted_size,
+)
+from ente_tools.api.core.types_file import EncryptedFile, File, UploadURL
+from ente_tools.api.photo.file_metadata import Media
+from ente_tools.api.photo.loader import DictTypes, extract_metadata, hash_file, identify_media_type
+from ente_tools.api.photo.planner import is_current, normalize_hash
+
+log = logging.getLogger(__name__)
+
+ChunksPerPart = 5
+"""Number of encrypted chunks in each part of a multipart upload."""
+
+ThumbnailMaxSide = 720
+"""The largest width or height of generated thumbnails, in pixels."""
+
+FILE_TYPES = {"image": 0, "video": 1}
+"""The file types of the metadata, by media type."""
+
+
+class UploadError(Exception):
+    """Raised when a local file cannot be uploaded."""
+
+
+def b64(data: bytes) -> str:
+    """Encode bytes in the standard base64 alphabet, as the other Ente clients expect."""
+    return str(b64encode(data), "utf-8")
+
+
+def _jpeg(img: Image.Image) -> bytes:
+    img = img.convert("RGB")
+    img.thumbnail((ThumbnailMaxSide, ThumbnailMaxSide))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def make_thumbnail(path: Path, media_type: Literal["image", "video"]) -> bytes:
+    """Return a JPEG thumbnail of an image, or of the first frame of a video.
+
+    A blank thumbnail is returned if the file cannot be decoded, so the file is
+    still uploaded.
+    """
+    try:
+        if media_type == "image":
+            with Image.open(path) as img:
+                return _jpeg(ImageOps.exif_transpose(img))
+        with av.open(str(path)) as container:
+            return _jpeg(next(container.decode(video=0)).to_image())
+    except Exception as e:  # noqa: BLE001 - any failure of the image and video libraries
+        log.warning("Failed making a thumbnail of %s: %s", path, e)
+        return _jpeg(Image.new("RGB", (1, 1)))
+
+
+def creation_time(metadata: dict[str, DictTypes]) -> int | None:
+    """Return when a media file was taken, from its metadata, in microseconds since the epoch."""
+    for key in ("Extra:DateTimeOriginal", "Base:DateTime"):
+        value = metadata.get(key)
+        if isinstance(value, str):
+            try:
+                # EXIF times are in the local time of the camera
+                taken = datetime.strptime(value, "%Y:%m:%d %H:%M:%S")  # noqa: DTZ007
+            except ValueError:
+                continue
+            return int(taken.timestamp() * 1_000_000)
+    value = metadata.get("creation_time")
+    if isinstance(value, str):
+        try:
+            return int(datetime.fromisoformat(value).timestamp() * 1_000_000)
+        except ValueError:
+            pass
+    return None
+
+
+def file_metadata(path: Path, media_type: Literal["image", "video"], file_hash: bytes) -> dict[str, Any]:
+    """Return the metadata of a local file as uploaded, before encryption.
+
+    Args:
+        path: The file.
+        media_type: Whether the file is an image or a video.
+        file_hash: The blake2b digest of the content.
+
+    """
+    try:
+        metadata = extract_metadata(str(path), media_type)
+    except Exception as e:  # noqa: BLE001 - any failure of the image and video libraries
+        log.warning("Failed extracting metadata from %s: %s", path, e)
+        metadata = {}
+    modification_time = path.stat().st_mtime_ns // 1000
+    return {
+        "fileType": FILE_TYPES[media_type],
+        "title": path.name,
+        "creationTime": creation_time(metadata) or modification_time,
+        "modificationTime": modification_time,
+        "hash": b64(file_hash),
+    }
+
+
+def media_files(paths: Sequence[Path]) -> list[Path]:
+    """Return the media files among files and the files in directories, recursively.
+
+    Raises:
+        UploadError: If a path does not exist.
+
+    """
+    files: list[Path] = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob("*") if p.is_file()))
+        elif path.is_file():
+            files.append(path)
+        else:
+            msg = f"{path} does not exist"
+            raise UploadError(msg)
+    return [
+        f for f in dict.fromkeys(files) if (m := guess_type(f, strict=False)[0]) and identify_media_type(m) is not None
+    ]
+
+
+def local_hashes(paths: Sequence[Path], local_media: Sequence[Media]) -> dict[Path, str]:
+    """Return the hashes of local files, as in the local index.
+
+    Files indexed and unchanged since keep their indexed hash, and the others
+    are read to hash them.
+
+    Args:
+        paths: The files.
+        local_media: The local media index.
+
+    """
+    indexed = {Path(m.media.file.fullpath).resolve(): m.media for m in local_media}
+    hashes: dict[Path, str] = {}
+    for path in paths:
+        media = indexed.get(path.resolve())
+        hashes[path] = media.hash if media is not None and is_current(media.file) else hash_file(str(path))
+    return hashes
+
+
+class UploadPlan(BaseModel):
+    """How local files are brought into a collection, content already in the account not being uploaded."""
+
+    uploads: list[Path] = []
+    """The files whose content is not in the account."""
+    adds: dict[Path, File] = {}
+    """The files whose content is in another collection of the account, by the remote file to add."""
+    present: dict[Path, int] = {}
+    """The files whose content is already in the collection, by the ID of the remote file."""
+    duplicates: dict[Path, Path] = {}
+    """The files with the same content as another file of the run, by that file."""
+
+
+def plan_uploads(
+    hashes: Mapping[Path, str],
+    remote_files: Sequence[File],
+    collection_id: int,
+    user_id: int,
+) -> UploadPlan:
+    """Plan bringing local files into a collection, by their hash.
+
+    Content already in the collection is skipped, and content in another
+    collection is added to the collection without uploading it again, from a
+    file the user owns: files shared with the user can only be uploaded.
+
+    Args:
+        hashes: The hashes of the local files, in the order to upload them.
+        remote_files: The files of the account, with their metadata decrypted.
+        collection_id: The ID of the collection.
+        user_id: The ID of the user of the account.
+
+    Returns:
+        The plan.
+
+    """
+    remote: dict[str, list[File]] = defaultdict(list)
+    for f in remote_files:
+        if not f.is_deleted and isinstance(remote_hash := f.metadata.get("hash"), str):
+            remote[normalize_hash(remote_hash)].append(f)
+
+    plan = UploadPlan()
+    seen: dict[str, Path] = {}
+    for path, file_hash in hashes.items():
+        if (first := seen.setdefault(file_hash, path)) != path:
+            plan.duplicates[path] = first
+            continue
+        copies = remote.get(file_hash, [])
+        if present := next((f for f in copies if f.collection_id == collection_id), None):
+            plan.present[path] = present.id
+        elif owned := next((f for f in copies if f.owner_id == user_id), None):
+            plan.adds[path] = owned
+        else:
+            plan.uploads.append(path)
+    return plan
+
+
+class UploadReport(BaseModel):
+    """Summary of an upload run."""
+
+    uploaded: dict[str, int] = Field(default_factory=dict)
+    """The IDs of the created files, by local path."""
+    added: dict[str, int] = Field(default_factory=dict)
+    """The IDs of the files added from other collections instead of uploading them, by local path."""
+    present: dict[str, int] = Field(default_factory=dict)
+    """The IDs of the files already in the collection, by local path."""
+    failed: dict[str, str] = Field(default_factory=dict)
+    """Why files failed to upload, by local path."""
+    size: int = 0
+    """The number of encrypted bytes uploaded, including thumbnails."""
+    seconds: float = 0.0
+    """The duration of the run."""
+
+    @property
+    def throughput(self) -> float:
+        """The achieved throughput, in bytes per second."""
+        return self.size / self.seconds if self.seconds > 0 else 0.0
+
+
+class Uploader:
+    """Uploads local media files into a collection.
+
+    Each file is encrypted as a stream with a new file key, in chunks of
+    `StreamEncryptionSize` bytes, and uploaded as it is encrypted: files larger
+    than a part are uploaded in parts of `ChunksPerPart` chunks, several at a
+    time, and smaller ones in one request. Its thumbnail and metadata are
+    encrypted with the same key, and the file is then registered in the
+    collection with its key encrypted with the collection key.
+
+    Parts are uploaded by a pool of workers shared by all files, and at most
+    twice as many parts as workers are held in memory.
+    """
+
+    UrlBatchSize = 50
+    """Number of upload URLs requested at a time."""
+
+    AddBatchSize = 100
+    """Number of files added to the collection in each request."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        api: EnteAPI,
+        collection_id: int,
+        collection_key: bytes,
+        *,
+        chunks_per_part: int = ChunksPerPart,
+        workers: int = 4,
+        progress: Callable[[int], None] | None = None,
+    ) -> None:
+        """Initialise the uploader.
+
+        Args:
+            api: The API client, with the token of the collection's account set.
+            collection_id: The ID of the collection to upload into.
+            collection_key: The decrypted key of the collection.
+            chunks_per_part: The number of encrypted chunks in each part.
+            workers: The maximum number of parts uploaded concurrently.
+            progress: Called with the number of bytes of each part or object uploaded.
+
+        """
+        self.api = api
+        self.collection_id = collection_id
+        self.collection_key = collection_key
+        self.part_size = chunks_per_part * CHUNK_SIZE
+        self.workers = max(workers, 1)
+        self.progress = progress
+        self._executor: ThreadPoolExecutor | None = None
+        self._slots = threading.BoundedSemaphore(2 * self.workers)
+        self._urls: list[UploadURL] = []
+        self._lock = threading.Lock()
+        self._uploaded = 0
+
+    def upload(self, paths: Sequence[Path], *, file_workers: int = 2) -> UploadReport:
+        """Upload local media files.
+
+        Args:
+            paths: The files.
+            file_workers: The maximum number of files encrypted concurrently.
+
+        Returns:
+            The report of the run.
+
+        """
+        report = UploadReport()
+        start = time.monotonic()
+
+        def run_task(path: Path) -> None:
+            try:
+                file = self.upload_file(path)
+            except (UploadError, EnteAPIError, httpx.HTTPError, OSError) as e:
+                log.warning("Failed to upload %s: %s", path, e)
+                with self._lock:
+                    report.failed[str(path)] = str(e)
+                return
+            log.debug("Uploaded %s as file %d", path, file.id)
+            with self._lock:
+                report.uploaded[str(path)] = file.id
+
+        with ThreadPoolExecutor(max_workers=self.workers) as parts, ThreadPoolExecutor(max(file_workers, 1)) as files:
+            self._executor = parts
+            try:
+                list(files.map(run_task, paths))
+            finally:
+                self._executor = None
+        report.seconds = time.monotonic() - start
+        report.size = self._uploaded
+        return report
+
+    def add(self, files: Mapping[Path, tuple[int, bytes]]) -> dict[str, int]:
+        """Add files already in the account to the collection, without uploading their content.
+
+        Args:
+            files: By local path, the ID and decrypted key of the remote file with its content.
+
+        Returns:
+            The IDs of the added files, by local path.
+
+        Raises:
+            EnteAPIError: If the server fails to add files.
+
+        """
+        added: dict[str, int] = {}
+        items = list(files.items())
+        for i in range(0, len(items), self.AddBatchSize):
+            batch = items[i : i + self.AddBatchSize]
+            requests = []
+            for _, (file_id, key) in batch:
+                nonce = random(SecretBox.NONCE_SIZE)
+                requests.append(
+                    {
+                        "id": file_id,
+                        "encryptedKey": b64(SecretBox(self.collection_key).encrypt(key, nonce).ciphertext),
+                        "keyDecryptionNonce": b64(nonce),
+                    },
+                )
+            self.api.add_files(self.collection_id, requests)
+            added.update((str(path), file_id) for (path, (file_id, _)) in batch)
+        return added
+
+    def upload_file(self, path: Path) -> EncryptedFile:
+        """Upload a local media file.
+
+        Returns:
+            The created file.
+
+        Raises:
+            UploadError: If the file is not a media file, or changed while uploaded.
+            EnteAPIError: If the server or the storage fails the upload.
+
+        """
+        mime_type = guess_type(path, strict=False)[0]
+        subtype = identify_media_type(mime_type) if mime_type else None
+        if subtype is None:
+            msg = f"{path} is not a media file"
+            raise UploadError(msg)
+        media_type = subtype.model_fields["media_type"].default
+
+        key = random(SecretBox.KEY_SIZE)
+        digest = hashlib.blake2b()
+        with path.open("rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            (header, encrypted) = encrypt_stream(key, self._read(path, f, size, digest))
+            file_object = self._upload_object(self._parts(encrypted), encrypted_size(size))
+
+        (thumbnail, thumbnail_header) = encrypt_blob(make_thumbnail(path, media_type), key)
+        thumbnail_object = self._upload_object(iter([thumbnail]), len(thumbnail))
+
+        metadata = json.dumps(file_metadata(path, media_type, digest.digest())).encode()
+        (encrypted_metadata, metadata_header) = encrypt_blob(metadata, key)
+        nonce = random(SecretBox.NONCE_SIZE)
+        return self.api.create_file(
+            {
+                "collectionID": self.collection_id,
+                "encryptedKey": b64(SecretBox(self.collection_key).encrypt(key, nonce).ciphertext),
+                "keyDecryptionNonce": b64(nonce),
+                "file": {"objectKey": file_object, "decryptionHeader": b64(header), "size": encrypted_size(size)},
+                "thumbnail": {
+                    "objectKey": thumbnail_object,
+                    "decryptionHeader": b64(thumbnail_header),
+                    "size": len(thumbnail),
+                },
+                "metadata": {"encryptedData": b64(encrypted_metadata), "decryptionHeader": b64(metadata_header)},
+            },
+        )
+
+    @staticmethod
+    def _read(path: Path, f: BinaryIO, size: int, digest: "hashlib.blake2b") -> Iterator[bytes]:
+        """Read a file in chunks to encrypt, hashing them, and checking it did not change size."""
+        read = 0
+        while chunk := f.read(StreamEncryptionSize):
+            digest.update(chunk)
+            read += len(chunk)
+            yield chunk
+        if read != size:
+            msg = f"{path} changed while uploaded"
+            raise UploadError(msg)
+
+    def _parts(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """Gather encrypted chunks into parts."""
+        part = bytearray()
+        for chunk in chunks:
+            part += chunk
+            if len(part) >= self.part_size:
+                yield bytes(part)
+                part = bytearray()
+        if part:
+            yield bytes(part)
+
+    def _upload_url(self) -> UploadURL:
+        with self._lock:
+            if not self._urls:
+                self._urls = self.api.get_upload_urls(self.UrlBatchSize)
+            return self._urls.pop()
+
+    def _put(self, url: str, data: bytes) -> str:
+        etag = self.api.put_object(url, data)
+        with self._lock:
+            self._uploaded += len(data)
+        if self.progress is not None:
+            self.progress(len(data))
+        return etag
+
+    def _upload_object(self, parts: Iterator[bytes], size: int) -> str:
+        """Upload an object in one request or in parts, depending on its size.
+
+        Args:
+            parts: The content, in parts of `part_size` bytes except the last.
+            size: The size of the content.
+
+        Returns:
+            The key of the uploaded object.
+
+        """
+        count = max(1, -(-size // self.part_size))
+        if count == 1:
+            url = self._upload_url()
+            self._put(url.url, b"".join(parts))
+            return url.object_key
+        if self._executor is None:
+            # A file uploaded on its own, outside of upload(), has a pool of its own
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                return self._upload_parts(executor, parts, count)
+        return self._upload_parts(self._executor, parts, count)
+
+    def _upload_parts(self, executor: ThreadPoolExecutor, parts: Iterator[bytes], count: int) -> str:
+        """Upload an object in `count` parts, concurrently on the executor."""
+        urls = self.api.get_multipart_upload_urls(count)
+        futures: list[Future[str]] = []
+        try:
+            for url, data in zip(urls.part_urls, parts, strict=True):
+                self._slots.acquire()
+                future = executor.submit(self._put, url, data)
+                future.add_done_callback(lambda _: self._slots.release())
+                futures.append(future)
+        except ValueError as e:
+            msg = f"content does not fit the {count} parts: {e}"
+            raise UploadError(msg) from e
+        self.api.complete_multipart_upload(urls.complete_url, [f.result() for f in futures])
+        return urls.object_key
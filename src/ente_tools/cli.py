@@ -14,16 +14,20 @@
 """DocString."""
 
 import logging
-from enum import Enum
+import re
+from enum import Enum, StrEnum
 from pathlib import Path
 from typing import TYPE_CHECKING, Annotated
 
 import typer
 from platformdirs import user_cache_dir, user_config_dir
+from rich.console import Console
 from rich.logging import RichHandler
 from typer_config.callbacks import toml_conf_callback
 
 from ente_tools.api.core.api import EnteAPIError
+from ente_tools.api.core.writer import FsyncPolicy
+from ente_tools.api.photo.scheduler import SchedulePolicy
 from ente_tools.api.photo.sync import EnteClient
 from ente_tools.db.in_memory import InMemoryBackend
 from ente_tools.db.sqlite import SQLiteBackend
@@ -34,6 +38,9 @@ if TYPE_CHECKING:
 
 APP_NAME = "ente_tool2"
 
+THUMBNAIL_DIR = Path(user_cache_dir(APP_NAME)) / "thumbnails"
+"""The default directory of the thumbnail cache."""
+
 app = typer.Typer(rich_markup_mode=None)
 
 log = logging.getLogger(__name__)
@@ -42,7 +49,8 @@ logging.basicConfig(
     level="INFO",
     format="%(message)s",
     datefmt="[%X]",
-    handlers=[RichHandler()],
+    # Log to stderr so stdout is free for file content
+    handlers=[RichHandler(console=Console(stderr=True))],
 )
 
 
@@ -53,6 +61,15 @@ class BackendChoice(str, Enum):
     SQLITE = "sqlite"
 
 
+class StorageCodecChoice(StrEnum):
+    """Enum for the available storage codecs of the SQLite backend."""
+
+    COLUMN = "column"
+    JSON = "json"
+    MSGPACK = "msgpack"
+    ZSTD = "zstd"
+
+
 def get_toml_config(app_name: str) -> str:
     """Fetch TOML configuration file to load."""
     filename = f"{app_name}.toml"
@@ -79,6 +96,20 @@ def load_toml_config(ctxt: typer.Context, param: typer.CallbackParam, config: st
     return toml_conf_callback(ctxt, param, config)
 
 
+SIZE_UNITS = {"": 1, "K": 1000, "M": 1000**2, "G": 1000**3, "KI": 1024, "MI": 1024**2, "GI": 1024**3}
+
+
+def parse_size(value: str | int) -> int:
+    """Parse a number of bytes with an optional unit, e.g. 500k, 2MB or 1.5MiB."""
+    if isinstance(value, int):
+        return value
+    m = re.fullmatch(r"\s*([\d.]+)\s*([kmg]i?)?b?\s*", value, re.IGNORECASE)
+    if not m:
+        msg = f"invalid size {value!r}"
+        raise typer.BadParameter(msg)
+    return int(float(m[1]) * SIZE_UNITS[(m[2] or "").upper()])
+
+
 def get_client(ctxt: typer.Context) -> EnteClient:
     """Create EnteClient using the command line arguments."""
     return EnteClient(
@@ -86,6 +117,12 @@ def get_client(ctxt: typer.Context) -> EnteClient:
         api_url=ctxt.obj["api_url"],
         api_account_url=ctxt.obj["api_account_url"],
         api_download_url=ctxt.obj["api_download_url"],
+        bandwidth_limit=ctxt.obj["bandwidth_limit"],
+        bandwidth_burst=ctxt.obj["bandwidth_burst"],
+        thumbnail_dir=ctxt.obj["thumbnail_dir"],
+        thumbnail_cache_size=ctxt.obj["thumbnail_cache_size"],
+        blob_cache_dir=ctxt.obj["blob_cache"],
+        blob_cache_size=ctxt.obj["blob_cache_size"],
     )
 
 
@@ -120,6 +157,31 @@ def refresh(
     client.local_refresh(ctxt.obj["sync_dir"], force_refresh=force_refresh, workers=workers)
 
 
+@app.command()
+def remote_metadata(
+    ctxt: typer.Context,
+    max_chunks: Annotated[int, typer.Option(help="Maximum chunks downloaded per file")] = 1,
+    force: Annotated[bool, typer.Option()] = False,  # noqa: FBT002
+    workers: Annotated[int | None, typer.Option()] = None,
+) -> None:
+    """Extract media metadata of remote files from partial downloads."""
+    client = get_client(ctxt)
+    client.remote_metadata(max_chunks=max_chunks, force=force, workers=workers)
+
+
+@app.command()
+def audit(
+    ctxt: typer.Context,
+    workers: Annotated[int, typer.Option(help="Maximum files downloaded concurrently")] = 4,
+    resume: Annotated[bool, typer.Option(help="Skip files audited before")] = False,  # noqa: FBT002
+) -> None:
+    """Verify that remote files decrypt and match their hashes, without storing them."""
+    client = get_client(ctxt)
+    report = client.audit(workers=workers, resume=resume)
+    if report.failed:
+        raise typer.Exit(1)
+
+
 @app.command()
 def export(ctxt: typer.Context) -> None:
     """Export local data."""
@@ -133,24 +195,89 @@ def export(ctxt: typer.Context) -> None:
 
 
 @app.command()
-def upload(ctxt: typer.Context, file: str) -> None:
-    """Upload local file."""
-    log.info("sync_dir: %s database: %s", ctxt.obj["sync_dir"], ctxt.obj["database"])
-    log.info("Uploading file %s", file)
+def compact(ctxt: typer.Context) -> None:
+    """Re-encode the database with the configured storage codec."""
+    client = get_client(ctxt)
+    client.backend.compact()
+
+
+@app.command()
+def upload(  # noqa: PLR0913
+    ctxt: typer.Context,
+    paths: Annotated[list[Path], typer.Argument(exists=True, help="Media files, or directories of them")],
+    *,
+    collection: Annotated[int, typer.Option(help="ID of the collection to upload into")],
+    email: Annotated[str | None, typer.Option(help="Account to upload with (default: the collection's owner)")] = None,
+    workers: Annotated[int, typer.Option(help="Maximum concurrent part uploads")] = 4,
+    file_workers: Annotated[int, typer.Option(help="Maximum files encrypted concurrently")] = 2,
+    dry_run: Annotated[bool, typer.Option(help="Only show what would be uploaded")] = False,
+) -> None:
+    """Upload local media files into a collection, skipping content already in the account."""
+    client = get_client(ctxt)
+    report = client.upload(
+        paths,
+        collection,
+        email=email,
+        workers=workers,
+        file_workers=file_workers,
+        dry_run=dry_run,
+    )
+    if report.failed:
+        raise typer.Exit(1)
 
 
 @app.command()
-def download_missing(ctxt: typer.Context) -> None:
+def download_missing(  # noqa: PLR0913
+    ctxt: typer.Context,
+    *,
+    template: Annotated[str, typer.Option(help="Jinja template of the local filename")] = "{{file.get_filename()}}",
+    dry_run: Annotated[bool, typer.Option(help="Only show what would be created")] = False,
+    policy: Annotated[SchedulePolicy, typer.Option(help="Order of the downloads")] = SchedulePolicy.SMALLEST_FIRST,
+    collection: Annotated[
+        list[int] | None,
+        typer.Option(help="ID of a collection downloaded first with the collection policy, repeatable in order"),
+    ] = None,
+    workers: Annotated[int, typer.Option(help="Maximum concurrent downloads")] = 4,
+    large_size: Annotated[
+        int,
+        typer.Option(parser=parse_size, metavar="SIZE", help="Size from which files use the large file lane"),
+    ] = EnteClient.LargeFileSize,
+    fsync: Annotated[FsyncPolicy, typer.Option(help="When downloaded files are flushed to storage")] = FsyncPolicy.NONE,
+) -> None:
     """Download any files that are not local."""
     client = get_client(ctxt)
-    client.download_missing()
+    client.download_missing(
+        ctxt.obj["sync_dir"],
+        template,
+        dry_run=dry_run,
+        policy=policy,
+        collection_priority=collection or [],
+        workers=workers,
+        large_size=large_size,
+        fsync=fsync,
+    )
 
 
 @app.command()
-def download(ctxt: typer.Context, file: str) -> None:
+def download(
+    ctxt: typer.Context,
+    file: str,
+    stdout: Annotated[bool, typer.Option(help="Write the file to standard output")] = False,  # noqa: FBT002
+    thumbnail: Annotated[bool, typer.Option(help="Download the file's thumbnail instead")] = False,  # noqa: FBT002
+) -> None:
     """Download a remote file."""
     client = get_client(ctxt)
-    client.download(file)
+    client.download(file, stdout=stdout, thumbnail=thumbnail)
+
+
+@app.command()
+def thumbnails(
+    ctxt: typer.Context,
+    workers: Annotated[int, typer.Option(help="Maximum concurrent thumbnail downloads")] = 8,
+) -> None:
+    """Download the thumbnails of all remote files into the thumbnail cache."""
+    client = get_client(ctxt)
+    client.thumbnails(workers=workers)
 
 
 @app.callback()
@@ -158,11 +285,44 @@ def app_main(  # noqa: PLR0913
     ctxt: typer.Context,
     sync_dir: Annotated[Path, typer.Option(help="Local synchronization directory")] = Path.home(),  # noqa: B008
     backend: Annotated[BackendChoice, typer.Option(help="Database backend to use")] = BackendChoice.IN_MEMORY,
+    storage_codec: Annotated[
+        StorageCodecChoice,
+        typer.Option(help="Encoding of stored media and file records (sqlite only)"),
+    ] = StorageCodecChoice.COLUMN,
     max_vers: Annotated[int, typer.Option(help="Maximum backup versions of database (0 = disable)")] = 10,
     api_url: Annotated[str, typer.Option(help="API URL for Ente")] = EnteClient.EnteApiUrl,
     api_account_url: Annotated[str, typer.Option(help="API Account URL for Ente")] = EnteClient.EnteAccountUrl,
     api_download_url: Annotated[str, typer.Option(help="Download API URL")] = EnteClient.EnteDownloadUrl,
     database: Annotated[Path, typer.Option(help="Database file")] = Path(user_cache_dir()) / f"{APP_NAME}.db",  # noqa: B008
+    bandwidth_limit: Annotated[
+        int | None,
+        typer.Option(
+            parser=parse_size,
+            metavar="SIZE",
+            help="Maximum download rate per second, e.g. 2MB (default: no limit)",
+        ),
+    ] = None,
+    bandwidth_burst: Annotated[
+        int | None,
+        typer.Option(
+            parser=parse_size,
+            metavar="SIZE",
+            help="Most bytes downloaded at once above the rate (default: one second)",
+        ),
+    ] = None,
+    thumbnail_dir: Annotated[Path, typer.Option(help="Thumbnail cache")] = THUMBNAIL_DIR,
+    thumbnail_cache_size: Annotated[
+        int,
+        typer.Option(parser=parse_size, metavar="SIZE", help="Maximum size of the thumbnail cache"),
+    ] = EnteClient.ThumbnailCacheSize,
+    blob_cache: Annotated[
+        Path | None,
+        typer.Option(help="Cache of encrypted downloads, can be shared by hosts (default: no cache)"),
+    ] = None,
+    blob_cache_size: Annotated[
+        int,
+        typer.Option(parser=parse_size, metavar="SIZE", help="Maximum size of the blob cache"),
+    ] = EnteClient.BlobCacheSize,
     debug: Annotated[bool, typer.Option(help="Enable debug logging")] = False,  # noqa: FBT002
     config: Annotated[  # noqa: ARG001
         str,
@@ -184,7 +344,12 @@ def app_main(  # noqa: PLR0913
         raise typer.Exit(1)
 
     backend_instance: Backend = (
-        SQLiteBackend(db_path=str(database)) if backend == BackendChoice.SQLITE else InMemoryBackend()
+        SQLiteBackend(
+            db_path=str(database),
+            codec=None if storage_codec == StorageCodecChoice.COLUMN else storage_codec.value,
+        )
+        if backend == BackendChoice.SQLITE
+        else InMemoryBackend()
     )
 
     ctxt.obj["backend"] = backend_instance
@@ -194,6 +359,12 @@ def app_main(  # noqa: PLR0913
     ctxt.obj["api_url"] = api_url
     ctxt.obj["api_account_url"] = api_account_url
     ctxt.obj["api_download_url"] = api_download_url
+    ctxt.obj["bandwidth_limit"] = bandwidth_limit
+    ctxt.obj["bandwidth_burst"] = bandwidth_burst
+    ctxt.obj["thumbnail_dir"] = thumbnail_dir
+    ctxt.obj["thumbnail_cache_size"] = thumbnail_cache_size
+    ctxt.obj["blob_cache"] = blob_cache
+    ctxt.obj["blob_cache_size"] = blob_cache_size
 
 
 def main() -> None:
@@ -14,9 +14,17 @@
 """Base class for database backends."""
 
 from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from typing import TYPE_CHECKING
 
-from ente_tools.api.core.account import EnteAccount
-from ente_tools.api.photo.file_metadata import Media
+from ente_tools.api.core.account import AccountSummary, EnteAccount, RefreshSink
+
+if TYPE_CHECKING:
+    from ente_tools.api.photo.audit import AuditResult
+    from ente_tools.api.photo.file_metadata import Media
+    from ente_tools.api.photo.journal import JournalEntry
+    from ente_tools.api.photo.remote_metadata import RemoteMetadata
+    from ente_tools.api.photo.thumbnails import ThumbnailEntry
 
 
 class Backend(ABC):
@@ -27,6 +35,25 @@ class Backend(ABC):
         """Get all accounts from the backend."""
         raise NotImplementedError
 
+    @abstractmethod
+    def list_account_summaries(self) -> list[AccountSummary]:
+        """Get a summary of all accounts without loading their files."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_account(self, email: str, *, with_files: bool = True) -> EnteAccount | None:
+        """Get a single account by email, or None if it is not linked.
+
+        With `with_files` False, the files of the account may be left out, which
+        is all a refresh needs.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def refresh_sink(self, email: str) -> RefreshSink:
+        """Get the sink saving the results of refreshing an account."""
+        raise NotImplementedError
+
     @abstractmethod
     def add_account(self, account: EnteAccount) -> None:
         """Add an account to the backend."""
@@ -38,11 +65,75 @@ class Backend(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def get_local_media(self) -> list[Media]:
+    def get_local_media(self) -> list["Media"]:
         """Get all local media from the backend."""
         raise NotImplementedError
 
     @abstractmethod
     def local_refresh(self, sync_dir: str, *, force_refresh: bool = False, workers: int | None = None) -> None:
-        """Refresh the local data by scanning the specified directory for media files."""
+        """Refresh the local data by scanning the specified directory for media files.
+
+        Media indexed under other directories are kept, so content in several
+        directories can be found by hash.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_remote_metadata(self) -> dict[int, "RemoteMetadata"]:
+        """Get the metadata extracted from remote files, by file ID."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_remote_metadata(self, metadata: Sequence["RemoteMetadata"]) -> None:
+        """Save metadata extracted from remote files, replacing that of the same files."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_audit_results(self) -> dict[int, "AuditResult"]:
+        """Get the latest integrity audit results of remote files, by file ID."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_audit_results(self, results: Sequence["AuditResult"]) -> None:
+        """Save integrity audit results, replacing those of the same files."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_local_media(self, media: Sequence["Media"]) -> None:
+        """Add media to the local media index, replacing those of the same paths."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_download_journal(self) -> dict[str, "JournalEntry"]:
+        """Get the journal of the transfers of missing files, by target path."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_download_journal(self, entries: Sequence["JournalEntry"]) -> None:
+        """Save journal entries, replacing those of the same targets."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_download_journal(self, targets: Sequence[str]) -> None:
+        """Delete the journal entries of targets."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_thumbnail_index(self) -> dict[int, "ThumbnailEntry"]:
+        """Get the index of the thumbnail cache, by file ID."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_thumbnail_index(self, entries: Sequence["ThumbnailEntry"]) -> None:
+        """Save thumbnail cache entries, replacing those of the same files."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_thumbnail_index(self, file_ids: Sequence[int]) -> None:
+        """Delete the thumbnail cache entries of files."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def compact(self) -> None:
+        """Re-encode the stored records with the configured storage codec."""
         raise NotImplementedError
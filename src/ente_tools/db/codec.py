@@ -0,0 +1,211 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Storage codecs for records serialised into the database.
+
+Records are stored either in a plain JSON column (format 0, the original layout)
+or as an encoded blob. Each row records the format it was written with, so rows
+written with different codecs can live side by side and be read back.
+"""
+
+import json
+import logging
+from abc import ABC, abstractmethod
+from collections.abc import Iterable
+from typing import Any, ClassVar, cast
+
+import msgpack
+import zstandard
+
+log = logging.getLogger(__name__)
+
+
+class CodecError(Exception):
+    """Raised when a stored record cannot be encoded or decoded."""
+
+
+FORMAT_JSON_COLUMN = 0
+"""Format version of rows stored in the plain JSON column."""
+
+
+class StorageCodec(ABC):
+    """Encodes and decodes python objects to bytes for storage."""
+
+    name: ClassVar[str]
+    """Name of the codec as used on the command line."""
+    format_version: ClassVar[int]
+    """Format version stored per row, used to select the decoder."""
+
+    @abstractmethod
+    def encode(self, obj: Any) -> bytes:  # noqa: ANN401
+        """Encode the object to bytes."""
+
+    @abstractmethod
+    def decode(self, data: bytes) -> Any:  # noqa: ANN401
+        """Decode bytes back to the object."""
+
+
+class JSONCodec(StorageCodec):
+    """Compact JSON encoding."""
+
+    name = "json"
+    format_version = 1
+
+    def encode(self, obj: Any) -> bytes:  # noqa: ANN401
+        """Encode the object to compact JSON."""
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data: bytes) -> Any:  # noqa: ANN401
+        """Decode JSON bytes."""
+        return json.loads(data)
+
+
+class MsgpackCodec(StorageCodec):
+    """MessagePack encoding."""
+
+    name = "msgpack"
+    format_version = 2
+
+    def encode(self, obj: Any) -> bytes:  # noqa: ANN401
+        """Encode the object to MessagePack."""
+        # Only a packer without autoreset returns None
+        return cast("bytes", msgpack.packb(obj, use_bin_type=True))
+
+    def decode(self, data: bytes) -> Any:  # noqa: ANN401
+        """Decode MessagePack bytes."""
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+class ZstdCodec(StorageCodec):
+    """MessagePack encoding compressed with zstd, optionally using trained dictionaries.
+
+    The zstd frame header records the dictionary ID used for compression, so
+    decoding picks the matching dictionary from those registered with the codec.
+    Rows compressed with an older dictionary stay readable as long as that
+    dictionary is still registered.
+    """
+
+    name = "zstd"
+    format_version = 3
+
+    DictionarySize = 112 * 1024
+    """Target size of trained dictionaries."""
+    Level = 3
+    """Compression level."""
+
+    def __init__(self) -> None:
+        """Initialise the codec without any dictionaries."""
+        self._inner = MsgpackCodec()
+        self._dictionaries: dict[int, zstandard.ZstdCompressionDict] = {}
+        self._decompressors: dict[int, zstandard.ZstdDecompressor] = {0: zstandard.ZstdDecompressor()}
+        self._compressor = zstandard.ZstdCompressor(level=self.Level)
+
+    def add_dictionary(self, data: bytes, *, active: bool = False) -> int:
+        """Register a dictionary and return its ID.
+
+        Args:
+            data: The raw dictionary content, as returned by `train`.
+            active: If True, use the dictionary for compressing new records.
+
+        Returns:
+            The zstd dictionary ID.
+
+        """
+        dictionary = zstandard.ZstdCompressionDict(data)
+        dict_id = dictionary.dict_id()
+        self._dictionaries[dict_id] = dictionary
+        self._decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        if active:
+            self._compressor = zstandard.ZstdCompressor(level=self.Level, dict_data=dictionary)
+        return dict_id
+
+    def train(self, samples: Iterable[Any]) -> bytes | None:
+        """Train a dictionary from sample objects.
+
+        Args:
+            samples: Objects representative of the records to be stored.
+
+        Returns:
+            The raw dictionary content, or None if there were too few samples.
+
+        """
+        encoded: list[Any] = [self._inner.encode(s) for s in samples]
+        try:
+            return zstandard.train_dictionary(self.DictionarySize, encoded, level=self.Level).as_bytes()
+        except zstandard.ZstdError as e:
+            log.warning("Unable to train dictionary from %d samples: %s", len(encoded), e)
+            return None
+
+    def encode(self, obj: Any) -> bytes:  # noqa: ANN401
+        """Encode the object to compressed MessagePack."""
+        return self._compressor.compress(self._inner.encode(obj))
+
+    def decode(self, data: bytes) -> Any:  # noqa: ANN401
+        """Decode compressed MessagePack bytes."""
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        decompressor = self._decompressors.get(dict_id)
+        if decompressor is None:
+            msg = f"unknown zstd dictionary {dict_id}"
+            raise CodecError(msg)
+        return self._inner.decode(decompressor.decompress(data))
+
+
+CODECS: dict[str, type[StorageCodec]] = {c.name: c for c in (JSONCodec, MsgpackCodec, ZstdCodec)}
+"""Available codecs by name."""
+
+
+class CodecRegistry:
+    """Selects the codec for writing and decodes rows of any known format."""
+
+    def __init__(self, name: str | None = None) -> None:
+        """Initialise the registry.
+
+        Args:
+            name: The codec used to write new rows, or None to keep writing
+                the plain JSON column.
+
+        """
+        if name is not None and name not in CODECS:
+            msg = f"unknown storage codec {name}"
+            raise CodecError(msg)
+        self._codecs = {cls.format_version: cls() for cls in CODECS.values()}
+        self.writer: StorageCodec | None = self._codecs[CODECS[name].format_version] if name else None
+
+    @property
+    def zstd(self) -> ZstdCodec:
+        """The zstd codec, for managing dictionaries."""
+        codec = self._codecs[ZstdCodec.format_version]
+        assert isinstance(codec, ZstdCodec)
+        return codec
+
+    def encode(self, obj: Any) -> tuple[int, Any, bytes | None]:  # noqa: ANN401
+        """Encode an object for storage.
+
+        Returns:
+            A tuple of the format version, the value for the JSON column and the
+            value for the blob column.
+
+        """
+        if self.writer is None:
+            return (FORMAT_JSON_COLUMN, obj, None)
+        return (self.writer.format_version, None, self.writer.encode(obj))
+
+    def decode(self, format_version: int, column: Any, blob: bytes | None) -> Any:  # noqa: ANN401
+        """Decode a stored object given the format version it was written with."""
+        if format_version == FORMAT_JSON_COLUMN:
+            return column
+        codec = self._codecs.get(format_version)
+        if codec is None or blob is None:
+            msg = f"unable to decode row with format {format_version}"
+            raise CodecError(msg)
+        return codec.decode(blob)
@@ -27,9 +27,15 @@
 """In-memory backend for the database."""
 
 import logging
+from collections.abc import Sequence
+from pathlib import Path
 
-from ente_tools.api.core.account import EnteAccount
+from ente_tools.api.core.account import AccountSummary, EnteAccount, RefreshSink
+from ente_tools.api.photo.audit import AuditResult
 from ente_tools.api.photo.file_metadata import Media, scan_media
+from ente_tools.api.photo.journal import JournalEntry
+from ente_tools.api.photo.remote_metadata import RemoteMetadata
+from ente_tools.api.photo.thumbnails import ThumbnailEntry
 from ente_tools.db.base import Backend
 
 log = logging.getLogger(__name__)
@@ -42,11 +48,32 @@ class InMemoryBackend(Backend):
         """Initialise the in-memory backend."""
         self._accounts: list[EnteAccount] = []
         self._local_media: list[Media] = []
+        self._remote_metadata: dict[int, RemoteMetadata] = {}
+        self._audit_results: dict[int, AuditResult] = {}
+        self._download_journal: dict[str, JournalEntry] = {}
+        self._thumbnail_index: dict[int, ThumbnailEntry] = {}
 
     def get_accounts(self) -> list[EnteAccount]:
         """Get all accounts from the backend."""
         return self._accounts
 
+    def list_account_summaries(self) -> list[AccountSummary]:
+        """Get a summary of all accounts without loading their files."""
+        return [acc.summary() for acc in self._accounts]
+
+    def get_account(self, email: str, *, with_files: bool = True) -> EnteAccount | None:  # noqa: ARG002
+        """Get a single account by email, or None if it is not linked."""
+        return next((acc for acc in self._accounts if acc.email == email), None)
+
+    def refresh_sink(self, email: str) -> RefreshSink:
+        """Get the sink saving the results of refreshing an account."""
+        # The account saves the results of a refresh itself.
+        account = self.get_account(email)
+        if account is None:
+            msg = f"Email {email} is not linked"
+            raise KeyError(msg)
+        return account
+
     def add_account(self, account: EnteAccount) -> None:
         """Add an account to the backend."""
         self._accounts.append(account)
@@ -64,6 +91,60 @@ class InMemoryBackend(Backend):
         # For the in-memory backend, a refresh is always a full refresh.
         # The `force_refresh` parameter is ignored but kept for compatibility.
         log.info("Refreshing dir %s", sync_dir)
-        self.get_local_media().clear()
-        self.get_local_media().extend(list(scan_media(sync_dir, workers=workers)))
+        local_media = self.get_local_media()
+        local_media[:] = [m for m in local_media if not Path(m.media.file.fullpath).is_relative_to(sync_dir)]
+        local_media.extend(list(scan_media(sync_dir, workers=workers)))
         log.info("Refreshed dir %s", sync_dir)
+
+    def get_remote_metadata(self) -> dict[int, RemoteMetadata]:
+        """Get the metadata extracted from remote files, by file ID."""
+        return dict(self._remote_metadata)
+
+    def save_remote_metadata(self, metadata: Sequence[RemoteMetadata]) -> None:
+        """Save metadata extracted from remote files, replacing that of the same files."""
+        self._remote_metadata.update((m.file_id, m) for m in metadata)
+
+    def get_audit_results(self) -> dict[int, AuditResult]:
+        """Get the latest integrity audit results of remote files, by file ID."""
+        return dict(self._audit_results)
+
+    def save_audit_results(self, results: Sequence[AuditResult]) -> None:
+        """Save integrity audit results, replacing those of the same files."""
+        self._audit_results.update((r.file_id, r) for r in results)
+
+    def add_local_media(self, media: Sequence[Media]) -> None:
+        """Add media to the local media index, replacing those of the same paths."""
+        paths = {m.media.file.fullpath for m in media}
+        self._local_media[:] = [m for m in self._local_media if m.media.file.fullpath not in paths]
+        self._local_media.extend(media)
+
+    def get_download_journal(self) -> dict[str, JournalEntry]:
+        """Get the journal of the transfers of missing files, by target path."""
+        return dict(self._download_journal)
+
+    def save_download_journal(self, entries: Sequence[JournalEntry]) -> None:
+        """Save journal entries, replacing those of the same targets."""
+        self._download_journal.update((e.target, e) for e in entries)
+
+    def delete_download_journal(self, targets: Sequence[str]) -> None:
+        """Delete the journal entries of targets."""
+        for t in targets:
+            self._download_journal.pop(t, None)
+
+    def get_thumbnail_index(self) -> dict[int, ThumbnailEntry]:
+        """Get the index of the thumbnail cache, by file ID."""
+        return {file_id: e.model_copy() for (file_id, e) in self._thumbnail_index.items()}
+
+    def save_thumbnail_index(self, entries: Sequence[ThumbnailEntry]) -> None:
+        """Save thumbnail cache entries, replacing those of the same files."""
+        self._thumbnail_index.update((e.file_id, e.model_copy()) for e in entries)
+
+    def delete_thumbnail_index(self, file_ids: Sequence[int]) -> None:
+        """Delete the thumbnail cache entries of files."""
+        for file_id in file_ids:
+            self._thumbnail_index.pop(file_id, None)
+
+    def compact(self) -> None:
+        """Re-encode the stored records with the configured storage codec."""
+        # Nothing is encoded in memory.
+        log.info("Nothing to compact for the in-memory backend")
@@ -13,14 +13,21 @@
 # limitations under the License.
 """SQLModel definitions for the database."""
 
-from sqlalchemy import Column
-from sqlalchemy.types import JSON
+from sqlalchemy import Column, UniqueConstraint
+from sqlalchemy.types import JSON, LargeBinary
 from sqlmodel import Field, SQLModel
 
 from ente_tools.api.core.types_collection import Collection
 from ente_tools.api.core.types_crypt import AuthorizationResponse, EnteEncKeys, SPRAttributes
 from ente_tools.api.core.types_file import File
 
+SCHEMA_VERSION = 1
+"""Version of the stored media model, bumped whenever its fields change.
+
+Rows written with the current version are loaded without validation (see
+`ente_tools.db.trusted`), older rows are validated.
+"""
+
 
 class EnteAccountDB(SQLModel, table=True):
     """Represents an authenticated Ente account in the database."""
@@ -31,13 +38,98 @@ class EnteAccountDB(SQLModel, table=True):
     auth_response: AuthorizationResponse = Field(sa_column=Column(JSON))
     encrypted_keys: EnteEncKeys = Field(sa_column=Column(JSON))
     collections: list[Collection] = Field(sa_column=Column(JSON))
-    files: dict[int, list[File]] = Field(sa_column=Column(JSON))
+    file_cursors: dict[int, int] | None = Field(default=None, sa_column=Column(JSON))
+    """File diff cursors of the collections, saved with each page of files."""
+    collections_cursor: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    files: dict[int, list[File]] | None = Field(default=None, sa_column=Column(JSON(none_as_null=True)))
+    """Legacy: files stored with the account, moved to `RemoteFileDB` on startup."""
+    files_format: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    """Legacy: storage format of the files (see `ente_tools.db.codec`)."""
+    files_data: bytes | None = Field(default=None, sa_column=Column(LargeBinary))
+    """Legacy: encoded files, if not stored in the JSON column."""
+    user_id: int | None = None
+    """The Ente user ID, kept with the counts below for summaries without loading files."""
+    collection_count: int | None = None
+    file_count: int | None = None
+    update_time: int | None = None
+
+
+class RemoteFileDB(SQLModel, table=True):
+    """Represents a file of a collection of an account in the database."""
+
+    __table_args__ = (UniqueConstraint("account_id", "collection_id", "file_id"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    account_id: int = Field(foreign_key="enteaccountdb.id", index=True)
+    collection_id: int
+    file_id: int
+    file: dict | None = Field(default=None, sa_column=Column(JSON))
+    file_format: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    """Storage format of the file (see `ente_tools.db.codec`)."""
+    file_data: bytes | None = Field(default=None, sa_column=Column(LargeBinary))
+    """Encoded file, if not stored in the JSON column."""
 
 
 class MediaDB(SQLModel, table=True):
     """Represents a media file in the database."""
 
     id: int | None = Field(default=None, primary_key=True)
-    media: dict = Field(sa_column=Column(JSON))
+    media: dict | None = Field(default=None, sa_column=Column(JSON))
+    media_format: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    """Storage format of the media (see `ente_tools.db.codec`)."""
+    media_data: bytes | None = Field(default=None, sa_column=Column(LargeBinary))
+    """Encoded media, if not stored in the JSON column."""
+    schema_version: int = Field(default=SCHEMA_VERSION, sa_column_kwargs={"server_default": "0"})
     xmp_sidecar: dict | None = Field(default=None, sa_column=Column(JSON))
     fullpath: str = Field(unique=True)
+
+
+class CodecDictionaryDB(SQLModel, table=True):
+    """Represents a trained compression dictionary for the storage codec."""
+
+    id: int = Field(primary_key=True)
+    """The zstd dictionary ID."""
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    active: bool = False
+    """Whether the dictionary is used for compressing new rows."""
+
+
+class RemoteMetadataDB(SQLModel, table=True):
+    """Represents the media metadata extracted from a remote file."""
+
+    file_id: int = Field(primary_key=True)
+    update_time: int
+    """The update time of the file the metadata was extracted from."""
+    metadata_: dict = Field(sa_column=Column("metadata", JSON))
+    """The `RemoteMetadata` of the file."""
+
+
+class AuditResultDB(SQLModel, table=True):
+    """Represents the latest integrity audit of a remote file."""
+
+    file_id: int = Field(primary_key=True)
+    update_time: int
+    """The update time of the file when it was audited."""
+    result: dict = Field(sa_column=Column(JSON))
+    """The `AuditResult` of the file."""
+
+
+class DownloadJournalDB(SQLModel, table=True):
+    """Represents the transfer of a missing file to a target path."""
+
+    target: str = Field(primary_key=True)
+    """The path of the local file to create."""
+    state: str
+    """The state of the transfer, as in the entry."""
+    entry: dict = Field(sa_column=Column(JSON))
+    """The `JournalEntry` of the target."""
+
+
+class ThumbnailDB(SQLModel, table=True):
+    """Represents a thumbnail in the thumbnail cache."""
+
+    file_id: int = Field(primary_key=True)
+    digest: str
+    """The digest naming the thumbnail in the cache directory."""
+    entry: dict = Field(sa_column=Column(JSON))
+    """The `ThumbnailEntry` of the file."""
@@ -14,36 +14,275 @@
 """SQLite backend for the database."""
 
 import logging
+import random
+from collections.abc import Mapping, Sequence
+from collections.abc import Set as AbstractSet
+from pathlib import Path
+from typing import Any
 
-from sqlmodel import Session, SQLModel, create_engine, delete, select
+from sqlalchemy import Engine, func, inspect, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm.attributes import flag_modified
+from sqlmodel import Session, SQLModel, col, create_engine, delete, select
 
-from ente_tools.api.core.account import EnteAccount
+from ente_tools.api.core.account import AccountSummary, EnteAccount, RefreshSink
+from ente_tools.api.core.types_collection import Collection
+from ente_tools.api.core.types_file import File
+from ente_tools.api.photo.audit import AuditResult
 from ente_tools.api.photo.file_metadata import Media, scan_media
+from ente_tools.api.photo.journal import JournalEntry
+from ente_tools.api.photo.remote_metadata import RemoteMetadata
+from ente_tools.api.photo.thumbnails import ThumbnailEntry
 from ente_tools.db.base import Backend
-from ente_tools.db.models import EnteAccountDB, MediaDB
+from ente_tools.db.codec import CodecRegistry, ZstdCodec
+from ente_tools.db.models import (
+    SCHEMA_VERSION,
+    AuditResultDB,
+    CodecDictionaryDB,
+    DownloadJournalDB,
+    EnteAccountDB,
+    MediaDB,
+    RemoteFileDB,
+    RemoteMetadataDB,
+    ThumbnailDB,
+)
+from ente_tools.db.trusted import construct
 
 log = logging.getLogger(__name__)
 
 
+def add_missing_columns(engine: Engine) -> None:
+    """Add columns of the SQLModel tables that are missing from an existing database.
+
+    `create_all` only creates missing tables, so columns added to a model after
+    the database was created are added here. New columns must be nullable or
+    have a server default.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                log.info("Adding column %s.%s", table.name, column.name)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"  # type: ignore[attr-defined]
+                conn.execute(text(ddl))
+
+
 class SQLiteBackend(Backend):
     """SQLite backend for the database."""
 
-    def __init__(self, db_path: str = "ente.db") -> None:
-        """Initialise the SQLite backend."""
+    DictionarySamples = 2000
+    """Maximum number of rows sampled to train a compression dictionary."""
+    InsertBatch = 500
+    """Maximum number of rows inserted per statement."""
+
+    def __init__(self, db_path: str = "ente.db", codec: str | None = None) -> None:
+        """Initialise the SQLite backend.
+
+        Args:
+            db_path: The path to the SQLite database file.
+            codec: The storage codec used to write media and file records
+                (see `ente_tools.db.codec`), or None for plain JSON columns.
+
+        """
         self.engine = create_engine(f"sqlite:///{db_path}")
         SQLModel.metadata.create_all(self.engine)
+        add_missing_columns(self.engine)
+        self.codec = CodecRegistry(codec)
+        with Session(self.engine) as session:
+            for d in session.exec(select(CodecDictionaryDB)).all():
+                self.codec.zstd.add_dictionary(d.data, active=d.active)
+        self._migrate_legacy_files()
+
+    def _load_account(self, session: Session, acc: EnteAccountDB, *, with_files: bool = True) -> EnteAccount:
+        files: dict[int, list[File]] = {c["id"]: [] for c in acc.collections}  # type: ignore[index]
+        if with_files:
+            rows = session.exec(
+                select(RemoteFileDB.collection_id, RemoteFileDB.file_format, RemoteFileDB.file, RemoteFileDB.file_data)
+                .where(RemoteFileDB.account_id == acc.id)
+                .order_by(RemoteFileDB.id),  # type: ignore[arg-type]
+            ).all()
+            for collection_id, file_format, file, file_data in rows:
+                # Validating files is faster than constructing them in python (see benchmarks/bench_load.py)
+                files.setdefault(collection_id, []).append(
+                    File.model_validate(self.codec.decode(file_format, file, file_data)),
+                )
+        return EnteAccount(
+            email=acc.email,
+            attributes=acc.attributes,
+            auth_response=acc.auth_response,
+            encrypted_keys=acc.encrypted_keys,
+            collections=acc.collections,
+            files=files,
+            file_cursors=acc.file_cursors or {},
+            collections_cursor=acc.collections_cursor,
+        )
+
+    def _store_files(self, session: Session, db_account: EnteAccountDB, collection_id: int, files: list[File]) -> None:
+        """Insert or update files of a collection of an account."""
+        rows = []
+        for f in files:
+            (file_format, file, file_data) = self.codec.encode(f.model_dump(by_alias=True))
+            rows.append(
+                {
+                    "account_id": db_account.id,
+                    "collection_id": collection_id,
+                    "file_id": f.id,
+                    "file_format": file_format,
+                    "file": file,
+                    "file_data": file_data,
+                },
+            )
+        # Keep within the limit of SQLite variables per statement
+        for i in range(0, len(rows), self.InsertBatch):
+            statement = insert(RemoteFileDB).values(rows[i : i + self.InsertBatch])
+            session.exec(
+                statement.on_conflict_do_update(  # type: ignore[arg-type]
+                    index_elements=["account_id", "collection_id", "file_id"],
+                    set_={
+                        "file_format": statement.excluded.file_format,
+                        "file": statement.excluded.file,
+                        "file_data": statement.excluded.file_data,
+                    },
+                ),
+            )
+
+    def _update_summary(self, session: Session, db_account: EnteAccountDB) -> AccountSummary:
+        """Update the summary columns of an account from its collections and files.
+
+        Returns:
+            The updated summary.
+
+        """
+        summary = AccountSummary(
+            email=db_account.email,
+            user_id=db_account.encrypted_keys["user_id"],  # type: ignore[index]
+            collections=len(db_account.collections),
+            files=session.exec(
+                select(func.count()).select_from(RemoteFileDB).where(RemoteFileDB.account_id == db_account.id),
+            ).one(),
+            update_time=max((c["update_time"] for c in db_account.collections), default=0),  # type: ignore[index]
+        )
+        db_account.user_id = summary.user_id
+        db_account.collection_count = summary.collections
+        db_account.file_count = summary.files
+        db_account.update_time = summary.update_time
+        session.add(db_account)
+        return summary
+
+    def _account_row(self, session: Session, email: str) -> EnteAccountDB:
+        account = session.exec(select(EnteAccountDB).where(EnteAccountDB.email == email)).first()
+        if account is None:
+            msg = f"Email {email} is not linked"
+            raise KeyError(msg)
+        return account
+
+    def _migrate_legacy_files(self) -> None:
+        """Move files stored with the account into their own rows."""
+        with Session(self.engine) as session:
+            accounts = session.exec(
+                select(EnteAccountDB).where(
+                    EnteAccountDB.files.is_not(None) | EnteAccountDB.files_data.is_not(None),  # type: ignore[union-attr]
+                ),
+            ).all()
+            for acc in accounts:
+                # Accounts added before the column stored None as SQL NULL hold JSON null
+                files = self.codec.decode(acc.files_format, acc.files, acc.files_data) or {}
+                for collection_id, collection_files in files.items():
+                    self._store_files(
+                        session,
+                        acc,
+                        int(collection_id),
+                        [File.model_validate(f) for f in collection_files],
+                    )
+                (acc.files_format, acc.files, acc.files_data) = (0, None, None)
+                # Also written when it held JSON null, which is loaded as None too
+                flag_modified(acc, "files")
+                self._update_summary(session, acc)
+                if files:
+                    log.info("Migrated files of account %s", acc.email)
+            session.commit()
+
+    def _load_media(self, db_media: MediaDB) -> Media:
+        return self._decode_media(db_media.media_format, db_media.media, db_media.media_data, db_media.schema_version)
+
+    def _decode_media(
+        self,
+        media_format: int,
+        media: Mapping[str, Any] | None,
+        media_data: bytes | None,
+        schema_version: int,
+    ) -> Media:
+        data = self.codec.decode(media_format, media, media_data)
+        if schema_version == SCHEMA_VERSION:
+            return construct(Media, data)
+        return Media(**data)
+
+    def _store_media(self, db_media: MediaDB, media: Media) -> None:
+        (db_media.media_format, db_media.media, db_media.media_data) = self.codec.encode(media.model_dump())
+        db_media.schema_version = SCHEMA_VERSION
+        # The sidecar is part of the media, only keep the separate copy for the JSON columns.
+        db_media.xmp_sidecar = (
+            media.xmp_sidecar.model_dump() if media.xmp_sidecar and self.codec.writer is None else None
+        )
 
     def get_accounts(self) -> list[EnteAccount]:
         """Get all accounts from the backend."""
         with Session(self.engine) as session:
-            return [EnteAccount(**acc.model_dump(by_alias=True)) for acc in session.exec(select(EnteAccountDB)).all()]
+            return [self._load_account(session, acc) for acc in session.exec(select(EnteAccountDB)).all()]
+
+    def list_account_summaries(self) -> list[AccountSummary]:
+        """Get a summary of all accounts without loading their files."""
+        with Session(self.engine) as session:
+            rows = session.exec(
+                select(  # type: ignore[call-overload]
+                    EnteAccountDB.email,
+                    EnteAccountDB.user_id,
+                    EnteAccountDB.collection_count,
+                    EnteAccountDB.file_count,
+                    EnteAccountDB.update_time,
+                ),
+            ).all()
+
+            summaries = []
+            for email, user_id, collection_count, file_count, update_time in rows:
+                if user_id is None or collection_count is None or file_count is None or update_time is None:
+                    # Stored before summaries were kept, so compute and save it once
+                    summaries.append(self._update_summary(session, self._account_row(session, email)))
+                    continue
+                summaries.append(
+                    AccountSummary(
+                        email=email,
+                        user_id=user_id,
+                        collections=collection_count,
+                        files=file_count,
+                        update_time=update_time,
+                    ),
+                )
+            session.commit()
+        return summaries
+
+    def get_account(self, email: str, *, with_files: bool = True) -> EnteAccount | None:
+        """Get a single account by email, or None if it is not linked."""
+        with Session(self.engine) as session:
+            account = session.exec(select(EnteAccountDB).where(EnteAccountDB.email == email)).first()
+            return self._load_account(session, account, with_files=with_files) if account else None
 
     def add_account(self, account: EnteAccount) -> None:
         """Add an account to the backend."""
         with Session(self.engine) as session:
-            account_data = account.model_dump(by_alias=True)
-            db_account = EnteAccountDB(**account_data)
+            db_account = EnteAccountDB(**account.model_dump(by_alias=True, exclude={"files"}))
             session.add(db_account)
+            session.flush()
+            for collection_id, files in account.files.items():
+                self._store_files(session, db_account, collection_id, files)
+            self._update_summary(session, db_account)
             session.commit()
 
     def remove_account(self, email: str) -> None:
@@ -53,19 +292,26 @@ class SQLiteBackend(Backend):
                 select(EnteAccountDB).where(EnteAccountDB.email == email),
             ).first()
             if account:
+                session.exec(delete(RemoteFileDB).where(RemoteFileDB.account_id == account.id))  # type: ignore[arg-type]
                 session.delete(account)
                 session.commit()
 
+    def refresh_sink(self, email: str) -> RefreshSink:
+        """Get the sink saving the results of refreshing an account."""
+        return SQLiteRefreshSink(self, email)
+
     def get_local_media(self) -> list[Media]:
         """Get all local media from the backend."""
         with Session(self.engine) as session:
-            # The `media` field in MediaDB is a dict representation of a Media object.
-            return [Media(**db_media.media) for db_media in session.exec(select(MediaDB)).all()]
+            rows = session.exec(
+                select(MediaDB.media_format, MediaDB.media, MediaDB.media_data, MediaDB.schema_version),
+            ).all()
+            return [self._decode_media(*row) for row in rows]
 
     def local_refresh(self, sync_dir: str, *, force_refresh: bool = False, workers: int | None = None) -> None:
         """Refresh the local data by scanning the specified directory for media files."""
         if force_refresh:
-            self._clear_local_media()
+            self._clear_local_media(sync_dir)
 
         with Session(self.engine) as session:
             all_disk_paths = set()
@@ -80,15 +326,12 @@ class SQLiteBackend(Backend):
 
                 if existing_media_db is None:
                     # New file
-                    db_media = MediaDB(
-                        media=media.model_dump(),
-                        xmp_sidecar=media.xmp_sidecar.model_dump() if media.xmp_sidecar else None,
-                        fullpath=media.media.file.fullpath,
-                    )
+                    db_media = MediaDB(fullpath=media.media.file.fullpath)
+                    self._store_media(db_media, media)
                     session.add(db_media)
                     processed_count += 1
                 else:
-                    existing_media_obj = Media(**existing_media_db.media)
+                    existing_media_obj = self._load_media(existing_media_db)
 
                     media_modified = (
                         existing_media_obj.media.file.st_mtime_ns != media.media.file.st_mtime_ns
@@ -107,8 +350,7 @@ class SQLiteBackend(Backend):
 
                     if media_modified or sidecar_modified:
                         # Modified
-                        existing_media_db.media = media.model_dump()
-                        existing_media_db.xmp_sidecar = media.xmp_sidecar.model_dump() if media.xmp_sidecar else None
+                        self._store_media(existing_media_db, media)
                         session.add(existing_media_db)
                         processed_count += 1
 
@@ -117,8 +359,8 @@ class SQLiteBackend(Backend):
 
             session.commit()  # commit any remaining changes
 
-            # Handle deletions
-            db_paths = set(db_media_dict.keys())
+            # Handle deletions, of the files in the scanned directory only
+            db_paths = {p for p in db_media_dict if Path(p).is_relative_to(sync_dir)}
             deleted_paths = db_paths - all_disk_paths
             if deleted_paths:
                 log.info("Deleting %d files from DB", len(deleted_paths))
@@ -126,7 +368,195 @@ class SQLiteBackend(Backend):
                 session.exec(statement)  # type: ignore[arg-type]
                 session.commit()
 
-    def _clear_local_media(self) -> None:
+    def _clear_local_media(self, sync_dir: str) -> None:
+        with Session(self.engine) as session:
+            paths = [p for p in session.exec(select(MediaDB.fullpath)).all() if Path(p).is_relative_to(sync_dir)]
+            session.exec(delete(MediaDB).where(MediaDB.fullpath.in_(paths)))  # type: ignore[arg-type, attr-defined]
+            session.commit()
+
+    def get_remote_metadata(self) -> dict[int, RemoteMetadata]:
+        """Get the metadata extracted from remote files, by file ID."""
+        with Session(self.engine) as session:
+            return {
+                file_id: RemoteMetadata.model_validate(data)
+                for (file_id, data) in session.exec(select(RemoteMetadataDB.file_id, RemoteMetadataDB.metadata_)).all()
+            }
+
+    def save_remote_metadata(self, metadata: Sequence[RemoteMetadata]) -> None:
+        """Save metadata extracted from remote files, replacing that of the same files."""
+        with Session(self.engine) as session:
+            for m in metadata:
+                session.merge(RemoteMetadataDB(file_id=m.file_id, update_time=m.update_time, metadata_=m.model_dump()))
+            session.commit()
+
+    def get_audit_results(self) -> dict[int, AuditResult]:
+        """Get the latest integrity audit results of remote files, by file ID."""
+        with Session(self.engine) as session:
+            return {
+                file_id: AuditResult.model_validate(data)
+                for (file_id, data) in session.exec(select(AuditResultDB.file_id, AuditResultDB.result)).all()
+            }
+
+    def save_audit_results(self, results: Sequence[AuditResult]) -> None:
+        """Save integrity audit results, replacing those of the same files."""
         with Session(self.engine) as session:
-            session.exec(delete(MediaDB))  # type: ignore[arg-type]
+            for r in results:
+                session.merge(AuditResultDB(file_id=r.file_id, update_time=r.update_time, result=r.model_dump()))
+            session.commit()
+
+    def add_local_media(self, media: Sequence[Media]) -> None:
+        """Add media to the local media index, replacing those of the same paths."""
+        with Session(self.engine) as session:
+            for m in media:
+                path = m.media.file.fullpath
+                db_media = session.exec(select(MediaDB).where(MediaDB.fullpath == path)).first()
+                if db_media is None:
+                    db_media = MediaDB(fullpath=path)
+                self._store_media(db_media, m)
+                session.add(db_media)
+            session.commit()
+
+    def get_download_journal(self) -> dict[str, JournalEntry]:
+        """Get the journal of the transfers of missing files, by target path."""
+        with Session(self.engine) as session:
+            return {
+                target: JournalEntry.model_validate(data)
+                for (target, data) in session.exec(select(DownloadJournalDB.target, DownloadJournalDB.entry)).all()
+            }
+
+    def save_download_journal(self, entries: Sequence[JournalEntry]) -> None:
+        """Save journal entries, replacing those of the same targets."""
+        with Session(self.engine) as session:
+            for e in entries:
+                session.merge(DownloadJournalDB(target=e.target, state=e.state, entry=e.model_dump()))
+            session.commit()
+
+    def delete_download_journal(self, targets: Sequence[str]) -> None:
+        """Delete the journal entries of targets."""
+        with Session(self.engine) as session:
+            session.exec(delete(DownloadJournalDB).where(DownloadJournalDB.target.in_(targets)))  # type: ignore[arg-type, attr-defined]
+            session.commit()
+
+    def get_thumbnail_index(self) -> dict[int, ThumbnailEntry]:
+        """Get the index of the thumbnail cache, by file ID."""
+        with Session(self.engine) as session:
+            return {
+                file_id: ThumbnailEntry.model_validate(data)
+                for (file_id, data) in session.exec(select(ThumbnailDB.file_id, ThumbnailDB.entry)).all()
+            }
+
+    def save_thumbnail_index(self, entries: Sequence[ThumbnailEntry]) -> None:
+        """Save thumbnail cache entries, replacing those of the same files."""
+        with Session(self.engine) as session:
+            for e in entries:
+                session.merge(ThumbnailDB(file_id=e.file_id, digest=e.digest, entry=e.model_dump()))
+            session.commit()
+
+    def delete_thumbnail_index(self, file_ids: Sequence[int]) -> None:
+        """Delete the thumbnail cache entries of files."""
+        with Session(self.engine) as session:
+            session.exec(delete(ThumbnailDB).where(ThumbnailDB.file_id.in_(file_ids)))  # type: ignore[arg-type, attr-defined]
+            session.commit()
+
+    def compact(self) -> None:
+        """Re-encode all media and file records with the configured storage codec.
+
+        For the zstd codec, a compression dictionary is first trained from a
+        sample of the stored records and stored alongside them.
+        """
+        with Session(self.engine) as session:
+            media_rows = session.exec(select(MediaDB)).all()
+            file_rows = session.exec(select(RemoteFileDB)).all()
+
+            if isinstance(self.codec.writer, ZstdCodec):
+                samples = [
+                    self._load_media(m).model_dump()
+                    for m in random.sample(media_rows, min(len(media_rows), self.DictionarySamples))
+                ]
+                samples.extend(
+                    self.codec.decode(f.file_format, f.file, f.file_data)
+                    for f in random.sample(file_rows, min(len(file_rows), self.DictionarySamples))
+                )
+                dictionary = self.codec.writer.train(samples)
+                if dictionary:
+                    dict_id = self.codec.zstd.add_dictionary(dictionary, active=True)
+                    for d in session.exec(select(CodecDictionaryDB)).all():
+                        d.active = False
+                        session.add(d)
+                    session.merge(CodecDictionaryDB(id=dict_id, data=dictionary, active=True))
+                    log.info("Trained dictionary %d (%d bytes) from %d samples", dict_id, len(dictionary), len(samples))
+
+            for m in media_rows:
+                self._store_media(m, self._load_media(m))
+                session.add(m)
+            for f in file_rows:
+                (f.file_format, f.file, f.file_data) = self.codec.encode(
+                    self.codec.decode(f.file_format, f.file, f.file_data),
+                )
+                session.add(f)
+            session.commit()
+            log.info("Compacted %d media and %d files", len(media_rows), len(file_rows))
+
+        with self.engine.connect() as conn:
+            conn.execute(text("VACUUM"))
+
+
+class SQLiteRefreshSink(RefreshSink):
+    """Saves the results of refreshing an account to the SQLite backend.
+
+    Each call is committed in its own transaction, so a page of files and the
+    file cursor after it are saved together.
+    """
+
+    def __init__(self, backend: SQLiteBackend, email: str) -> None:
+        """Initialise the sink for the account with the given email."""
+        self.backend = backend
+        self.email = email
+
+    def save_files(self, collection_id: int, files: list[File], cursor: int) -> None:
+        """Save a page of files of a collection and the file cursor after the page."""
+        with Session(self.backend.engine) as session:
+            account = self.backend._account_row(session, self.email)  # noqa: SLF001
+            self.backend._store_files(session, account, collection_id, files)  # noqa: SLF001
+            account.file_cursors = {**(account.file_cursors or {}), str(collection_id): cursor}  # type: ignore[dict-item]
+            self.backend._update_summary(session, account)  # noqa: SLF001
+            session.commit()
+
+    def save_collection(self, collection: Collection) -> None:
+        """Save a fully synchronized collection."""
+        with Session(self.backend.engine) as session:
+            account = self.backend._account_row(session, self.email)  # noqa: SLF001
+            account.collections = [
+                *(c for c in account.collections if c["id"] != collection.id),  # type: ignore[index]
+                collection.model_dump(by_alias=True),  # type: ignore[list-item]
+            ]
+            self.backend._update_summary(session, account)  # noqa: SLF001
+            session.commit()
+
+    def save_collections_cursor(self, cursor: int) -> None:
+        """Save the cursor for fetching collections once all collections are saved."""
+        with Session(self.backend.engine) as session:
+            account = self.backend._account_row(session, self.email)  # noqa: SLF001
+            account.collections_cursor = cursor
+            session.add(account)
+            session.commit()
+
+    def retain(self, files: Mapping[int, AbstractSet[int]]) -> None:
+        """Remove the collections, files and file cursors of the account that a full refresh did not fetch."""
+        with Session(self.backend.engine) as session:
+            account = self.backend._account_row(session, self.email)  # noqa: SLF001
+            rows = session.exec(
+                select(RemoteFileDB.id, RemoteFileDB.collection_id, RemoteFileDB.file_id).where(
+                    RemoteFileDB.account_id == account.id,
+                ),
+            ).all()
+            stale = [row_id for (row_id, collection_id, file_id) in rows if file_id not in files.get(collection_id, ())]
+            # Keep within the limit of SQLite variables per statement
+            for i in range(0, len(stale), self.backend.InsertBatch):
+                session.exec(
+                    delete(RemoteFileDB).where(col(RemoteFileDB.id).in_(stale[i : i + self.backend.InsertBatch])),
+                )  # type: ignore[arg-type]
+            account.collections = [c for c in account.collections if c["id"] in files]  # type: ignore[index]
+            account.file_cursors = {k: v for k, v in (account.file_cursors or {}).items() if int(k) in files}
+            self.backend._update_summary(session, account)  # noqa: SLF001
             session.commit()
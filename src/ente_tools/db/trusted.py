@@ -0,0 +1,219 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Construct pydantic models from trusted data without validation.
+
+Rows written by the backend with the current schema version were produced by
+`model_dump()` of the very same models, so validating them again on load is
+wasted work. `construct` builds the models (including nested models, lists,
+dictionaries and discriminated unions) directly from such data.
+
+Only the annotations used by the stored models are supported; building a plan
+for a model with any other annotation raises `TypeError`, and callers should
+then validate instead.
+"""
+
+from collections.abc import Callable, Mapping, Sequence
+from functools import cache
+from types import NoneType, UnionType
+from typing import TYPE_CHECKING, Annotated, Any, Literal, TypeAliasType, Union, get_args, get_origin
+
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from pydantic.fields import FieldInfo
+
+type Converter = Callable[[Any], Any]
+
+_setattr = object.__setattr__
+
+_PLAIN_TYPES = (str, int, float, bool)
+
+
+class TrustedLoadError(Exception):
+    """Raised when trusted data does not have the shape of the model."""
+
+
+def _is_plain(tp: Any) -> bool:  # noqa: ANN401
+    """Check whether values of the type are stored as-is."""
+    if tp is Any or tp in _PLAIN_TYPES:
+        return True
+    origin = get_origin(tp)
+    if origin is Literal:
+        return True
+    if isinstance(tp, TypeAliasType):
+        return _is_plain(tp.__value__)
+    if origin in (dict, Mapping):
+        # JSON turns other keys into strings, so they need converting back
+        (key, value) = get_args(tp)
+        return key in (str, Any) and _is_plain(value)
+    if origin in (Union, UnionType, list, Sequence):
+        return all(a is NoneType or _is_plain(a) for a in get_args(tp))
+    return False
+
+
+def _union_converter(args: tuple[Any, ...], discriminator: str | None) -> Converter | None:
+    members = [a for a in args if a is not NoneType]
+    optional = len(members) < len(args)
+
+    if discriminator:
+        by_tag: dict[Any, Converter] = {}
+        for m in members:
+            if not (isinstance(m, type) and issubclass(m, BaseModel)):
+                msg = f"unsupported discriminated member {m}"
+                raise TypeError(msg)
+            by_tag[m.model_fields[discriminator].default] = _model_converter(m)
+
+        def convert_tagged(v: Any) -> Any:  # noqa: ANN401
+            return by_tag[v[discriminator]](v)
+
+        convert: Converter | None = convert_tagged
+    elif len(members) == 1:
+        convert = _converter(members[0])
+    elif all(_is_plain(m) for m in members):
+        convert = None
+    else:
+        msg = f"unsupported union {args}"
+        raise TypeError(msg)
+
+    if convert is None or not optional:
+        return convert
+
+    inner = convert
+
+    def convert_optional(v: Any) -> Any:  # noqa: ANN401
+        return None if v is None else inner(v)
+
+    return convert_optional
+
+
+def _model_converter(cls: type[BaseModel]) -> Converter:
+    def convert_model(v: Any) -> Any:  # noqa: ANN401
+        return construct(cls, v)
+
+    _plan(cls)  # fail early for unsupported models
+    return convert_model
+
+
+def _discriminator(field: "FieldInfo") -> str | None:
+    """Return the field name discriminating a union, rejecting callable discriminators."""
+    if field.discriminator is None or isinstance(field.discriminator, str):
+        return field.discriminator
+    msg = f"unsupported discriminator {field.discriminator}"
+    raise TypeError(msg)
+
+
+def _converter(tp: Any, discriminator: str | None = None) -> Converter | None:  # noqa: ANN401, C901, PLR0911
+    """Build the function converting stored data to the type, or None if stored as-is."""
+    if isinstance(tp, TypeAliasType):
+        return _converter(tp.__value__, discriminator)
+
+    origin = get_origin(tp)
+    args = get_args(tp)
+
+    if origin is Annotated:
+        return _converter(args[0], discriminator)
+    if isinstance(tp, type) and issubclass(tp, BaseModel):
+        return _model_converter(tp)
+    if _is_plain(tp):
+        return None
+    if origin in (Union, UnionType):
+        return _union_converter(args, discriminator)
+    if origin in (list, Sequence):
+        item = _converter(args[0])
+        if item is None:
+            return None
+
+        def convert_list(v: Any) -> Any:  # noqa: ANN401
+            return [item(x) for x in v]
+
+        return convert_list
+    if origin in (dict, Mapping):
+        # JSON turns integer keys into strings
+        key = int if args[0] is int else None
+        value = _converter(args[1])
+        if key is None and value is None:
+            return None
+
+        def convert_dict(v: Any) -> Any:  # noqa: ANN401
+            return {(key(k) if key else k): (value(x) if value else x) for k, x in v.items()}
+
+        return convert_dict
+
+    msg = f"unsupported annotation {tp}"
+    raise TypeError(msg)
+
+
+_MISSING = object()
+
+
+class _Plan:
+    """How to construct a model: the key, converter and default of each field."""
+
+    def __init__(self, cls: type[BaseModel]) -> None:
+        self.fields: list[tuple[str, str | None, Converter | None, FieldInfo | None]] = [
+            (
+                name,
+                field.alias,
+                _converter(field.annotation, _discriminator(field)),
+                None if field.is_required() else field,
+            )
+            for name, field in cls.model_fields.items()
+        ]
+        self.private = {k: p.get_default() for k, p in cls.__private_attributes__.items()} or None
+        self.post_init = bool(cls.__pydantic_post_init__)
+
+
+@cache
+def _plan(cls: type[BaseModel]) -> _Plan:
+    return _Plan(cls)
+
+
+def construct[M: BaseModel](cls: type[M], data: Mapping[str, Any]) -> M:
+    """Construct a model from trusted data without validation.
+
+    Args:
+        cls: The model class.
+        data: The output of `model_dump()` of the model, by name or by alias.
+
+    Returns:
+        The constructed model.
+
+    Raises:
+        TypeError: If the model uses annotations that are not supported.
+        TrustedLoadError: If a required field is missing from the data.
+
+    """
+    plan = _plan(cls)
+    values: dict[str, Any] = {}
+    for name, alias, convert, default in plan.fields:
+        v = data.get(alias, _MISSING) if alias is not None else _MISSING
+        if v is _MISSING:
+            v = data.get(name, _MISSING)
+        if v is _MISSING:
+            if default is None:
+                msg = f"missing field {name} for {cls.__name__}"
+                raise TrustedLoadError(msg)
+            v = default.get_default(call_default_factory=True, validated_data=values)
+        elif convert is not None and v is not None:
+            v = convert(v)
+        values[name] = v
+
+    m = cls.__new__(cls)
+    _setattr(m, "__dict__", values)
+    _setattr(m, "__pydantic_fields_set__", set(values))
+    _setattr(m, "__pydantic_extra__", None)
+    _setattr(m, "__pydantic_private__", dict(plan.private) if plan.private else None)
+    if plan.post_init:
+        m.model_post_init(None)
+    return m
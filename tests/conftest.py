@@ -0,0 +1,35 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fixtures shared by the tests."""
+
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from ente_tools.db.base import Backend
+from ente_tools.db.in_memory import InMemoryBackend
+from ente_tools.db.sqlite import SQLiteBackend
+
+BACKENDS: dict[str, Callable[[Path], Backend]] = {
+    "in-memory": lambda _: InMemoryBackend(),
+    "sqlite": lambda tmp_path: SQLiteBackend(db_path=str(tmp_path / "test.db")),
+    "sqlite-zstd": lambda tmp_path: SQLiteBackend(db_path=str(tmp_path / "test.db"), codec="zstd"),
+}
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request: pytest.FixtureRequest, tmp_path: Path) -> Backend:
+    """Create each of the backends."""
+    return BACKENDS[request.param](tmp_path)
@@ -0,0 +1,282 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process stand-ins for the Ente API and its storage, for tests that do not need the test server."""
+
+import json
+import re
+from base64 import urlsafe_b64encode
+from http import HTTPStatus
+from itertools import count
+from typing import Any
+
+import httpx
+import keyring
+from nacl.public import PrivateKey
+from nacl.secret import SecretBox
+from nacl.utils import random
+
+from ente_tools.api.core.account import EnteAccount
+from ente_tools.api.core.api import EnteAPI, EnteAPIError
+from ente_tools.api.core.device import get_device_key
+from ente_tools.api.core.ente_crypt import StreamEncryptionSize, encrypt_blob, encrypt_stream
+from ente_tools.api.core.types_collection import EncryptedCollection
+from ente_tools.api.core.types_crypt import (
+    AuthorizationResponse,
+    EnteEncKeys,
+    EnteKeys,
+    KeyAttributes,
+    SPRAttributes,
+)
+from ente_tools.api.core.types_file import EncryptedFile, File, FileAttributes, FileInfo
+from ente_tools.api.photo.planner import RemoteRef
+
+from .ente_test_server.ente_server import TestKeyring
+
+
+def b64(data: bytes) -> str:
+    """Encode bytes as the API does."""
+    return str(urlsafe_b64encode(data), "utf-8")
+
+
+def secretbox(key: bytes, msg: bytes) -> tuple[str, str]:
+    """Encrypt with a secret box, returning the encrypted message and nonce."""
+    nonce = random(SecretBox.NONCE_SIZE)
+    return (b64(SecretBox(key).encrypt(msg, nonce).ciphertext), b64(nonce))
+
+
+class FakeEnte:
+    """Holds the encrypted collections and files of one user and serves them like EnteAPI.
+
+    Pages of the file diffs hold `page_size` files. Setting `fail_after` makes
+    `get_files` raise an EnteAPIError after that many calls.
+    """
+
+    def __init__(self, user_id: int = 1, page_size: int = 2) -> None:
+        """Initialise the server with a new user and no collections."""
+        keyring.set_keyring(TestKeyring())
+
+        private_key = PrivateKey.generate()
+        self.keys = EnteKeys(
+            user_id=user_id,
+            master_key=random(SecretBox.KEY_SIZE),
+            secret_key=bytes(private_key),
+            token=random(32),
+            public_key=bytes(private_key.public_key),
+        )
+        self.page_size = page_size
+        self.fail_after: int | None = None
+        self.calls: list[tuple[int, int]] = []
+        """The collection ID and since time of each call of `get_files`."""
+        self.collections: dict[int, EncryptedCollection] = {}
+        self.collection_keys: dict[int, bytes] = {}
+        self.files: dict[int, dict[int, EncryptedFile]] = {}
+        self.file_keys: dict[int, bytes] = {}
+        self.titles: dict[int, str] = {}
+        self._ids = count(1)
+        self._time = count(1_700_000_000_000_000, 1000)
+
+    def account(self, email: str = "test@example.com") -> EnteAccount:
+        """Create the linked account of the user."""
+        return EnteAccount(
+            email=email,
+            attributes=SPRAttributes(
+                srpUserID="user",
+                srpSalt="salt",
+                memLimit=1,
+                opsLimit=1,
+                kekSalt="salt",
+                isEmailMFAEnabled=False,
+            ),
+            auth_response=AuthorizationResponse(
+                id=self.keys.user_id,
+                keyAttributes=KeyAttributes(
+                    kekSalt="salt",
+                    encryptedKey="key",
+                    keyDecryptionNonce="nonce",
+                    publicKey=b64(self.keys.public_key),
+                    encryptedSecretKey="key",
+                    secretKeyDecryptionNonce="nonce",
+                    memLimit=1,
+                    opsLimit=1,
+                ),
+                encryptedToken="token",
+            ),
+            encrypted_keys=EnteEncKeys.from_keys(get_device_key(), self.keys),
+            collections=[],
+            files={},
+        )
+
+    def add_collection(self, name: str) -> int:
+        """Add a collection owned by the user."""
+        collection_id = next(self._ids)
+        key = random(SecretBox.KEY_SIZE)
+        (encrypted_key, nonce) = secretbox(self.keys.master_key, key)
+        self.collection_keys[collection_id] = key
+        self.collections[collection_id] = EncryptedCollection.model_validate(
+            {
+                "id": collection_id,
+                "owner": {"id": self.keys.user_id, "email": "test@example.com", "role": "OWNER"},
+                "encryptedKey": encrypted_key,
+                "keyDecryptionNonce": nonce,
+                "name": name,
+                "type": "album",
+                "sharees": [],
+                "updationTime": next(self._time),
+            },
+        )
+        self.files[collection_id] = {}
+        return collection_id
+
+    def add_file(self, collection_id: int, title: str, file_hash: str = "", file_id: int | None = None) -> int:
+        """Add a new file, or update an existing file, in a collection."""
+        file_id = file_id or next(self._ids)
+        key = self.file_keys.setdefault(file_id, random(SecretBox.KEY_SIZE))
+        self.titles[file_id] = title
+        (encrypted_key, nonce) = secretbox(self.collection_keys[collection_id], key)
+        (metadata, header) = encrypt_blob(json.dumps({"title": title, "hash": file_hash}).encode(), key)
+        update_time = next(self._time)
+        self.files[collection_id][file_id] = EncryptedFile.model_validate(
+            {
+                "id": file_id,
+                "ownerID": self.keys.user_id,
+                "collectionID": collection_id,
+                "collectionOwnerID": self.keys.user_id,
+                "encryptedKey": encrypted_key,
+                "keyDecryptionNonce": nonce,
+                "file": {"decryptionHeader": b64(random(24))},
+                "thumbnail": {"decryptionHeader": b64(random(24))},
+                "metadata": {"encryptedData": b64(metadata), "decryptionHeader": b64(header)},
+                "isDeleted": False,
+                "updationTime": update_time,
+                "info": {"fileSize": 100, "thumbSize": 10},
+            },
+        )
+        self.collections[collection_id].update_time = update_time
+        return file_id
+
+    def touch_collection(self, collection_id: int) -> None:
+        """Update a collection without changing its files, as renaming or sharing does."""
+        self.collections[collection_id].update_time = next(self._time)
+
+    def set_token(self, token: bytes | None = None) -> None:
+        """Accept the token of the user."""
+        assert token == self.keys.token
+
+    def get_collections(self, since: int = 0) -> list[EncryptedCollection]:
+        """Return the collections updated after the given time."""
+        return [c.model_copy() for c in self.collections.values() if c.update_time > since]
+
+    def get_files(self, collection_id: int, since: int) -> tuple[list[EncryptedFile], bool]:
+        """Return a page of the files of a collection updated after the given time."""
+        if self.fail_after is not None and len(self.calls) >= self.fail_after:
+            msg = "injected failure"
+            raise EnteAPIError(msg)
+        self.calls.append((collection_id, since))
+        files = sorted(
+            (f for f in self.files[collection_id].values() if f.update_time > since),
+            key=lambda f: f.update_time,
+        )
+        return (files[: self.page_size], len(files) > self.page_size)
+
+
+def encrypt(plaintext: bytes, key: bytes, chunk_size: int = StreamEncryptionSize) -> tuple[bytes, bytes]:
+    """Encrypt in chunks, returning the header and the encrypted file."""
+    chunks = [plaintext[i : i + chunk_size] for i in range(0, len(plaintext), chunk_size)]
+    (header, encrypted) = encrypt_stream(key, iter(chunks))
+    return (header, b"".join(encrypted))
+
+
+class RangeServer:
+    """Serves byte ranges of an encrypted file and records the requested ranges."""
+
+    def __init__(self, data: bytes) -> None:
+        """Serve the data."""
+        self.data = data
+        self.ranges: list[tuple[int, int]] = []
+
+    def fetch(self, start: int, end: int) -> tuple[bytes, int]:
+        """Return a range of the data and its size."""
+        self.ranges.append((start, end))
+        return (self.data[start:end], len(self.data))
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        """Handle a download request, with or without a Range header."""
+        if "Range" not in request.headers:
+            return httpx.Response(HTTPStatus.OK, content=self.data)
+        m = re.fullmatch(r"bytes=(\d+)-(\d+)", request.headers["Range"])
+        assert m
+        (start, end) = (int(m[1]), int(m[2]) + 1)
+        data = self.fetch(start, end)[0]
+        return httpx.Response(
+            HTTPStatus.PARTIAL_CONTENT,
+            content=data,
+            headers={"Content-Range": f"bytes {start}-{start + len(data) - 1}/{len(self.data)}"},
+        )
+
+
+def make_api(server: RangeServer) -> EnteAPI:
+    """Return an API client downloading from the server."""
+    transport = httpx.MockTransport(server.handle)
+    return EnteAPI(
+        pkg="test",
+        api_url="https://api.test",
+        api_account_url="https://accounts.test",
+        api_download_url="https://files.test/?fileID=",
+        transport=transport,
+        async_transport=transport,
+    )
+
+
+def make_file(header: bytes, **kwargs: Any) -> File:  # noqa: ANN401
+    """Return a file with the decryption header."""
+    return File(
+        id=1,
+        owner_id=1,
+        collection_id=1,
+        collection_owner_id=1,
+        file=FileAttributes(decryptionHeader=str(urlsafe_b64encode(header), "utf-8")),
+        thumbnail=FileAttributes(decryptionHeader=""),
+        is_deleted=False,
+        update_time=1,
+        **kwargs,
+    )
+
+
+def make_remote(  # noqa: PLR0913
+    file_id: int,
+    file_hash: str | None,
+    *,
+    title: str | None = None,
+    email: str = "a@b.c",
+    owner_id: int = 1,
+    size: int | None = None,
+) -> RemoteRef:
+    """Return a reference to a remote file with a hash in its metadata."""
+    metadata = {"title": title or f"{file_id}.mp4"} | ({"hash": file_hash} if file_hash else {})
+    return RemoteRef(
+        email=email,
+        user_id=1,
+        file=File(
+            id=file_id,
+            owner_id=owner_id,
+            collection_id=1,
+            collection_owner_id=1,
+            file=FileAttributes(decryptionHeader=""),
+            thumbnail=FileAttributes(decryptionHeader=""),
+            is_deleted=False,
+            update_time=1,
+            info=FileInfo(fileSize=size, thumbSize=0) if size is not None else None,
+            plain_metadata={"metadata": metadata},
+        ),
+    )
@@ -0,0 +1,77 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the integrity audit of remote files."""
+
+import hashlib
+import os
+from base64 import b64encode, urlsafe_b64encode
+from pathlib import Path
+
+from nacl.utils import random
+
+from ente_tools.api.core.ente_crypt import StreamEncryptionSize
+from ente_tools.api.photo.audit import AuditReport, AuditResult, AuditStatus, audit_file
+from ente_tools.db.in_memory import InMemoryBackend
+from ente_tools.db.sqlite import SQLiteBackend
+
+from .ente_fake import RangeServer, encrypt, make_api, make_file
+
+
+def test_audit_file() -> None:
+    """Files are classified by whether they decrypt and match their hash."""
+    key = random(32)
+    plaintext = os.urandom(StreamEncryptionSize + 10)
+    (header, data) = encrypt(plaintext, key, StreamEncryptionSize)
+    digest = hashlib.blake2b(plaintext).digest()
+    api = make_api(RangeServer(data))
+
+    def audit(file_hash: str | None) -> AuditResult:
+        metadata = {"hash": file_hash} if file_hash else {}
+        return audit_file(api, make_file(header, plain_metadata={"metadata": metadata}), key)
+
+    # Hashes match in either base64 alphabet
+    assert audit(str(b64encode(digest), "utf-8")).status == "ok"
+    assert audit(str(urlsafe_b64encode(digest), "utf-8")).status == "ok"
+    assert audit(str(b64encode(bytes(64)), "utf-8")).status == "mismatch"
+    assert audit("a:b").status == "unverified"
+    assert audit(None).status == "unverified"
+    assert audit(None).size == len(plaintext)
+
+    # Flipped bits fail decryption
+    corrupted = bytearray(data)
+    corrupted[100] ^= 1
+    api = make_api(RangeServer(bytes(corrupted)))
+    assert audit(None).status == "corrupt"
+
+
+def test_audit_report() -> None:
+    """Reports count results and list the failed files."""
+    report = AuditReport(seconds=2)
+    statuses: list[AuditStatus] = ["ok", "ok", "mismatch", "unverified", "corrupt"]
+    for file_id, status in enumerate(statuses):
+        report.add(AuditResult(file_id=file_id, update_time=1, status=status, size=100))
+    assert report.counts == {"ok": 2, "mismatch": 1, "unverified": 1, "corrupt": 1}
+    assert report.failed == {2: "mismatch", 4: "corrupt"}
+    assert report.throughput == 250  # noqa: PLR2004
+
+
+def test_backend_audit_results(tmp_path: Path) -> None:
+    """Audit results are stored and replaced by file ID."""
+    for backend in (InMemoryBackend(), SQLiteBackend(db_path=str(tmp_path / "ente.db"))):
+        backend.save_audit_results([AuditResult(file_id=1, update_time=1, status="error", detail="timeout")])
+        backend.save_audit_results([AuditResult(file_id=1, update_time=1, status="ok", size=10)])
+        stored = backend.get_audit_results()
+        assert list(stored) == [1]
+        assert stored[1].status == "ok"
+        assert stored[1].detail is None
@@ -19,6 +19,7 @@ import unittest
 from pathlib import Path
 
 from PIL import Image
+from sqlalchemy import text
 
 from ente_tools.api.core.account import EnteAccount
 from ente_tools.api.core.types_crypt import (
@@ -31,6 +32,44 @@ from ente_tools.api.core.types_crypt import (
 from ente_tools.db.sqlite import SQLiteBackend
 
 
+def make_account(email: str, user_id: int = 1) -> EnteAccount:
+    """Create an account with dummy keys and no collections."""
+    return EnteAccount(
+        email=email,
+        attributes=SPRAttributes(
+            srpUserID="test_user",
+            srpSalt="salt",
+            memLimit=1,
+            opsLimit=1,
+            kekSalt="salt",
+            isEmailMFAEnabled=False,
+        ),
+        auth_response=AuthorizationResponse(
+            id=user_id,
+            keyAttributes=KeyAttributes(
+                kekSalt="salt",
+                encryptedKey="key",
+                keyDecryptionNonce="nonce",
+                publicKey="key",
+                encryptedSecretKey="key",
+                secretKeyDecryptionNonce="nonce",
+                memLimit=1,
+                opsLimit=1,
+            ),
+            encryptedToken="token",
+        ),
+        encrypted_keys=EnteEncKeys(
+            user_id=user_id,
+            master_key=SecretPair(encrypted="key", nonce="nonce"),
+            secret_key=SecretPair(encrypted="key", nonce="nonce"),
+            token=SecretPair(encrypted="key", nonce="nonce"),
+            public_key="key",
+        ),
+        collections=[],
+        files={},
+    )
+
+
 class TestSQLiteBackend(unittest.TestCase):
     """Tests for the SQLiteBackend."""
 
@@ -91,6 +130,28 @@ class TestSQLiteBackend(unittest.TestCase):
         assert len(accounts) == 1
         assert accounts[0].email == "test@example.com"
 
+    def test_account_summaries(self) -> None:
+        """Test account summaries and loading a single account."""
+        self.backend.add_account(make_account("a@example.com", user_id=1))
+        self.backend.add_account(make_account("b@example.com", user_id=2))
+
+        summaries = {s.email: s for s in self.backend.list_account_summaries()}
+        assert set(summaries) == {"a@example.com", "b@example.com"}
+        assert summaries["b@example.com"].user_id == 2  # noqa: PLR2004
+        assert summaries["b@example.com"].files == 0
+
+        # Summaries of accounts stored before they were kept are saved once computed
+        with self.backend.engine.begin() as conn:
+            conn.execute(text("UPDATE enteaccountdb SET user_id = NULL, file_count = NULL"))
+        assert {s.email: s for s in self.backend.list_account_summaries()} == summaries
+        with self.backend.engine.begin() as conn:
+            assert conn.execute(text("SELECT COUNT(*) FROM enteaccountdb WHERE user_id IS NULL")).scalar() == 0
+
+        account = self.backend.get_account("b@example.com")
+        assert account is not None
+        assert account.email == "b@example.com"
+        assert self.backend.get_account("c@example.com") is None
+
     def test_local_refresh(self) -> None:
         """Test the local_refresh method."""
         # Create some dummy image files
@@ -128,6 +189,23 @@ class TestSQLiteBackend(unittest.TestCase):
         assert str(img3_path) in paths
         assert str(img1_path) not in paths
 
+    def test_local_refresh_keeps_other_dirs(self) -> None:
+        """Refreshing one directory keeps the media indexed under another."""
+        dir_a = Path(self.tmpdir.name) / "a"
+        dir_b = Path(self.tmpdir.name) / "b"
+        dir_a.mkdir()
+        dir_b.mkdir()
+        Image.new("RGB", (100, 100), color="red").save(dir_a / "img.jpg")
+        Image.new("RGB", (100, 100), color="blue").save(dir_b / "img.jpg")
+
+        self.backend.local_refresh(sync_dir=str(dir_a))
+        self.backend.local_refresh(sync_dir=str(dir_b))
+        (dir_b / "img.jpg").unlink()
+        self.backend.local_refresh(sync_dir=str(dir_b))
+
+        paths = {m.media.file.fullpath for m in self.backend.get_local_media()}
+        assert paths == {str(dir_a / "img.jpg")}
+
     def test_local_refresh_with_sidecar(self) -> None:
         """Test the local_refresh method with sidecar files."""
         img_path = Path(self.tmpdir.name) / "img.jpg"
@@ -0,0 +1,92 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for limiting the bandwidth of downloads."""
+
+import os
+
+import pytest
+import typer
+from nacl.utils import random
+
+from ente_tools.api.core.api import rechunk
+from ente_tools.api.core.bandwidth import TokenBucket
+from ente_tools.api.core.ente_crypt import StreamEncryptionSize
+from ente_tools.cli import parse_size
+
+from .ente_fake import RangeServer, encrypt, make_api, make_file
+
+
+def test_token_bucket() -> None:
+    """Consuming beyond the burst waits for the bucket to refill."""
+    now = 0.0
+    waits: list[float] = []
+    bucket = TokenBucket(100, burst=50, clock=lambda: now, sleep=waits.append)
+    bucket.consume(50)
+    assert waits == []
+    bucket.consume(100)
+    assert waits == [1.0]
+    # Debt is paid back over time
+    now = 1.0
+    bucket.consume(50)
+    assert waits == [1.0, 0.5]
+
+
+def test_set_rate() -> None:
+    """Changing the rate applies to the time after the change."""
+    now = 0.0
+    waits: list[float] = []
+    bucket = TokenBucket(100, clock=lambda: now, sleep=waits.append)
+    bucket.consume(300)
+    assert waits == [2.0]
+    now = 2.0
+    bucket.set_rate(1000, burst=500)
+    bucket.consume(1000)
+    assert waits == [2.0, 1.0]
+
+
+def test_rechunk() -> None:
+    """Reads of any size are regrouped into chunks, after the bytes skipped."""
+    data = os.urandom(100)
+    reads = iter([data[:7], data[7:8], data[8:60], data[60:]])
+    assert list(rechunk(reads, 30, skip=5)) == [data[5:35], data[35:65], data[65:95], data[95:]]
+
+
+def test_download_throttled() -> None:
+    """Every byte downloaded is drawn from the shared bucket, which can change or be removed."""
+    key = random(32)
+    plaintext = os.urandom(StreamEncryptionSize + 1000)
+    (header, data) = encrypt(plaintext, key, StreamEncryptionSize)
+    api = make_api(RangeServer(data))
+    consumed: list[int] = []
+    api.set_bandwidth_limit(1_000_000)
+    assert api.bandwidth is not None
+    api.bandwidth.consume = consumed.append  # type: ignore[method-assign]
+
+    assert b"".join(api.iter_file(make_file(header), key)) == plaintext
+    assert sum(consumed) == len(data)
+
+    api.set_bandwidth_limit(2_000_000, 100)
+    assert (api.bandwidth.rate, api.bandwidth.burst) == (2_000_000, 100)
+    api.set_bandwidth_limit(None)
+    assert api.bandwidth is None
+
+
+def test_parse_size() -> None:
+    """Sizes are given with decimal or binary units."""
+    assert parse_size("500") == 500  # noqa: PLR2004
+    assert parse_size("2MB") == 2_000_000  # noqa: PLR2004
+    assert parse_size("1.5k") == 1500  # noqa: PLR2004
+    assert parse_size("1MiB") == 1024**2
+    with pytest.raises(typer.BadParameter, match="invalid size"):
+        parse_size("fast")
@@ -0,0 +1,139 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the cache of encrypted files."""
+
+import io
+import os
+from collections.abc import Generator
+from http import HTTPStatus
+from pathlib import Path
+
+import httpx
+import pytest
+from nacl.utils import random
+
+from ente_tools.api.core.api import EnteAPI
+from ente_tools.api.core.blob_cache import BlobCache
+from ente_tools.api.core.ente_crypt import EnteCryptError, StreamEncryptionSize
+from ente_tools.api.core.types_file import FileInfo
+
+from .ente_fake import encrypt, make_file
+
+
+class CountingServer:
+    """Serves an encrypted file and counts the downloads."""
+
+    def __init__(self, data: bytes) -> None:
+        """Serve the data."""
+        self.data = data
+        self.downloads = 0
+
+    def handle(self, request: httpx.Request) -> httpx.Response:  # noqa: ARG002
+        """Handle a download request."""
+        self.downloads += 1
+        return httpx.Response(HTTPStatus.OK, content=self.data)
+
+
+def make_host(server: CountingServer, cache_dir: Path, max_size: int = BlobCache.MaxSize) -> EnteAPI:
+    """Return the API client of a host, downloading from the server through a cache directory."""
+    transport = httpx.MockTransport(server.handle)
+    return EnteAPI(
+        pkg="test",
+        api_url="https://api.test",
+        api_account_url="https://accounts.test",
+        api_download_url="https://files.test/?fileID=",
+        transport=transport,
+        blob_cache=BlobCache(cache_dir, max_size=max_size),
+    )
+
+
+def test_blob_cache_shared(tmp_path: Path) -> None:
+    """Hosts sharing a cache directory download a file from the server once."""
+    key = random(32)
+    plaintext = os.urandom(2 * StreamEncryptionSize + 100)
+    (header, data) = encrypt(plaintext, key, StreamEncryptionSize)
+    file = make_file(header, info=FileInfo(fileSize=len(data), thumbSize=0))
+    server = CountingServer(data)
+    cache_dir = tmp_path / "blobs"
+    hosts = [make_host(server, cache_dir) for _ in range(2)]
+
+    for i, host in enumerate(hosts):
+        host.download_file(file, key, tmp_path / f"host{i}.bin")
+        assert (tmp_path / f"host{i}.bin").read_bytes() == plaintext
+    assert server.downloads == 1
+    assert hosts[1].blob_cache is not None
+    assert hosts[1].blob_cache.stats.hits == 1
+
+    # The blob is the ciphertext as received, and nothing else is left in the directory
+    assert [p.read_bytes() for p in cache_dir.rglob("*") if p.is_file()] == [data]
+
+    # An updated file is downloaded again
+    hosts[0].download_file(file.model_copy(update={"update_time": 2}), key, tmp_path / "updated.bin")
+    assert server.downloads == 2  # noqa: PLR2004
+
+
+def test_blob_cache_incomplete(tmp_path: Path) -> None:
+    """Downloads that are not read to the end, or do not decrypt, are not cached."""
+    key = random(32)
+    plaintext = os.urandom(2 * StreamEncryptionSize + 100)
+    (header, data) = encrypt(plaintext, key, StreamEncryptionSize)
+    file = make_file(header)
+    server = CountingServer(data)
+    host = make_host(server, tmp_path)
+    assert host.blob_cache is not None
+
+    chunks = host.iter_file(file, key)
+    # Closing the generator stops the download before its end
+    assert isinstance(chunks, Generator)
+    next(chunks)
+    chunks.close()
+    assert [p for p in tmp_path.rglob("*") if p.is_file()] == []
+
+    # A corrupted blob is removed once it fails to decrypt, and downloaded again
+    host.write_file(file, key, io.BytesIO())
+    blob = host.blob_cache.path(file.id, file.update_time)
+    blob.write_bytes(data[:-1] + bytes([data[-1] ^ 1]))
+    with pytest.raises(EnteCryptError):
+        host.write_file(file, key, io.BytesIO())
+    assert not blob.exists()
+    downloads = server.downloads
+    host.write_file(file, key, io.BytesIO())
+    assert server.downloads == downloads + 1
+
+
+def test_blob_cache_evicts(tmp_path: Path) -> None:
+    """The least recently used blobs are evicted over the cap, and stale temporary files removed."""
+    cache = BlobCache(tmp_path, max_size=250)
+
+    def put(file_id: int) -> Path:
+        list(cache.fetch(file_id, 1, lambda: iter([bytes(100)])))
+        return cache.path(file_id, 1)
+
+    (first, second) = (put(1), put(2))
+    os.utime(first, (1000, 1000))
+    os.utime(second, (2000, 2000))
+    stale = first.parent / ".3-1.blob.host.abc.part"
+    stale.write_bytes(b"partial")
+    os.utime(stale, (1000, 1000))
+
+    # Reading the first blob makes the second the least recently used
+    assert b"".join(cache.fetch(1, 1, lambda: iter([]))) == bytes(100)
+    third = put(3)
+    assert first.exists()
+    assert not second.exists()
+    assert third.exists()
+    assert cache.stats.evicted == 1
+
+    cache.trim()
+    assert not stale.exists()
@@ -0,0 +1,103 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the adaptive concurrency of requests."""
+
+import threading
+import time
+from http import HTTPStatus
+
+import httpx
+
+from ente_tools.api.core.api import EnteAPI
+from ente_tools.api.core.concurrency import ConcurrencyController
+from ente_tools.api.core.retry import Retrier
+
+
+def test_additive_increase() -> None:
+    """Steady latencies raise the limit by about one per round, up to the maximum."""
+    controller = ConcurrencyController("test", initial=2, max_limit=4)
+    for _ in range(2):
+        controller.record(0.1)
+    assert controller.limit == 2  # noqa: PLR2004
+    controller.record(0.1)
+    assert controller.limit == 3  # noqa: PLR2004
+    for _ in range(20):
+        controller.record(0.1)
+    assert controller.limit == 4  # noqa: PLR2004
+
+
+def test_multiplicative_decrease() -> None:
+    """Throttling and rising latency cut the limit, once per average latency."""
+    now = 0.0
+    controller = ConcurrencyController("test", initial=16, clock=lambda: now)
+    controller.record(1.0)
+    controller.throttled()
+    controller.throttled()
+    assert controller.limit == 8  # noqa: PLR2004
+    now = 2.0
+    controller.throttled()
+    assert controller.limit == 4  # noqa: PLR2004
+
+    # Latency growing well over the lowest seen counts as congestion
+    now = 10.0
+    for latency in (5.0, 5.0, 5.0):
+        controller.record(latency)
+    assert controller.limit == 2  # noqa: PLR2004
+    stats = controller.stats()
+    assert (stats.throttled, stats.decreases) == (3, 3)
+
+
+def test_slot_limits_in_flight() -> None:
+    """No more operations than the limit run at once."""
+    controller = ConcurrencyController("test", initial=2, max_limit=2)
+    lock = threading.Lock()
+    running = peak = 0
+
+    def work() -> None:
+        nonlocal running, peak
+        with controller.slot():
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.01)
+            with lock:
+                running -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak == 2  # noqa: PLR2004
+
+
+def test_throttled_pages_cut_limit() -> None:
+    """Throttling responses for pages of files are reported to the API's controller."""
+    responses = [
+        httpx.Response(HTTPStatus.TOO_MANY_REQUESTS),
+        httpx.Response(HTTPStatus.OK, json={"diff": [], "hasMore": False}),
+    ]
+    controller = ConcurrencyController("pages", initial=8)
+    api = EnteAPI(
+        pkg="test",
+        api_url="https://api.test",
+        api_account_url="https://accounts.test",
+        api_download_url="https://files.test/?fileID=",
+        transport=httpx.MockTransport(lambda _: responses.pop(0)),
+        retry=Retrier(rng=lambda: 0, sleep=lambda _: None),
+        api_concurrency=controller,
+    )
+    assert api.get_files(collection_id=1, since=0) == ([], False)
+    stats = controller.stats()
+    assert (stats.limit, stats.throttled, stats.completed) == (4, 1, 1)
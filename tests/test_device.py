@@ -0,0 +1,40 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for encrypting secrets with the device key."""
+
+from base64 import urlsafe_b64decode
+
+import pytest
+from nacl.exceptions import CryptoError
+from nacl.secret import SecretBox
+from nacl.utils import random
+
+from ente_tools.api.core.device import DeviceCrypto
+from ente_tools.api.core.types_crypt import SecretPair
+
+
+def test_device_crypto() -> None:
+    """Secrets encrypted in bulk decrypt one by one, and with a SecretBox."""
+    key = random(SecretBox.KEY_SIZE)
+    crypto = DeviceCrypto(key)
+    msgs = [random(n) for n in range(10)]
+
+    secrets = [SecretPair(encrypted=e, nonce=n) for (e, n) in crypto.encrypt_many(msgs)]
+    assert len({s.nonce for s in secrets}) == len(msgs)
+    assert crypto.decrypt_many(secrets) == msgs
+    assert [s.decrypt(key) for s in secrets] == msgs
+    assert [SecretBox(key).decrypt(urlsafe_b64decode(s.encrypted), urlsafe_b64decode(s.nonce)) for s in secrets] == msgs
+
+    with pytest.raises(CryptoError):
+        DeviceCrypto(random(SecretBox.KEY_SIZE)).decrypt(secrets[0])
@@ -0,0 +1,92 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the journal of the transfers of missing files."""
+
+from pathlib import Path
+
+from PIL import Image
+
+from ente_tools.api.photo.journal import DownloadJournal
+from ente_tools.api.photo.loader import hash_file
+from ente_tools.api.photo.planner import PlannedDownload
+from ente_tools.db.base import Backend
+
+from .ente_fake import make_remote
+
+
+def make_download(targets: list[Path], file_hash: str) -> PlannedDownload:
+    """Return a planned download of content to targets."""
+    return PlannedDownload(hash=file_hash, refs=[make_remote(1, file_hash)], targets=targets)
+
+
+def write_image(path: Path, color: str = "red") -> str:
+    """Write an image, returning its hash."""
+    Image.new("RGB", (10, 10), color=color).save(path)
+    return hash_file(str(path))
+
+
+def test_journal(backend: Backend, tmp_path: Path) -> None:
+    """Verified targets are folded into the local media index, and mismatched ones removed."""
+    (good, bad) = (tmp_path / "good.jpg", tmp_path / "bad.jpg")
+    d = make_download([good, bad], write_image(tmp_path / "content.jpg"))
+    journal = DownloadJournal(backend)
+    journal.plan([d])
+    assert {e.state for e in backend.get_download_journal().values()} == {"planned"}
+
+    journal.start(d, good)
+    write_image(good)
+    assert journal.complete(good)
+    journal.start(d, bad)
+    write_image(bad, color="blue")
+    assert not journal.complete(bad)
+    assert not bad.exists()
+
+    # Completed targets stay in the journal until folded
+    assert backend.get_download_journal()[str(good)].state == "completed"
+    journal.flush()
+
+    entries = backend.get_download_journal()
+    assert list(entries) == [str(bad)]
+    assert entries[str(bad)].state == "failed"
+    (media,) = backend.get_local_media()
+    assert media.media.file.fullpath == str(good)
+    assert media.media.hash == d.hash
+    assert media.media.media_type == "image"
+
+
+def test_journal_recover(backend: Backend, tmp_path: Path) -> None:
+    """A rerun folds the completed targets of an interrupted run, and removes unverified ones."""
+    (done, partial) = (tmp_path / "done.jpg", tmp_path / "partial.jpg")
+    d = make_download([done, partial], write_image(tmp_path / "content.jpg"))
+    journal = DownloadJournal(backend)
+    journal.plan([d])
+    journal.start(d, done)
+    write_image(done)
+    assert journal.complete(done)
+    journal.start(d, partial)
+    partial.write_bytes(b"unverified")
+    (tmp_path / ".partial.jpg.x1y2.part").write_bytes(b"partial")
+    # The run is interrupted here
+
+    journal = DownloadJournal(backend)
+    journal.recover()
+
+    assert not partial.exists()
+    assert not (tmp_path / ".partial.jpg.x1y2.part").exists()
+    assert {t: e.state for (t, e) in backend.get_download_journal().items()} == {str(partial): "planned"}
+    assert [m.media.file.fullpath for m in backend.get_local_media()] == [str(done)]
+
+    # Targets no longer planned are forgotten
+    journal.plan([])
+    assert backend.get_download_journal() == {}
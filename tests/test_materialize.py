@@ -0,0 +1,108 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of planning downloads and creating files from identical local content."""
+
+from pathlib import Path
+
+from ente_tools.api.photo.file_metadata import Media
+from ente_tools.api.photo.loader import NewAVFile
+from ente_tools.api.photo.local_file import NewLocalDiskFile
+from ente_tools.api.photo.materialize import materialize
+from ente_tools.api.photo.planner import best_source, plan_downloads
+
+from .ente_fake import make_remote
+
+
+def make_local(path: Path, file_hash: str) -> Media:
+    """Return the indexed media of a local file."""
+    return Media(
+        media=NewAVFile(
+            file=NewLocalDiskFile.from_path(path=path, mime_type="video/mp4"),
+            hash=file_hash,
+            data_hash=None,
+            metadata={},
+        ),
+        xmp_sidecar=None,
+    )
+
+
+def test_materialize(tmp_path: Path) -> None:
+    """The destination gets the content of the source, and no temporary file is left."""
+    source = tmp_path / "source.bin"
+    source.write_bytes(b"content" * 1000)
+    dest = tmp_path / "sub" / "dest.bin"
+
+    method = materialize(source, dest)
+
+    assert method in {"reflink", "copy_file_range", "hardlink", "copy"}
+    assert dest.read_bytes() == source.read_bytes()
+    assert sorted(p.name for p in dest.parent.iterdir()) == ["dest.bin"]
+
+
+def test_plan_downloads(tmp_path: Path) -> None:
+    """Content in the sync directory is skipped, content elsewhere is copied, the rest is fetched."""
+    sync_dir = tmp_path / "sync"
+    other_dir = tmp_path / "other"
+    sync_dir.mkdir()
+    other_dir.mkdir()
+    (sync_dir / "present.mp4").write_bytes(b"present")
+    (other_dir / "elsewhere.mp4").write_bytes(b"elsewhere")
+    (other_dir / "changed.mp4").write_bytes(b"changed")
+    local = [
+        make_local(sync_dir / "present.mp4", "a-_"),
+        make_local(other_dir / "elsewhere.mp4", "b"),
+        make_local(other_dir / "changed.mp4", "c"),
+    ]
+    (other_dir / "changed.mp4").write_bytes(b"changed since indexed")
+
+    refs = [
+        make_remote(1, "a+/"),  # Standard base64 of the local hash
+        make_remote(2, "b"),
+        make_remote(3, "b"),
+        make_remote(4, "c"),
+        make_remote(5, "d"),
+        make_remote(6, None),
+    ]
+    plan = plan_downloads(refs, local, sync_dir, lambda f: f.metadata["title"])
+
+    assert plan.present == 1
+    assert plan.unhashed == 1
+    by_hash = {d.hash: d for d in plan.downloads}
+    assert sorted(by_hash) == ["b", "c", "d"]
+    assert [r.file.id for r in by_hash["b"].refs] == [2, 3]
+    assert by_hash["b"].action == "materialize"
+    assert by_hash["b"].source == other_dir / "elsewhere.mp4"
+    assert by_hash["b"].targets == [sync_dir / "2.mp4", sync_dir / "3.mp4"]
+    assert by_hash["c"].action == "fetch"
+    assert by_hash["d"].action == "fetch"
+
+
+def test_plan_downloads_dedupe(tmp_path: Path) -> None:
+    """Copies of one content in several albums and accounts are fetched once from the best source."""
+    refs = [
+        make_remote(1, "h", title="a.jpg", owner_id=2, size=10),  # Shared with the account
+        make_remote(2, "h", title="a.jpg", size=30),
+        make_remote(3, "h", title="b.jpg", email="d@e.f", size=20),
+        make_remote(4, "h", title="b.jpg", email="d@e.f"),
+    ]
+    assert best_source(refs).file.id == 3  # noqa: PLR2004
+    assert best_source(refs[:1]).file.id == 1
+
+    plan = plan_downloads(refs, [], tmp_path, lambda f: f.metadata["title"])
+
+    (download,) = plan.downloads
+    assert download.action == "fetch"
+    assert download.ref.email == "d@e.f"
+    assert [r.file.id for r in download.refs] == [3, 1, 2, 4]
+    assert download.targets == [tmp_path / "b.jpg", tmp_path / "a.jpg"]
@@ -0,0 +1,240 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for refreshing accounts against a stand-in for the Ente API."""
+
+from pathlib import Path
+from typing import cast
+
+import pytest
+
+from ente_tools.api.core.api import EnteAPI, EnteAPIError
+from ente_tools.api.core.ente_crypt import EnteCryptError
+from ente_tools.api.core.types_file import File, MetadataCache, metadata_cache
+from ente_tools.db.base import Backend
+from ente_tools.db.sqlite import SQLiteBackend
+
+from .ente_fake import FakeEnte
+
+
+@pytest.fixture
+def server() -> FakeEnte:
+    """Create a server with two collections of five files each."""
+    server = FakeEnte(page_size=2)
+    for name in ("one", "two"):
+        collection_id = server.add_collection(name)
+        for i in range(5):
+            server.add_file(collection_id, f"{name}-{i}.jpg", file_hash=f"{name}-{i}")
+    return server
+
+
+def refresh(backend: Backend, server: FakeEnte, email: str = "test@example.com", *, force: bool = False) -> None:
+    """Refresh the account from the server."""
+    account = backend.get_account(email, with_files=False)
+    assert account is not None
+    account.refresh(cast("EnteAPI", server), force_refresh=force, sink=backend.refresh_sink(email))
+
+
+def titles(backend: Backend, email: str = "test@example.com") -> dict[int, set[str]]:
+    """Return the titles of the files by collection."""
+    account = backend.get_account(email)
+    assert account is not None
+    return {c: {f.metadata["title"] for f in files} for c, files in account.files.items()}
+
+
+def test_refresh(backend: Backend, server: FakeEnte) -> None:
+    """A refresh saves all collections and files."""
+    backend.add_account(server.account())
+    refresh(backend, server)
+
+    assert titles(backend) == {
+        c: {f"{name}-{i}.jpg" for i in range(5)} for c, name in zip(server.collections, ("one", "two"), strict=True)
+    }
+    (summary,) = backend.list_account_summaries()
+    assert summary.collections == len(server.collections)
+    assert summary.files == 10  # noqa: PLR2004
+
+
+def test_refresh_resumes(backend: Backend, server: FakeEnte) -> None:
+    """An interrupted refresh keeps the saved pages and resumes after the last one."""
+    backend.add_account(server.account())
+
+    # Fail in the middle of the second collection
+    server.fail_after = 4
+    with pytest.raises(EnteAPIError):
+        refresh(backend, server)
+    (first, second) = server.collections
+    assert titles(backend) == {first: {f"one-{i}.jpg" for i in range(5)}, second: {"two-0.jpg", "two-1.jpg"}}
+
+    server.fail_after = None
+    server.calls.clear()
+    refresh(backend, server)
+
+    # The first collection is complete, the second resumes after its first page
+    assert server.calls[0] == (first, server.collections[first].update_time)
+    assert server.calls[1] == (second, server.files[second][sorted(server.files[second])[1]].update_time)
+    assert titles(backend)[second] == {f"two-{i}.jpg" for i in range(5)}
+
+
+def test_parallel_refresh(backend: Backend, server: FakeEnte) -> None:
+    """Collections refreshed concurrently save the same files, reporting progress."""
+    backend.add_account(server.account())
+    account = backend.get_account("test@example.com", with_files=False)
+    assert account is not None
+    progress: list[tuple[int, int]] = []
+    account.refresh(
+        cast("EnteAPI", server),
+        sink=backend.refresh_sink("test@example.com"),
+        workers=4,
+        progress=lambda done, total: progress.append((done, total)),
+    )
+    assert progress == [(1, 2), (2, 2)]
+    assert titles(backend) == {
+        c: {f"{name}-{i}.jpg" for i in range(5)} for c, name in zip(server.collections, ("one", "two"), strict=True)
+    }
+
+
+def test_refresh_updates(backend: Backend, server: FakeEnte) -> None:
+    """A second refresh picks up new and updated files."""
+    backend.add_account(server.account())
+    refresh(backend, server)
+
+    (first, _) = server.collections
+    file_id = next(iter(server.files[first]))
+    server.add_file(first, "renamed.jpg", file_id=file_id)
+    server.add_file(first, "new.jpg")
+    refresh(backend, server)
+
+    assert titles(backend)[first] == {"renamed.jpg", "new.jpg"} | {f"one-{i}.jpg" for i in range(1, 5)}
+
+    refresh(backend, server, force=True)
+    assert len(titles(backend)[first]) == 6  # noqa: PLR2004
+
+
+def test_forced_refresh(backend: Backend, server: FakeEnte) -> None:
+    """A forced refresh replaces the stored files once complete, and an interrupted one keeps them."""
+    backend.add_account(server.account())
+    refresh(backend, server)
+    stored = titles(backend)
+
+    (first, _) = server.collections
+    del server.files[first][next(iter(server.files[first]))]
+    server.fail_after = len(server.calls) + 1
+    with pytest.raises(EnteAPIError):
+        refresh(backend, server, force=True)
+    assert titles(backend) == stored
+
+    server.fail_after = None
+    refresh(backend, server, force=True)
+    assert titles(backend)[first] == {f"one-{i}.jpg" for i in range(1, 5)}
+    assert sum(s.files for s in backend.list_account_summaries()) == 9  # noqa: PLR2004
+
+
+def test_reopen(tmp_path: Path, server: FakeEnte) -> None:
+    """A refreshed account is loaded again from a reopened database."""
+    SQLiteBackend(db_path=str(tmp_path / "test.db")).add_account(server.account())
+    refresh(SQLiteBackend(db_path=str(tmp_path / "test.db")), server)
+    backend = SQLiteBackend(db_path=str(tmp_path / "test.db"))
+    assert sum(len(t) for t in titles(backend).values()) == 10  # noqa: PLR2004
+
+
+def test_refresh_file_cursor(backend: Backend, server: FakeEnte) -> None:
+    """File diffs are requested since the last fetched file, not since the collection changed."""
+    backend.add_account(server.account())
+    refresh(backend, server)
+
+    (first, second) = server.collections
+    last_file = max(f.update_time for f in server.files[first].values())
+    server.touch_collection(first)
+    server.calls.clear()
+    refresh(backend, server)
+
+    # Only the touched collection is requested, since its last file, and nothing is returned
+    assert server.calls == [(first, last_file)]
+    assert server.collections[first].update_time > last_file
+
+    server.add_file(second, "new.jpg")
+    server.calls.clear()
+    refresh(backend, server)
+    assert len(server.calls) == 1
+    assert "new.jpg" in titles(backend)[second]
+
+
+def test_file_keys(backend: Backend, server: FakeEnte) -> None:
+    """File keys are kept as sent by the server and decrypted with the collection key."""
+    backend.add_account(server.account())
+    refresh(backend, server)
+
+    account = backend.get_account("test@example.com")
+    assert account is not None
+    for files in account.files.values():
+        for f in files:
+            assert account.file_key(f) == server.file_keys[f.id]
+
+
+def test_lazy_metadata(backend: Backend, server: FakeEnte) -> None:
+    """Metadata is stored encrypted and decrypted once on first access."""
+    backend.add_account(server.account())
+    refresh(backend, server)
+    metadata_cache.clear()
+
+    account = backend.get_account("test@example.com")
+    assert account is not None
+    f = next(iter(account.files.values()))[0]
+    assert f.enc_metadata is not None
+    assert f.plain_metadata is None
+
+    assert f.metadata["title"] == server.titles[f.id]
+    assert f.metadata is f.metadata
+    assert f.pub_magic_metadata == {}
+
+    # Files without a bound key cannot decrypt their metadata
+    unbound = File.model_validate(f.model_dump(by_alias=True))
+    metadata_cache.clear()
+    with pytest.raises(EnteCryptError):
+        _ = unbound.metadata
+
+
+def test_metadata_cache_reserve() -> None:
+    """A reservation grows the metadata cache only while in its context."""
+    cache = MetadataCache(maxsize=2)
+    with cache.reserve(2), cache.reserve(2):
+        for file_id in range(4):
+            cache.get(file_id, 1)["metadata"] = {"title": str(file_id)}
+        assert cache.get(0, 1) == {"metadata": {"title": "0"}}
+    # The most recently used entries are kept
+    assert cache.get(0, 1) == {"metadata": {"title": "0"}}
+    assert cache.get(3, 1) == {"metadata": {"title": "3"}}
+    assert cache.get(1, 1) == {}
+
+
+def test_decrypted_metadata() -> None:
+    """Files saved with decrypted metadata keep it."""
+    f = File.model_validate(
+        {
+            "id": 1,
+            "owner_id": 1,
+            "collection_id": 1,
+            "collection_owner_id": 1,
+            "file": {"decryptionHeader": "header"},
+            "thumbnail": {"decryptionHeader": "header"},
+            "metadata": {"title": "a.jpg"},
+            "is_deleted": False,
+            "update_time": 1,
+            "magic_metadata": {},
+            "pub_magic_metadata": {"editedTime": 1},
+        },
+    )
+    assert f.metadata == {"title": "a.jpg"}
+    assert f.pub_magic_metadata == {"editedTime": 1}
+    assert File.model_validate(f.model_dump(by_alias=True)).metadata == {"title": "a.jpg"}
@@ -0,0 +1,80 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for extracting the metadata of remote files from partial downloads."""
+
+import io
+import os
+from pathlib import Path
+
+from nacl.utils import random
+from PIL import Image
+
+from ente_tools.api.core.ente_crypt import StreamEncryptionSize
+from ente_tools.api.photo.remote_metadata import RemoteMetadata, extract_remote_metadata
+from ente_tools.db.in_memory import InMemoryBackend
+from ente_tools.db.sqlite import SQLiteBackend
+
+from .ente_fake import RangeServer, encrypt, make_api, make_file
+
+
+def make_jpeg() -> bytes:
+    """Return a JPEG larger than one chunk, with EXIF data in its header."""
+    img = Image.frombytes("RGB", (64, 64), os.urandom(64 * 64 * 3))
+    exif = Image.Exif()
+    exif[0x010F] = "TestMake"  # Make
+    out = io.BytesIO()
+    img.save(out, format="JPEG", exif=exif)
+    # Trailing data after the end of the image stands in for a large image
+    return out.getvalue() + os.urandom(StreamEncryptionSize)
+
+
+def test_extract_remote_metadata() -> None:
+    """The EXIF data of a remote image is read from its first chunk only."""
+    key = random(32)
+    plaintext = make_jpeg()
+    assert len(plaintext) > StreamEncryptionSize
+    (header, data) = encrypt(plaintext, key, StreamEncryptionSize)
+    server = RangeServer(data)
+    api = make_api(server)
+    file = make_file(header, plain_metadata={"metadata": {"title": "photo.jpg"}})
+
+    result = extract_remote_metadata(api, file, key, max_chunks=1)
+    assert result.error is None
+    assert result.media_type == "image"
+    assert result.metadata["Base:Make"] == "TestMake"
+    assert result.fetched_bytes <= StreamEncryptionSize + 17 + 16
+
+    # Unsupported files are not downloaded
+    server.ranges.clear()
+    file.plain_metadata = {"metadata": {"title": "notes.txt"}}
+    result = extract_remote_metadata(api, file, key, max_chunks=1)
+    assert result.error == "unsupported media type"
+    assert server.ranges == []
+
+
+def test_backend_remote_metadata(tmp_path: Path) -> None:
+    """Extracted metadata is stored and replaced by file ID."""
+    for backend in (InMemoryBackend(), SQLiteBackend(db_path=str(tmp_path / "ente.db"))):
+        backend.save_remote_metadata([RemoteMetadata(file_id=1, update_time=1, error="failed")])
+        backend.save_remote_metadata(
+            [
+                RemoteMetadata(file_id=1, update_time=2, media_type="image", metadata={"Base:Make": "TestMake"}),
+                RemoteMetadata(file_id=2, update_time=1, media_type="video"),
+            ],
+        )
+        stored = backend.get_remote_metadata()
+        assert sorted(stored) == [1, 2]
+        assert stored[1].update_time == 2  # noqa: PLR2004
+        assert stored[1].metadata == {"Base:Make": "TestMake"}
+        assert stored[1].error is None
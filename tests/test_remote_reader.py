@@ -0,0 +1,163 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for random access to the decrypted content of remote files."""
+
+import asyncio
+import io
+import os
+from base64 import urlsafe_b64encode
+from http import HTTPStatus
+
+import httpx
+import pytest
+from nacl.utils import random
+
+from ente_tools.api.core.api import EnteAPIError
+from ente_tools.api.core.ente_crypt import EnteCryptError, StreamEncryptionSize
+from ente_tools.api.core.remote_reader import RemoteDecryptedReader
+
+from .ente_fake import RangeServer, encrypt, make_api, make_file
+
+CHUNK = 1000
+
+
+def test_reader() -> None:
+    """Reads at any position return the plaintext, fetching only the chunks needed."""
+    key = random(32)
+    plaintext = os.urandom(CHUNK * 9 + 123)
+    (header, data) = encrypt(plaintext, key, CHUNK)
+    server = RangeServer(data)
+    reader = RemoteDecryptedReader(server.fetch, key, header, chunk_size=CHUNK, cache_chunks=2)
+
+    # A read far into the file fetches that chunk and the MACs of the chunks before it
+    reader.seek(CHUNK * 7 + 10)
+    assert reader.read(20) == plaintext[CHUNK * 7 + 10 : CHUNK * 7 + 30]
+    assert reader.fetched_bytes < 2 * CHUNK
+
+    # Reads across chunks, backwards, and to the end
+    reader.seek(CHUNK * 2 - 5)
+    assert reader.read(10) == plaintext[CHUNK * 2 - 5 : CHUNK * 2 + 5]
+    assert reader.seek(-50, os.SEEK_END) == len(plaintext) - 50
+    assert reader.read() == plaintext[-50:]
+    assert reader.read(10) == b""
+    assert reader.size == len(plaintext)
+
+    # Reading everything matches
+    reader.seek(0)
+    assert reader.read() == plaintext
+
+    # Cached chunks are not fetched again
+    server.ranges.clear()
+    reader.seek(len(plaintext) - 10)
+    reader.read()
+    assert server.ranges == []
+
+
+def test_reader_truncated() -> None:
+    """A file cut at a chunk boundary is detected by its missing final tag."""
+    key = random(32)
+    (header, data) = encrypt(os.urandom(CHUNK * 3), key, CHUNK)
+    server = RangeServer(data[: 2 * (CHUNK + 17)])
+    reader = RemoteDecryptedReader(server.fetch, key, header, chunk_size=CHUNK)
+    with pytest.raises(EnteCryptError, match="unexpected tag"):
+        reader.read()
+
+
+def test_reader_corrupted() -> None:
+    """A chunk with a flipped ciphertext byte fails to decrypt."""
+    key = random(32)
+    plaintext = os.urandom(CHUNK * 3)
+    (header, data) = encrypt(plaintext, key, CHUNK)
+    corrupted = bytearray(data)
+    corrupted[CHUNK + 17 + 100] ^= 1
+    reader = RemoteDecryptedReader(RangeServer(bytes(corrupted)).fetch, key, header, chunk_size=CHUNK)
+    # Other chunks still decrypt
+    assert reader.read(10) == plaintext[:10]
+    reader.seek(CHUNK + 10)
+    with pytest.raises(EnteCryptError, match="corrupted chunk 1"):
+        reader.read(10)
+
+
+def test_open_file() -> None:
+    """EnteAPI.open_file reads through HTTP Range requests."""
+    key = random(32)
+    plaintext = os.urandom(StreamEncryptionSize * 2 + 1000)
+    (header, data) = encrypt(plaintext, key, StreamEncryptionSize)
+    server = RangeServer(data)
+    api = make_api(server)
+    file = make_file(header)
+
+    with api.open_file(file, key) as f:
+        f.seek(StreamEncryptionSize * 2 + 100)
+        assert f.read(100) == plaintext[StreamEncryptionSize * 2 + 100 : StreamEncryptionSize * 2 + 200]
+        # The last chunk with the MAC of the one before, and the MAC of the first chunk
+        assert len(server.ranges) == 2  # noqa: PLR2004
+
+
+def test_iter_file() -> None:
+    """Whole files stream as decrypted chunks, synchronously or not, or into a sink."""
+    key = random(32)
+    plaintext = os.urandom(StreamEncryptionSize * 2 + 1000)
+    (header, data) = encrypt(plaintext, key, StreamEncryptionSize)
+    api = make_api(RangeServer(data))
+    file = make_file(header)
+
+    chunks = list(api.iter_file(file, key))
+    assert [len(c) for c in chunks] == [StreamEncryptionSize, StreamEncryptionSize, 1000]
+    assert b"".join(chunks) == plaintext
+
+    async def collect() -> bytes:
+        return b"".join([c async for c in api.aiter_file(file, key)])
+
+    assert asyncio.run(collect()) == plaintext
+
+    sink = io.BytesIO()
+    assert api.write_file(file, key, sink) == len(plaintext)
+    assert sink.getvalue() == plaintext
+
+    # A truncated file fails after yielding the chunks it has
+    api = make_api(RangeServer(data[: StreamEncryptionSize + 17]))
+    with pytest.raises(EnteCryptError, match="unfinished"):
+        list(api.iter_file(file, key))
+
+
+def test_download_token() -> None:
+    """A download with the token of another account sends it instead of the client's."""
+    key = random(32)
+    (header, data) = encrypt(b"content", key, StreamEncryptionSize)
+    server = RangeServer(data)
+    tokens: list[str | None] = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        tokens.append(request.headers.get("X-Auth-Token"))
+        return server.handle(request)
+
+    api = make_api(server)
+    api.client = httpx.Client(transport=httpx.MockTransport(handle))
+    api.set_token(b"client")
+    file = make_file(header)
+
+    assert b"".join(api.iter_file(file, key, token=b"account")) == b"content"
+    assert b"".join(api.iter_file(file, key)) == b"content"
+    assert tokens == [str(urlsafe_b64encode(t), "utf-8") for t in (b"account", b"client")]
+
+
+def test_download_range_invalid() -> None:
+    """A partial response without the size of the file is an API error."""
+    api = make_api(RangeServer(b""))
+    api.client = httpx.Client(
+        transport=httpx.MockTransport(lambda _: httpx.Response(HTTPStatus.PARTIAL_CONTENT, content=b"data")),
+    )
+    with pytest.raises(EnteAPIError, match="Content-Range"):
+        api.download_range(1, 0, 4)
@@ -0,0 +1,119 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for retrying failed requests."""
+
+import os
+import re
+from collections.abc import Iterator
+from http import HTTPStatus
+
+import httpx
+import pytest
+from nacl.utils import random
+
+from ente_tools.api.core.api import EnteAPI, EnteAPIError
+from ente_tools.api.core.ente_crypt import CHUNK_SIZE, StreamEncryptionSize
+from ente_tools.api.core.retry import Retrier, RetryPolicy
+
+from .ente_fake import encrypt, make_file
+
+
+def make_api(handler: httpx.MockTransport, retry: Retrier) -> EnteAPI:
+    """Return an API client sending requests to the transport."""
+    return EnteAPI(
+        pkg="test",
+        api_url="https://api.test",
+        api_account_url="https://accounts.test",
+        api_download_url="https://files.test/?fileID=",
+        transport=handler,
+        async_transport=handler,
+        retry=retry,
+    )
+
+
+def test_backoff() -> None:
+    """Delays grow exponentially with jitter, up to the maximum, unless the server asks for one."""
+    retrier = Retrier(RetryPolicy(base_delay=1, max_delay=10), rng=lambda: 0.5)
+    assert [retrier.backoff(a) for a in range(1, 6)] == [0.5, 1, 2, 4, 5]
+    assert retrier.backoff(1, "3") == 3  # noqa: PLR2004
+    assert retrier.backoff(1, "120") == 10  # noqa: PLR2004
+    assert retrier.backoff(1, "Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert retrier.backoff(1, "soon") == 0.5  # noqa: PLR2004
+
+
+def test_get_retries() -> None:
+    """Throttled and failed API requests are retried, within the budget."""
+    responses = [
+        httpx.Response(HTTPStatus.TOO_MANY_REQUESTS, headers={"Retry-After": "2"}),
+        httpx.Response(HTTPStatus.BAD_GATEWAY),
+        httpx.Response(HTTPStatus.OK, json={"collections": []}),
+    ]
+    delays: list[float] = []
+    retrier = Retrier(RetryPolicy(budget=3), rng=lambda: 0, sleep=delays.append)
+    api = make_api(httpx.MockTransport(lambda _: responses.pop(0)), retrier)
+
+    assert api.get_collections() == []
+    assert delays == [2, 0]
+    stats = retrier.stats["/collections/v2"]
+    assert (stats.requests, stats.retries, stats.failures) == (3, 2, 0)
+    assert stats.statuses == {429: 1, 502: 1}
+
+    # The budget left allows one more retry
+    responses = [httpx.Response(HTTPStatus.SERVICE_UNAVAILABLE)] * 3
+    with pytest.raises(EnteAPIError, match="503"):
+        api.get_collections()
+    assert retrier.budget == 0
+    assert len(responses) == 1
+
+
+def test_post_not_repeated() -> None:
+    """Non-idempotent requests are only retried if the server did not process them."""
+    responses = [httpx.Response(HTTPStatus.INTERNAL_SERVER_ERROR)]
+    api = make_api(httpx.MockTransport(lambda _: responses.pop(0)), Retrier(sleep=lambda _: None))
+    with pytest.raises(EnteAPIError, match="500"):
+        api.send_email_otp("a@b.c")
+
+
+def test_download_resumes() -> None:
+    """Interrupted downloads resume after the last whole chunk."""
+    key = random(32)
+    plaintext = os.urandom(StreamEncryptionSize * 2 + 1000)
+    (header, data) = encrypt(plaintext, key, StreamEncryptionSize)
+    ranges: list[str | None] = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        ranges.append(request.headers.get("Range"))
+        if len(ranges) == 1:
+            return httpx.Response(HTTPStatus.SERVICE_UNAVAILABLE)
+        m = re.fullmatch(r"bytes=(\d+)-", request.headers.get("Range", "bytes=0-"))
+        assert m
+        start = int(m[1])
+
+        def content() -> Iterator[bytes]:
+            # The first full download breaks in the middle of the second chunk
+            yield data[start : start + CHUNK_SIZE + 100]
+            if len(ranges) == 2:  # noqa: PLR2004
+                msg = "connection reset"
+                raise httpx.ReadError(msg)
+            yield data[start + CHUNK_SIZE + 100 :]
+
+        return httpx.Response(
+            HTTPStatus.PARTIAL_CONTENT if start else HTTPStatus.OK,
+            content=content(),
+        )
+
+    api = make_api(httpx.MockTransport(handle), Retrier(rng=lambda: 0, sleep=lambda _: None))
+    assert b"".join(api.iter_file(make_file(header), key)) == plaintext
+    assert ranges == [None, None, f"bytes={CHUNK_SIZE}-"]
+    assert api.retry.stats["download"].retries == 2  # noqa: PLR2004
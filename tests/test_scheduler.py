@@ -0,0 +1,79 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the ordering of downloads and the large file lane."""
+
+import threading
+from collections.abc import Sequence
+from pathlib import Path
+
+from ente_tools.api.photo.planner import PlannedDownload
+from ente_tools.api.photo.scheduler import DownloadLanes, SchedulePolicy, schedule
+
+from .ente_fake import make_remote
+
+
+def make_download(file_id: int, size: int | None, *, email: str = "a@b.c", collection_id: int = 1) -> PlannedDownload:
+    """Return a planned download of a remote file."""
+    ref = make_remote(file_id, str(file_id), email=email, size=size)
+    ref.file.collection_id = collection_id
+    ref.file.plain_metadata = {"metadata": {"title": f"{file_id}.jpg", "creationTime": file_id * 1_000_000}}
+    return PlannedDownload(hash=str(file_id), refs=[ref], targets=[Path(f"{file_id}.jpg")])
+
+
+def ids(downloads: Sequence[PlannedDownload | None]) -> list[int | None]:
+    """Return the IDs of the remote files of downloads, or None where no download was taken."""
+    return [d.ref.file.id if d is not None else None for d in downloads]
+
+
+def test_schedule() -> None:
+    """Downloads are ordered by each policy."""
+    downloads = [
+        make_download(1, 300, collection_id=2),
+        make_download(2, None, email="d@e.f"),
+        make_download(3, 100, email="d@e.f", collection_id=3),
+        make_download(4, 200),
+    ]
+    assert ids(schedule(downloads, SchedulePolicy.SMALLEST_FIRST)) == [3, 4, 1, 2]
+    assert ids(schedule(downloads, SchedulePolicy.NEWEST_FIRST)) == [4, 3, 2, 1]
+    assert ids(schedule(downloads, SchedulePolicy.COLLECTION, collection_priority=[3, 2])) == [3, 1, 4, 2]
+    assert ids(schedule(downloads, SchedulePolicy.ROUND_ROBIN)) == [3, 4, 2, 1]
+
+
+def test_lanes() -> None:
+    """Small files are taken first by their lane, and each lane takes from the other once empty."""
+    lanes = DownloadLanes([make_download(1, 10), make_download(2, 1000), make_download(3, 20)], large_size=100)
+    assert ids([lanes.take(large=True), lanes.take(large=False), lanes.take(large=True)]) == [2, 1, 3]
+    assert lanes.take(large=False) is None
+
+
+def test_lanes_run() -> None:
+    """A large file does not hold back the small ones."""
+    downloads = [make_download(1, 1000), make_download(2, 2000), *(make_download(i, 10) for i in range(3, 13))]
+    small_done = threading.Event()
+    done: list[int] = []
+    lock = threading.Lock()
+
+    def task(d: PlannedDownload) -> None:
+        if d.ref.file.id < 3:  # noqa: PLR2004
+            # Large files wait until all the small ones are done
+            assert small_done.wait(timeout=5)
+        with lock:
+            done.append(d.ref.file.id)
+            if len(done) == len(downloads) - 2:
+                small_done.set()
+
+    DownloadLanes(downloads, large_size=100).run(task, workers=3)
+
+    assert sorted(done) == list(range(1, 13))
+    assert set(done[-2:]) == {1, 2}
@@ -0,0 +1,125 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the on-disk cache of decrypted thumbnails."""
+
+import os
+from base64 import urlsafe_b64encode
+from http import HTTPStatus
+from pathlib import Path
+
+import httpx
+from nacl.utils import random
+
+from ente_tools.api.core.api import EnteAPI
+from ente_tools.api.core.types_file import File, FileAttributes
+from ente_tools.api.photo.thumbnails import ThumbnailCache
+from ente_tools.db.base import Backend
+
+from .ente_fake import encrypt
+
+
+def make_thumbnail_file(file_id: int, header: bytes = b"", update_time: int = 1) -> File:
+    """Return a file whose thumbnail has the decryption header."""
+    return File(
+        id=file_id,
+        owner_id=1,
+        collection_id=1,
+        collection_owner_id=1,
+        file=FileAttributes(decryptionHeader=""),
+        thumbnail=FileAttributes(decryptionHeader=str(urlsafe_b64encode(header), "utf-8")),
+        is_deleted=False,
+        update_time=update_time,
+    )
+
+
+def test_download_thumbnail() -> None:
+    """Thumbnails are fetched from the preview endpoint and decrypted."""
+    key = random(32)
+    thumbnail = os.urandom(5000)
+    (header, data) = encrypt(thumbnail, key, chunk_size=len(thumbnail))
+    requests: list[httpx.Request] = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(HTTPStatus.OK, content=data)
+
+    transport = httpx.MockTransport(handle)
+    api = EnteAPI(
+        pkg="test",
+        api_url="https://api.test",
+        api_account_url="https://accounts.test",
+        api_download_url="https://files.test/?fileID=",
+        transport=transport,
+        async_transport=transport,
+    )
+    assert api.download_thumbnail(make_thumbnail_file(7, header), key, token=b"token") == thumbnail
+    assert str(requests[0].url) == "https://api.test/files/preview/7"
+    assert requests[0].headers["X-Auth-Token"] == str(urlsafe_b64encode(b"token"), "utf-8")
+
+
+def test_thumbnail_cache(backend: Backend, tmp_path: Path) -> None:
+    """Cached thumbnails are found at the current version of their file, also when reopened."""
+    cache = ThumbnailCache(tmp_path / "thumbnails", backend)
+    (file, copy) = (make_thumbnail_file(1), make_thumbnail_file(2))
+    assert cache.get(file) is None
+
+    path = cache.put(file, b"thumbnail")
+    assert path.read_bytes() == b"thumbnail"
+    assert cache.get(file) == path
+
+    # Files with the same thumbnail share it
+    assert cache.put(copy, b"thumbnail") == path
+    assert cache.size == len(b"thumbnail")
+
+    # An updated file's thumbnail is not current
+    assert cache.get(make_thumbnail_file(1, update_time=2)) is None
+
+    # A new thumbnail of an updated file replaces the former one, once no other file shares it
+    updated = cache.put(make_thumbnail_file(1, update_time=2), b"updated")
+    assert path.exists()
+    cache.put(make_thumbnail_file(2, update_time=2), b"updated")
+    assert not path.exists()
+    assert cache.size == len(b"updated")
+
+    cache.save()
+    reopened = ThumbnailCache(tmp_path / "thumbnails", backend)
+    assert reopened.get(make_thumbnail_file(1, update_time=2)) == updated
+    assert reopened.get(copy) is None
+    assert reopened.size == len(b"updated")
+
+
+def test_thumbnail_cache_evicts(backend: Backend, tmp_path: Path) -> None:
+    """The least recently used thumbnails are evicted over the cap."""
+    cache = ThumbnailCache(tmp_path / "thumbnails", backend, max_size=250)
+    files = [make_thumbnail_file(i) for i in range(4)]
+    paths = [cache.put(f, bytes([i]) * 100) for (i, f) in enumerate(files[:2])]
+    cache.save()
+
+    # Reading the first thumbnail makes the second the least recently used
+    assert cache.get(files[0]) == paths[0]
+    cache.put(files[2], b"\x02" * 100)
+    assert cache.get(files[1]) is None
+    assert not paths[1].exists()
+    assert cache.get(files[0]) == paths[0]
+    assert cache.size == 2 * 100
+
+    # Evictions are removed from the index
+    cache.save()
+    assert set(backend.get_thumbnail_index()) == {0, 2}
+
+    # The order of use is kept when reopened
+    reopened = ThumbnailCache(tmp_path / "thumbnails", backend, max_size=250)
+    reopened.put(files[3], b"\x03" * 100)
+    assert set(reopened.entries) == {0, 3}
+    assert reopened.size == 2 * 100
@@ -0,0 +1,110 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for constructing models from trusted data."""
+
+import json
+from typing import Annotated, Literal
+
+import pytest
+from pydantic import BaseModel, Discriminator, Tag
+
+from ente_tools.api.photo.file_metadata import Media
+from ente_tools.api.photo.loader import NewAVFile, NewXMPDiskFile
+from ente_tools.api.photo.local_file import NewLocalDiskFile
+from ente_tools.db.trusted import TrustedLoadError, construct
+
+
+class Inner(BaseModel):
+    """A nested model with an alias."""
+
+    value: int
+    other: str = "default"
+
+
+class Outer(BaseModel):
+    """A model using the supported annotations."""
+
+    inner: Inner
+    optional: Inner | None = None
+    items: list[Inner]
+    by_id: dict[int, list[Inner]]
+
+
+def test_construct_media() -> None:
+    """Media constructed from its dump equals the validated media."""
+    media = Media(
+        media=NewAVFile(
+            file=NewLocalDiskFile(mime_type="video/mp4", fullpath="/a.mp4", st_mtime_ns=1, size=2),
+            hash="hash",
+            data_hash=None,
+            metadata={"title": "a", "rating": 1.5, "flag": True},
+        ),
+        xmp_sidecar=NewXMPDiskFile(
+            file=NewLocalDiskFile(mime_type=None, fullpath="/a.xmp", st_mtime_ns=1, size=2),
+            metadata={"XMP:Rating": "5"},
+        ),
+    )
+    data = json.loads(json.dumps(media.model_dump()))
+    assert construct(Media, data) == Media(**data) == media
+
+
+def test_construct_nested() -> None:
+    """Nested models, defaults and integer keys are rebuilt."""
+    outer = Outer(inner=Inner(value=1), items=[Inner(value=2, other="x")], by_id={3: [Inner(value=3)]})
+    data = json.loads(json.dumps(outer.model_dump()))
+    result = construct(Outer, data)
+    assert result == outer
+    assert isinstance(result.by_id[3][0], Inner)
+
+
+def test_construct_missing_field() -> None:
+    """A missing required field is an error."""
+    with pytest.raises(TrustedLoadError):
+        construct(Inner, {"other": "x"})
+
+
+def test_construct_unsupported() -> None:
+    """Unsupported annotations are rejected."""
+
+    class Unsupported(BaseModel):
+        value: bytes
+
+    with pytest.raises(TypeError):
+        construct(Unsupported, {"value": b""})
+
+
+def test_construct_int_keys() -> None:
+    """Integer keys of dictionaries of plain values are converted back from strings."""
+
+    class Counts(BaseModel):
+        by_id: dict[int, str]
+
+    counts = Counts(by_id={1: "a"})
+    assert construct(Counts, json.loads(json.dumps(counts.model_dump()))) == counts
+
+
+def test_construct_callable_discriminator() -> None:
+    """Unions discriminated by a callable are rejected, to be validated instead."""
+
+    class A(BaseModel):
+        kind: Literal["a"] = "a"
+
+    class B(BaseModel):
+        kind: Literal["b"] = "b"
+
+    class Tagged(BaseModel):
+        value: Annotated[Annotated[A, Tag("a")] | Annotated[B, Tag("b")], Discriminator(lambda v: v["kind"])]
+
+    with pytest.raises(TypeError, match="discriminator"):
+        construct(Tagged, {"value": {"kind": "a"}})
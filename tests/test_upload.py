@@ -0,0 +1,303 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the upload of local media files."""
+
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from base64 import b64decode, b64encode
+from http import HTTPStatus
+from itertools import count
+from pathlib import Path
+from typing import Any
+
+import httpx
+import pytest
+from nacl.secret import SecretBox
+from nacl.utils import random
+from PIL import Image
+
+from ente_tools.api.core.api import EnteAPI
+from ente_tools.api.core.ente_crypt import (
+    CHUNK_SIZE,
+    StreamEncryptionSize,
+    decrypt_blob,
+    decrypt_stream,
+    encrypt_stream,
+    encrypted_size,
+)
+from ente_tools.api.core.retry import Retrier
+from ente_tools.api.core.types_file import File
+from ente_tools.api.photo.loader import hash_file
+from ente_tools.api.photo.planner import normalize_hash
+from ente_tools.api.photo.upload import Uploader, UploadError, local_hashes, media_files, plan_uploads
+
+from .ente_fake import make_remote
+
+
+class UploadServer:
+    """A stand-in for the upload endpoints of the API and for the object storage.
+
+    The first `fail_puts` uploads to the storage are answered as unavailable.
+    """
+
+    def __init__(self, fail_puts: int = 0) -> None:
+        """Start with no objects."""
+        self.fail_puts = fail_puts
+        self.objects: dict[str, bytes] = {}
+        self.parts: dict[str, dict[int, bytes]] = {}
+        self.files: list[dict[str, Any]] = []
+        """The requests registering files."""
+        self.added: list[dict[str, Any]] = []
+        """The requests adding existing files to collections."""
+        self.completed: list[str] = []
+        """The keys of the objects uploaded in parts."""
+        self._keys = count(1)
+        self._lock = threading.Lock()
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        """Handle a request to the API or to the storage."""
+        url = request.url
+        if url.host == "api.test":
+            return self.api(request)
+        key = url.path.lstrip("/")
+        if request.method == "PUT":
+            with self._lock:
+                if self.fail_puts:
+                    self.fail_puts -= 1
+                    return httpx.Response(HTTPStatus.SERVICE_UNAVAILABLE)
+                if "partNumber" in url.params:
+                    self.parts[key][int(url.params["partNumber"])] = request.content
+                else:
+                    self.objects[key] = request.content
+            return httpx.Response(HTTPStatus.OK, headers={"ETag": f'"{hashlib.blake2b(request.content).hexdigest()}"'})
+        # Completion of a multipart upload, checking the parts are the uploaded ones
+        body = request.content.decode()
+        parts = [
+            (int(n), etag) for (n, etag) in re.findall(r"<PartNumber>(\d+)</PartNumber><ETag>([^<]*)</ETag>", body)
+        ]
+        uploaded = self.parts.pop(key)
+        assert [n for (n, _) in parts] == sorted(uploaded)
+        assert all(etag == f'"{hashlib.blake2b(uploaded[n]).hexdigest()}"' for (n, etag) in parts)
+        self.objects[key] = b"".join(uploaded[n] for (n, _) in parts)
+        self.completed.append(key)
+        return httpx.Response(HTTPStatus.OK)
+
+    def api(self, request: httpx.Request) -> httpx.Response:
+        """Handle a request to the API."""
+        path = request.url.path
+        if path == "/files/upload-urls":
+            keys = [f"object-{next(self._keys)}" for _ in range(int(request.url.params["count"]))]
+            return httpx.Response(
+                HTTPStatus.OK,
+                json={"urls": [{"objectKey": k, "url": f"https://storage.test/{k}"} for k in keys]},
+            )
+        if path == "/files/multipart-upload-urls":
+            k = f"object-{next(self._keys)}"
+            self.parts[k] = {}
+            return httpx.Response(
+                HTTPStatus.OK,
+                json={
+                    "urls": {
+                        "objectKey": k,
+                        "partURLs": [
+                            f"https://storage.test/{k}?partNumber={n}"
+                            for n in range(1, int(request.url.params["count"]) + 1)
+                        ],
+                        "completeURL": f"https://storage.test/{k}?complete",
+                    },
+                },
+            )
+        if path == "/collections/add-files":
+            self.added.append(json.loads(request.content))
+            return httpx.Response(HTTPStatus.OK)
+        assert path == "/files"
+        file = json.loads(request.content)
+        with self._lock:
+            self.files.append(file)
+            file_id = len(self.files)
+        return httpx.Response(
+            HTTPStatus.OK,
+            json=file
+            | {
+                "id": file_id,
+                "ownerID": 1,
+                "collectionOwnerID": 1,
+                "isDeleted": False,
+                "updationTime": 1,
+            },
+        )
+
+
+def make_api(server: UploadServer) -> EnteAPI:
+    """Return an API client of the stand-in server, retrying without waiting."""
+    return EnteAPI(
+        pkg="test",
+        api_url="https://api.test",
+        api_account_url="https://accounts.test",
+        api_download_url="https://files.test/?fileID=",
+        transport=httpx.MockTransport(server.handle),
+        retry=Retrier(rng=lambda: 0, sleep=lambda _: None),
+    )
+
+
+def write_image(path: Path, padding: int = 0) -> Path:
+    """Write an image, padded with random bytes to make it large."""
+    Image.new("RGB", (1000, 600), color="blue").save(path)
+    with path.open("ab") as f:
+        f.write(os.urandom(padding))
+    return path
+
+
+def test_encrypted_size() -> None:
+    """The size of encrypted content is known before encrypting it."""
+    for size in (0, 1, StreamEncryptionSize, StreamEncryptionSize + 1):
+        chunks = [bytes(size)[i : i + StreamEncryptionSize] for i in range(0, size, StreamEncryptionSize)]
+        (_, encrypted) = encrypt_stream(random(32), iter(chunks))
+        assert sum(len(c) for c in encrypted) == encrypted_size(size)
+
+
+def test_upload(tmp_path: Path) -> None:
+    """Files are uploaded encrypted, in parts when large, and registered in the collection."""
+    large = write_image(tmp_path / "large.jpg", padding=StreamEncryptionSize + 1000)
+    small = write_image(tmp_path / "small.jpg")
+    server = UploadServer(fail_puts=1)
+    api = make_api(server)
+    collection_key = random(SecretBox.KEY_SIZE)
+    uploaded: list[int] = []
+    uploader = Uploader(api, 5, collection_key, chunks_per_part=1, workers=2, progress=uploaded.append)
+
+    report = uploader.upload([large, small])
+    assert sorted(report.uploaded) == sorted([str(large), str(small)])
+    assert report.failed == {}
+    assert report.size == sum(uploaded) == sum(len(o) for o in server.objects.values())
+    assert api.retry.stats["upload"].retries == 1
+
+    for request in server.files:
+        assert request["collectionID"] == 5  # noqa: PLR2004
+        key = SecretBox(collection_key).decrypt(
+            b64decode(request["encryptedKey"]),
+            b64decode(request["keyDecryptionNonce"]),
+        )
+        metadata = json.loads(
+            decrypt_blob(
+                b64decode(request["metadata"]["encryptedData"]),
+                b64decode(request["metadata"]["decryptionHeader"]),
+                key,
+            ),
+        )
+        path = tmp_path / metadata["title"]
+        assert normalize_hash(metadata["hash"]) == hash_file(str(path))
+        assert metadata["fileType"] == 0
+
+        data = server.objects[request["file"]["objectKey"]]
+        assert len(data) == request["file"]["size"]
+        chunks = [data[i : i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+        assert b"".join(decrypt_stream(key, b64decode(request["file"]["decryptionHeader"]), chunks)) == (
+            path.read_bytes()
+        )
+
+        thumbnail = decrypt_blob(
+            server.objects[request["thumbnail"]["objectKey"]],
+            b64decode(request["thumbnail"]["decryptionHeader"]),
+            key,
+        )
+        with Image.open(io.BytesIO(thumbnail)) as img:
+            assert img.format == "JPEG"
+            assert max(img.size) == 720  # noqa: PLR2004
+
+    # The large file was uploaded in two parts
+    assert len(server.objects) == 2 * 2
+
+
+def test_upload_file(tmp_path: Path) -> None:
+    """A large file uploaded on its own is still uploaded in parts."""
+    large = write_image(tmp_path / "large.jpg", padding=StreamEncryptionSize + 1000)
+    server = UploadServer()
+    uploader = Uploader(make_api(server), 5, random(SecretBox.KEY_SIZE), chunks_per_part=1)
+
+    file = uploader.upload_file(large)
+    assert server.completed == [server.files[0]["file"]["objectKey"]]
+    assert file.id == 1
+
+
+def test_upload_media_files(tmp_path: Path) -> None:
+    """Directories are uploaded with their media files, and files failing to upload are reported."""
+    (tmp_path / "album").mkdir()
+    image = write_image(tmp_path / "album" / "image.png")
+    (tmp_path / "album" / "notes.txt").write_text("notes")
+    assert media_files([tmp_path / "album", image]) == [image]
+
+    server = UploadServer(fail_puts=100)
+    uploader = Uploader(make_api(server), 5, random(SecretBox.KEY_SIZE))
+    report = uploader.upload([image])
+    assert list(report.failed) == [str(image)]
+    assert server.files == []
+
+    with pytest.raises(UploadError, match="does not exist"):
+        media_files([tmp_path / "missing"])
+
+
+def test_plan_uploads(tmp_path: Path) -> None:
+    """Content already in the account is not uploaded again, but added from a file the user owns."""
+    paths = [write_image(tmp_path / f"{i}.png", padding=i) for i in range(5)]
+    duplicate = tmp_path / "copy.png"
+    duplicate.write_bytes(paths[0].read_bytes())
+    hashes = local_hashes([*paths, duplicate], [])
+    assert hashes[duplicate] == hashes[paths[0]] == hash_file(str(paths[0]))
+
+    def remote(file_id: int, path: Path, collection_id: int, owner_id: int = 1) -> File:
+        file_hash = str(b64encode(hashlib.blake2b(path.read_bytes()).digest()), "utf-8")
+        file = make_remote(file_id, file_hash, owner_id=owner_id).file
+        return file.model_copy(update={"collection_id": collection_id})
+
+    remote_files = [
+        remote(10, paths[0], 5),
+        remote(11, paths[0], 6),
+        remote(12, paths[1], 6),
+        remote(13, paths[2], 6, owner_id=2),
+        remote(14, paths[3], 5).model_copy(update={"is_deleted": True}),
+    ]
+    plan = plan_uploads(hashes, remote_files, 5, 1)
+    assert plan.present == {paths[0]: 10}
+    assert {p: f.id for (p, f) in plan.adds.items()} == {paths[1]: 12}
+    # Files shared with the user, and deleted files, are not reused
+    assert plan.uploads == [paths[2], paths[3], paths[4]]
+    assert plan.duplicates == {duplicate: paths[0]}
+
+
+def test_upload_adds(tmp_path: Path) -> None:
+    """Files are added to the collection with their key encrypted with the collection key."""
+    server = UploadServer()
+    collection_key = random(SecretBox.KEY_SIZE)
+    uploader = Uploader(make_api(server), 5, collection_key)
+    uploader.AddBatchSize = 2
+    keys = {tmp_path / f"{i}.png": (i, random(SecretBox.KEY_SIZE)) for i in range(3)}
+
+    assert uploader.add(keys) == {str(p): i for (p, (i, _)) in keys.items()}
+    assert [len(r["files"]) for r in server.added] == [2, 1]
+    assert server.objects == {}
+    added = {f["id"]: f for r in server.added for f in r["files"]}
+    for file_id, key in keys.values():
+        assert (
+            SecretBox(collection_key).decrypt(
+                b64decode(added[file_id]["encryptedKey"]),
+                b64decode(added[file_id]["keyDecryptionNonce"]),
+            )
+            == key
+        )
+    assert all(r["collectionID"] == 5 for r in server.added)  # noqa: PLR2004
@@ -0,0 +1,82 @@
+# Copyright 2025 Mark Scannell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the atomic writes of downloaded files."""
+
+import hashlib
+import os
+from base64 import b64encode
+from pathlib import Path
+
+import pytest
+from nacl.utils import random
+
+from ente_tools.api.core.ente_crypt import EnteCryptError, StreamEncryptionSize
+from ente_tools.api.core.types_file import FileInfo
+from ente_tools.api.core.writer import AtomicFileWriter, FsyncPolicy, HashMismatchError
+from ente_tools.api.photo.loader import hash_file
+
+from .ente_fake import RangeServer, encrypt, make_api, make_file
+
+
+def test_writer(tmp_path: Path) -> None:
+    """The destination appears with the whole content only once committed."""
+    dest = tmp_path / "file.bin"
+    data = os.urandom(3 * 1024 * 1024 + 100)
+    with AtomicFileWriter(dest, size=len(data) + 5000, fsync=FsyncPolicy.FULL) as f:
+        for i in range(0, len(data), 700_000):
+            f.write(data[i : i + 700_000])
+        assert not dest.exists()
+        f.commit()
+
+    assert dest.read_bytes() == data
+    assert f.hash == hash_file(str(dest))
+    assert [p.name for p in tmp_path.iterdir()] == ["file.bin"]
+
+
+def test_writer_discards(tmp_path: Path) -> None:
+    """Content that fails or does not match its hash leaves nothing behind."""
+    dest = tmp_path / "file.bin"
+
+    def write(expected_hash: str | None, error: Exception | None = None) -> None:
+        with AtomicFileWriter(dest, expected_hash=expected_hash) as f:
+            f.write(b"content")
+            if error is not None:
+                raise error
+            f.commit()
+
+    with pytest.raises(HashMismatchError):
+        write("wrong")
+    with pytest.raises(ValueError, match="failed"):
+        write(None, ValueError("failed"))
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_download_file(tmp_path: Path) -> None:
+    """Downloads are verified before they are renamed into place."""
+    key = random(32)
+    plaintext = os.urandom(StreamEncryptionSize + 1000)
+    (header, data) = encrypt(plaintext, key, StreamEncryptionSize)
+    file = make_file(header, info=FileInfo(fileSize=len(data), thumbSize=0))
+    expected = str(b64encode(hashlib.blake2b(plaintext).digest()), "utf-8")
+    dest = tmp_path / "file.bin"
+
+    assert make_api(RangeServer(data)).download_file(file, key, dest, expected_hash=expected) == hash_file(str(dest))
+    assert dest.read_bytes() == plaintext
+
+    # A truncated download never appears under its name
+    dest.unlink()
+    with pytest.raises(EnteCryptError):
+        make_api(RangeServer(data[: StreamEncryptionSize + 17])).download_file(file, key, dest)
+    assert list(tmp_path.iterdir()) == []